@@ -1,11 +1,14 @@
 import asyncio
+from collections import Counter
+import csv
 from datetime import datetime
+from itertools import islice
 import logging
-import re
+import os
+import tempfile
 import textwrap
-from typing import Any, Awaitable, Callable, Dict, Optional
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
 from urllib.parse import urlparse
-import aiohttp
 from maxapi import Bot, Dispatcher, F
 from maxapi.context import StatesGroup, State, MemoryContext
 from maxapi.enums.parse_mode import ParseMode
@@ -13,6 +16,7 @@ from maxapi.enums.attachment import AttachmentType
 from maxapi.enums.chat_type import ChatType
 from maxapi.filters.middleware import BaseMiddleware
 from maxapi.types import (
+    InputMedia,
     Message,
     Command,
     BotStarted,
@@ -29,14 +33,58 @@ from handlers.callbacks import handle_complete_conversation
 from handlers.commands import handle_check
 from handlers.groups import add_message_to_group_conversation
 from handlers.privates import add_message_to_private_conversation
-from leaks_aggregator import search_leaks, shutdown_all_clients
-from services.ai_analyzer import init_ai_analyzer
-from services.balance_checker import init_balance_checker
-from virus_checker import check_link, check_file, exit_vt_client
+from handlers.utils import extract_message_text
+from leaks_aggregator import (
+    CheckItem,
+    LeakInfo,
+    LeakSearchResult,
+    parse_bulk_lines,
+    search_leaks,
+    search_leaks_bulk,
+)
+from services.ai_analyzer import close_ai_analyzer, init_ai_analyzer
+from services.attachments import (
+    AttachmentDownloadError,
+    AttachmentTooLarge,
+    DownloadedAttachment,
+    download_attachment,
+)
+from services.link_extractor import extract_links
+from services.balance_checker import get_balance_checker, init_balance_checker
+from services.breach_catalog import close_breach_catalog, setup_breach_catalog
+from services.http import close_http_clients, warm_up_http_clients
+from services.pwned_passwords import close_offline_index
+from services.metrics import format_metrics
+from services.archive_scanner import is_archive_name
+from services.vt_scheduler import PRIORITY_BACKGROUND
+from virus_checker import (
+    FileVerdict,
+    LinkVerdict,
+    canonical_url,
+    check_archive,
+    check_file,
+    check_links,
+    exit_vt_client,
+    file_report_url,
+    get_file_report,
+    quick_link_verdict,
+    setup_group_scanner,
+    upload_file,
+    vt_queue_position,
+    vt_queue_wait,
+)
 from config import settings
 
 dp = Dispatcher()
 
+QUEUE_NOTICE_DELAY = 1.0
+MAX_REPORT_BUTTONS = 5
+BULK_LEAK_EXTENSIONS = (".txt", ".csv")
+MAX_SUMMARY_BREACHES = 5
+BULK_READ_BATCH = 100
+
+_BULK_LEAK_CHECKS: set[int] = set()
+
 
 class IgnoreOldUpdatesMiddleware(BaseMiddleware):
     def __init__(self):
@@ -124,6 +172,7 @@ async def bot_added_to_chat(event: BotAdded):
                 
                 **/start** — Основное меню
                 **/help** — Подсказки по командам
+                **/autoscan on** — Автоматически проверять все ссылки и файлы в чате (для администраторов)
                 """
             ),
             parse_mode=ParseMode.MARKDOWN,
@@ -140,12 +189,69 @@ async def send_help_message(event: MessageCreated):
             * **/start** — Показать главное меню с основными функциями (проверка утечек, анализ сообщений).
             * **/help** | **/справка** — Показать это сообщение.
             * **Проверка ссылки/файла** — Просто отправь мне их в чат, я проверю на вирусы! 🦠
+            * **/autoscan on** | **off** — В группе: автоматически проверять все ссылки и файлы (только для администраторов).
             """
         ),
         parse_mode=ParseMode.MARKDOWN,
     )
 
 
+@dp.message_created(Command("stats"))
+async def send_stats_message(event: MessageCreated):
+    if event.message.sender.user_id not in settings.ADMIN_USER_IDS:
+        return
+    await event.message.reply(text=format_metrics())
+
+
+@dp.message_created(Command("autoscan"))
+async def toggle_group_autoscan(event: MessageCreated, args: List[str]):
+    if not event.chat or event.chat.type != ChatType.CHAT:
+        await event.message.reply(
+            text="ℹ️ Автопроверка ссылок и файлов работает только в групповых чатах."
+        )
+        return
+
+    chat_id = event.chat.chat_id
+    scanner = setup_group_scanner()
+    action = args[0].lower() if args else ""
+    if action not in ("on", "off", "вкл", "выкл"):
+        status = "включена ✅" if scanner.is_enabled(chat_id) else "выключена"
+        await event.message.reply(
+            text=f"🛡️ Автопроверка в этом чате {status}.\n\n"
+            "**/autoscan on** — проверять все ссылки и файлы в чате\n"
+            "**/autoscan off** — выключить автопроверку\n\n"
+            "*Я напишу только если найду что-то опасное.*"
+        )
+        return
+
+    user_id = event.message.sender.user_id
+    if not await is_chat_admin(event.bot, chat_id, user_id):
+        await event.message.reply(
+            text="⚠️ Включать и выключать автопроверку могут только администраторы чата."
+        )
+        return
+
+    enabled = action in ("on", "вкл")
+    await scanner.set_enabled(chat_id, user_id, enabled)
+    await event.message.reply(
+        text=(
+            "✅ Автопроверка включена. Буду проверять ссылки и файлы в чате "
+            "и предупреждать, если найду угрозы."
+            if enabled
+            else "⏹ Автопроверка выключена."
+        )
+    )
+
+
+async def is_chat_admin(bot: Bot, chat_id: int, user_id: int) -> bool:
+    try:
+        member = await bot.get_chat_member(chat_id=chat_id, user_id=user_id)
+    except Exception as e:
+        logging.error(f"Не удалось получить участника чата {chat_id}: {e}")
+        return False
+    return bool(member and (member.is_admin or member.is_owner))
+
+
 @dp.message_created(Command("check"))
 async def check_command(event: MessageCreated, context: MemoryContext):
     await handle_check(event, context)
@@ -157,6 +263,8 @@ async def message_callback(event: MessageCallback, context: MemoryContext):
     await event.message.answer(
         "🔎 **Отлично! Готовимся проверить данные на утечки.**\n\n"
         "Пришлите мне то, что нужно проверить: **адрес почты, номер телефона, логин или даже пароль**.\n\n"
+        "Чтобы проверить сразу много адресов и телефонов (например, всех сотрудников), "
+        "пришлите их **файлом .txt или .csv** — по одному значению в строке.\n\n"
         "Я ищу только совпадения в общедоступных базах утечек. Ваши данные **не сохраняются**! 😉"
     )
 
@@ -178,6 +286,44 @@ def create_data_leak_check_kb() -> Attachment:
     ).pack()
 
 
+@dp.message_created(
+    F.message.body.attachments[0].type == AttachmentType.FILE,
+    S.wait_for_leaks_check_data,
+)
+async def check_file_for_leaks(event: MessageCreated, context: MemoryContext):
+    file_info = event.message.body.attachments[0]  # type: ignore
+    filename = file_info.filename or ""
+    if not filename.lower().endswith(BULK_LEAK_EXTENSIONS):
+        await event.message.reply(
+            "⚠️ Для массовой проверки пришлите список **файлом .txt или .csv** — "
+            "по одному email, телефону или логину в строке."
+        )
+        return
+
+    user_id = event.message.sender.user_id
+    if user_id in _BULK_LEAK_CHECKS:
+        await event.message.reply(
+            "⏳ Предыдущий список ещё проверяется. Дождитесь отчёта, пожалуйста."
+        )
+        return
+
+    try:
+        attachment = await download_attachment(file_info.payload.url, filename)
+    except AttachmentTooLarge:
+        await reply_file_too_large(event.message)
+        return
+    except AttachmentDownloadError as e:
+        logging.error(f"Не удалось скачать список для проверки утечек: {e}")
+        await event.message.reply(
+            text="❌ Ой! Не удалось получить файл. Пожалуйста, попробуйте отправить его еще раз. 🙏"
+        )
+        return
+
+    await context.clear()
+    _BULK_LEAK_CHECKS.add(user_id)
+    asyncio.create_task(bulk_check_leaks_and_send_report(event.message, attachment))
+
+
 @dp.message_created(F.message.body.text, S.wait_for_leaks_check_data)
 async def check_data_for_leaks(event: MessageCreated, context: MemoryContext):
     await event.message.answer(
@@ -193,26 +339,27 @@ async def check_file_for_viruses(event: MessageCreated):
         if event.message.body.attachments:
             requested_file = event.message.body.attachments[0]
             if requested_file.type == AttachmentType.FILE:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(requested_file.payload.url) as resp:  # type: ignore
-                        if not resp.ok:
-                            await event.message.reply(
-                                text="❌ Ой! Не удалось получить файл для проверки. Пожалуйста, попробуйте отправить его еще раз. 🙏"
-                            )
-                            return
-                        temp_file_name = (
-                            f"temp_file_{event.message.sender.user_id}"
-                            + ("." + requested_file.filename.split(".")[-1])
-                            if requested_file.filename
-                            else ""
-                        )
-                        with open(temp_file_name, "wb") as temp_file:
-                            async for chunk in resp.content.iter_chunked(1024):
-                                temp_file.write(chunk)
+                if (requested_file.size or 0) > settings.VT_MAX_FILE_SIZE:
+                    await reply_file_too_large(event.message)
+                    return
+                try:
+                    attachment = await download_attachment(
+                        requested_file.payload.url,  # type: ignore
+                        requested_file.filename,
+                    )
+                except AttachmentTooLarge:
+                    await reply_file_too_large(event.message)
+                    return
+                except AttachmentDownloadError as e:
+                    logging.error(f"Не удалось скачать вложение: {e}")
+                    await event.message.reply(
+                        text="❌ Ой! Не удалось получить файл для проверки. Пожалуйста, попробуйте отправить его еще раз. 🙏"
+                    )
+                    return
                 await event.message.reply(
                     "📥 Получил ваш файл. Запускаю глубокую проверку на угрозы... ⏳"
                 )
-                await scan_and_send_result(event.message, temp_file_name)
+                await scan_and_send_result(event.message, attachment)
             else:
                 await event.message.reply(
                     text="⚠️ Я могу проверять только файлы. Пожалуйста, пришлите **один** файл."
@@ -221,22 +368,42 @@ async def check_file_for_viruses(event: MessageCreated):
             await event.message.reply(
                 text="⚠️ Пожалуйста, пришлите файл. Если это изображение, выберите опцию **«Отправить как файл»**, а не как фото."
             )
+    elif event.chat and event.chat.type == ChatType.CHAT:
+        if setup_group_scanner().is_enabled(event.chat.chat_id):
+            asyncio.create_task(passive_scan_file(event.message, event.chat.chat_id))
+
+
+async def reply_file_too_large(message: Message) -> None:
+    await message.reply(
+        text=f"⚠️ Файл слишком большой. Я могу проверить файлы размером до "
+        f"{settings.VT_MAX_FILE_SIZE // (1024 * 1024)} МБ."
+    )
 
 
 @dp.message_created(F.message.body.text)
+@dp.message_created(F.message.link.message.text)
 async def check_link_for_viruses(event: MessageCreated, context: MemoryContext):
     if event.chat and event.chat.type == ChatType.DIALOG:
         user_data = await context.get_data()
         if user_data.get("is_collecting"):
             await add_message_to_private_conversation(
-                event, context, event.message.body.text
+                event, context, extract_message_text(event.message)
             )
             return
-        if is_online_link(event.message.body.text):
+        links = extract_message_links(event.message)
+        if links:
+            verdicts = [await quick_link_verdict(link) for link in links]
+            if all(verdicts):
+                await send_link_verdicts(event.message, verdicts)  # type: ignore
+                return
             await event.message.reply(
-                text="🔗 Получил вашу ссылку. Быстро проверяю её на вирусы и фишинг... ⏳"
+                text=(
+                    "🔗 Получил вашу ссылку. Быстро проверяю её на вирусы и фишинг... ⏳"
+                    if len(links) == 1
+                    else f"🔗 Нашёл ссылок: {len(links)}. Проверяю их все на вирусы и фишинг... ⏳"
+                )
             )
-            asyncio.create_task(scan_and_send_result(event.message))
+            asyncio.create_task(scan_links_and_send_result(event.message, links))
         else:
             await event.message.reply(
                 text="🤔 Хм, я не могу распознать это как онлайн-ссылку (URL). Пожалуйста, убедитесь, что это полная ссылка, которую можно открыть в браузере."
@@ -247,21 +414,23 @@ async def check_link_for_viruses(event: MessageCreated, context: MemoryContext):
             session_owner = user_data.get("session_owner")
             if event.from_user and session_owner == event.from_user.user_id:
                 await add_message_to_group_conversation(
-                    event, context, event.message.body.text
+                    event, context, extract_message_text(event.message)
                 )
             return
+        if setup_group_scanner().is_enabled(event.chat.chat_id):
+            asyncio.create_task(passive_scan_links(event.message, event.chat.chat_id))
 
 
-def create_scan_result_kb(scan_id: str | None = None) -> Attachment:
+def create_scan_result_kb(report_url: str | None = None) -> Attachment:
     return ButtonsPayload(
         buttons=[
             [
                 (
                     LinkButton(
                         text="Полный отчет VirusTotal 📄",
-                        url=f"https://www.virustotal.com/gui/file-analysis/{scan_id}",
+                        url=report_url,
                     )
-                    if scan_id
+                    if report_url
                     else LinkButton(
                         text="Проверить на Virustotal (вручную) 🌐",
                         url="https://www.virustotal.com",
@@ -272,11 +441,304 @@ def create_scan_result_kb(scan_id: str | None = None) -> Attachment:
     ).pack()
 
 
-async def scan_and_send_result(message: Message, filepath: str | None = None) -> None:
-    if filepath:
-        id, result = await check_file(filepath)
-    else:
-        id, result = await check_link(message.body.text)
+def extract_message_links(message: Message) -> List[str]:
+    """Все ссылки из текста сообщения, пересланного сообщения и разметки MAX."""
+    bodies = [message.body]
+    if message.link:
+        bodies.append(message.link.message)
+
+    return extract_links(
+        texts=[body.text for body in bodies],
+        markup_urls=[
+            getattr(markup, "url", None)
+            for body in bodies
+            for markup in body.markup or []
+        ],
+    )
+
+
+async def scan_links_and_send_result(message: Message, links: List[str]) -> None:
+    user_id = message.sender.user_id
+    scan = asyncio.create_task(check_links(links, user_id=user_id))
+
+    try:
+        await notify_queue_position(message, scan, user_id)
+        verdicts = await scan
+    except Exception as e:
+        logging.error(f"Ошибка проверки ссылок: {e}")
+        await send_scan_result(message, None, None)
+        return
+    await send_link_verdicts(message, verdicts)
+
+
+async def send_link_verdicts(message: Message, verdicts: List[LinkVerdict]) -> None:
+    """Один ответ на сообщение: подробный для одной ссылки, сводный для нескольких."""
+    if len(verdicts) == 1:
+        verdict = verdicts[0]
+        if verdict.local_verdict:
+            await send_local_verdict(message, verdict.local_verdict)
+        else:
+            await send_scan_result(message, verdict.report_url, verdict.stats)
+        return
+
+    lines = [describe_link_verdict(verdict) for verdict in verdicts]
+    dangerous = sum(verdict.is_dangerous for verdict in verdicts)
+    summary = (
+        f"🚨 **Опасных ссылок: {dangerous}.** **НЕ ОТКРЫВАЙТЕ** ссылки, отмеченные 🚨 и ⚠️!"
+        if dangerous
+        else "✅ Угроз не найдено. Всё равно будьте внимательны к адресам сайтов."
+    )
+    await message.reply(
+        text=f"🔎 **Проверил ссылок: {len(verdicts)}**\n\n"
+        + "\n".join(lines)
+        + f"\n\n{summary}",
+        attachments=[create_link_reports_kb(verdicts)],
+    )
+
+
+def create_reports_kb(reports: List[Tuple[str, Optional[str]]]) -> Attachment:
+    """Кнопки отчётов VirusTotal (название, ссылка) или кнопка ручной проверки."""
+    buttons = [
+        [LinkButton(text=f"Отчет: {title} 📄", url=report_url)]
+        for title, report_url in reports
+        if report_url
+    ][:MAX_REPORT_BUTTONS]
+    if not buttons:
+        return create_scan_result_kb()
+    return ButtonsPayload(buttons=buttons).pack()
+
+
+def create_link_reports_kb(verdicts: List[LinkVerdict]) -> Attachment:
+    return create_reports_kb(
+        [(str(urlparse(v.link).hostname), v.report_url) for v in verdicts]
+    )
+
+
+def describe_link_verdict(verdict: LinkVerdict) -> str:
+    link = verdict.link
+    if verdict.source == "error":
+        return f"❔ {link} — не удалось проверить"
+    if verdict.local_verdict == "malicious":
+        return f"🚨 {link} — в базе фишинговых и вредоносных сайтов"
+    if verdict.local_verdict == "clean":
+        return f"✅ {link} — известный популярный сайт"
+
+    stats = verdict.stats or {}
+    if stats.get("malicious", 0):
+        return f"🚨 {link} — опасно (антивирусов: {stats['malicious']})"
+    if stats.get("suspicious", 0):
+        return f"⚠️ {link} — подозрительно (антивирусов: {stats['suspicious']})"
+    return f"✅ {link} — угроз не найдено"
+
+
+async def scan_and_send_result(
+    message: Message, attachment: DownloadedAttachment
+) -> None:
+    if is_archive_name(attachment.filename):
+        await scan_archive_and_send_result(message, attachment)
+        return
+
+    user_id = message.sender.user_id
+    scan = asyncio.create_task(
+        check_file(attachment.file, attachment.sha256, user_id=user_id)
+    )
+
+    try:
+        await notify_queue_position(message, scan, user_id)
+        report_url, result = await scan
+    except Exception as e:
+        logging.error(f"Ошибка проверки VirusTotal: {e}")
+        report_url, result = None, None
+    finally:
+        attachment.close()
+    await send_scan_result(message, report_url, result)
+
+
+async def scan_archive_and_send_result(
+    message: Message, attachment: DownloadedAttachment
+) -> None:
+    user_id = message.sender.user_id
+    scan = asyncio.create_task(
+        check_archive(
+            attachment.file,
+            attachment.sha256,
+            attachment.filename,
+            attachment.size,
+            user_id=user_id,
+        )
+    )
+
+    try:
+        await notify_queue_position(message, scan, user_id)
+        verdicts = await scan
+    except Exception as e:
+        logging.error(f"Ошибка проверки архива: {e}")
+        await send_scan_result(message, None, None)
+        return
+    finally:
+        attachment.close()
+    await send_archive_verdicts(message, attachment.filename, verdicts)
+
+
+async def send_archive_verdicts(
+    message: Message, filename: str, verdicts: List[FileVerdict]
+) -> None:
+    """Отчёт по архиву: подробный, если проверялся архив целиком, иначе сводный."""
+    if len(verdicts) == 1 and verdicts[0].name == filename:
+        await send_scan_result(message, verdicts[0].report_url, verdicts[0].stats)
+        return
+
+    dangerous = [verdict for verdict in verdicts if verdict.is_dangerous]
+    lines = [describe_file_verdict(verdict) for verdict in dangerous]
+    clean = len(verdicts) - len(dangerous)
+    if clean:
+        lines.append(f"✅ Остальные файлы ({clean}) — угроз не найдено")
+
+    summary = (
+        f"🚨 **Опасных файлов: {len(dangerous)}.** **НЕ ОТКРЫВАЙТЕ** архив!"
+        if dangerous
+        else "✅ Угроз не найдено ни в одном файле архива."
+    )
+    await message.reply(
+        text=f"📦 **Архив {filename}: проверено файлов: {len(verdicts)}**\n\n"
+        + "\n".join(lines)
+        + f"\n\n{summary}",
+        attachments=[
+            create_reports_kb(
+                [(v.name[-40:], v.report_url) for v in dangerous or verdicts]
+            )
+        ],
+    )
+
+
+def describe_file_verdict(verdict: FileVerdict) -> str:
+    stats = verdict.stats or {}
+    if stats.get("malicious", 0):
+        return f"🚨 {verdict.name} — опасно (антивирусов: {stats['malicious']})"
+    if stats.get("suspicious", 0):
+        return f"⚠️ {verdict.name} — подозрительно (антивирусов: {stats['suspicious']})"
+    return f"✅ {verdict.name} — угроз не найдено"
+
+
+async def passive_scan_links(message: Message, chat_id: int) -> None:
+    """
+    Фоновая проверка ссылок из группы с автопроверкой. Пишет в чат только
+    об опасных ссылках; повторы и ссылки сверх бюджета чата пропускаются.
+    """
+    scanner = setup_group_scanner()
+    verdicts: List[LinkVerdict] = []
+    to_scan: List[str] = []
+
+    for link in extract_message_links(message):
+        key = canonical_url(link)
+        if scanner.seen(chat_id, key):
+            continue
+        verdict = await quick_link_verdict(link)
+        if verdict:
+            scanner.mark_seen(chat_id, key)
+            verdicts.append(verdict)
+        elif scanner.admit(chat_id, key):
+            to_scan.append(link)
+
+    if to_scan:
+        try:
+            verdicts += await check_links(
+                to_scan, user_id=("chat", chat_id), priority=PRIORITY_BACKGROUND
+            )
+        except Exception as e:
+            logging.error(f"Ошибка автопроверки ссылок в чате {chat_id}: {e}")
+
+    dangerous = [verdict for verdict in verdicts if verdict.is_dangerous]
+    if dangerous:
+        await message.reply(
+            text="🚨 **Осторожно!** В этом сообщении опасные ссылки:\n\n"
+            + "\n".join(describe_link_verdict(verdict) for verdict in dangerous)
+            + "\n\n**НЕ ОТКРЫВАЙТЕ** их и не вводите там никаких данных!",
+            attachments=[create_link_reports_kb(dangerous)],
+        )
+
+
+async def passive_scan_file(message: Message, chat_id: int) -> None:
+    """
+    Фоновая проверка файла из группы с автопроверкой: поиск по хэшу, а загрузка
+    в VirusTotal — только если на неё хватает бюджета чата. Архивы целиком.
+    """
+    attachment_info = message.body.attachments[0]  # type: ignore
+    if (attachment_info.size or 0) > settings.VT_MAX_FILE_SIZE:
+        return
+
+    scanner = setup_group_scanner()
+    if not scanner.has_budget(chat_id):
+        return
+
+    try:
+        attachment = await download_attachment(
+            attachment_info.payload.url, attachment_info.filename
+        )
+    except (AttachmentTooLarge, AttachmentDownloadError) as e:
+        logging.error(f"Не удалось скачать вложение из чата {chat_id}: {e}")
+        return
+
+    # Пересланный файл приходит с новым токеном, поэтому повторы узнаются
+    # по содержимому, и бюджет чата тратится только на новые файлы.
+    user_id = ("chat", chat_id)
+    upload_key = f"upload:{attachment.sha256}"
+    try:
+        if not scanner.admit(chat_id, attachment.sha256):
+            return
+
+        report_url: Optional[str] = file_report_url(attachment.sha256)
+        stats = await get_file_report(
+            attachment.sha256, user_id=user_id, priority=PRIORITY_BACKGROUND
+        )
+        # Загрузка — два запроса к VirusTotal плюс опрос результата.
+        if stats is None and scanner.admit(chat_id, upload_key, cost=2):
+            report_url, stats = await upload_file(
+                attachment.file, user_id=user_id, priority=PRIORITY_BACKGROUND
+            )
+    except Exception as e:
+        logging.error(f"Ошибка автопроверки файла в чате {chat_id}: {e}")
+        # Временная ошибка VirusTotal не должна закрывать файл на всё окно.
+        scanner.forget(chat_id, attachment.sha256)
+        scanner.forget(chat_id, upload_key)
+        return
+    finally:
+        attachment.close()
+
+    verdict = FileVerdict(
+        name=attachment.filename or "файл",
+        sha256=attachment.sha256,
+        report_url=report_url,
+        stats=stats,
+    )
+    if verdict.is_dangerous:
+        await message.reply(
+            text="🚨 **Осторожно!** Файл в этом сообщении опасен:\n\n"
+            + describe_file_verdict(verdict)
+            + "\n\n**НЕ ОТКРЫВАЙТЕ** его!",
+            attachments=[create_scan_result_kb(verdict.report_url)],
+        )
+
+
+async def notify_queue_position(
+    message: Message, scan: asyncio.Task, user_id: int
+) -> None:
+    """Сообщает пользователю его место в очереди, если проверка не началась сразу."""
+    done, _ = await asyncio.wait({scan}, timeout=QUEUE_NOTICE_DELAY)
+    if done:
+        return
+
+    position = vt_queue_position(user_id)
+    if position and position > 1:
+        await message.reply(
+            text=f"⏳ Сейчас много проверок. Вы **#{position}** в очереди, "
+            f"ожидание примерно {int(vt_queue_wait(position)) + 1} сек."
+        )
+
+
+async def send_scan_result(
+    message: Message, report_url: str | None, result: Dict[str, int] | None
+) -> None:
     if result:
         await message.reply(
             text=textwrap.dedent(
@@ -294,7 +756,7 @@ async def scan_and_send_result(message: Message, filepath: str | None = None) ->
                 👉 Для максимально подробного анализа, включая отзывы и оценку десятков антивирусов, нажмите на **«Полный отчет VirusTotal»** 👇
                 """
             ),
-            attachments=[create_scan_result_kb(id)],
+            attachments=[create_scan_result_kb(report_url)],
         )
     else:
         await message.reply(
@@ -304,82 +766,301 @@ async def scan_and_send_result(message: Message, filepath: str | None = None) ->
         )
 
 
+async def send_local_verdict(message: Message, verdict: str) -> None:
+    if verdict == "malicious":
+        text = (
+            "🚨 **Опасная ссылка!** Этот адрес есть в базах фишинговых и вредоносных сайтов.\n\n"
+            "**НЕ ОТКРЫВАЙТЕ** ссылку и не вводите на ней никаких данных!"
+        )
+    else:
+        text = (
+            "✅ Ссылка ведёт на **известный популярный сайт**, угроз не найдено.\n\n"
+            "*Всё равно проверяйте, что адрес написан без ошибок и опечаток.*"
+        )
+    await message.reply(text=text, attachments=[create_scan_result_kb()])
+
+
+MAX_LEAK_DATA_CLASSES = 4
+
+
+def describe_leak(leak: LeakInfo) -> str:
+    date = leak.breach_date.strftime("%d.%m.%Y") if leak.breach_date else "Неизвестно"
+    text = f"💔 **Сервис:** {leak.site or "Неизвестно"} **Дата:** {date}"
+    if leak.records:
+        text += f" • {leak.records:,} записей".replace(",", " ")
+    if leak.data_classes:
+        text += " • утекли: " + ", ".join(leak.data_classes[:MAX_LEAK_DATA_CLASSES])
+    return text
+
+
 async def check_leaks_and_send_result(message: Message) -> None:
     result = await search_leaks(message.body.text)
-    if result:
+    partial_note = (
+        f"\n\n⚠️ *Не дождался ответа от: {', '.join(result.timed_out + result.failed)}. "
+        "Результат может быть неполным — попробуйте проверить ещё раз позже.*"
+        if result.is_partial
+        else ""
+    )
+    if result.leaks:
         await message.reply(
             text=textwrap.dedent(
                 f"""\
-                🚨 **ВНИМАНИЕ! Найдено {len(result)} утечек, связанных с вашими данными!** 😱
+                🚨 **ВНИМАНИЕ! Найдено {len(result.leaks)} утечек, связанных с вашими данными!** 😱
                 
                 Ваши данные **были скомпрометированы** в следующих случаях:
                 {
-                    "\n".join(map(lambda leak: f"💔 **Сервис:** {leak.site or "Неизвестно"} **Дата:** {leak.breach_date or "Неизвестно"}", result))
+                    "\n".join(map(describe_leak, result.leaks))
                 }
                 
                 **ЧТО ДЕЛАТЬ НЕМЕДЛЕННО?** 👇
                 1. Смените **все** пароли, которые вы использовали на указанных сайтах.
                 2. Включите **двухфакторную аутентификацию (2FA)** везде, где это возможно.
                 """
-            ),
+            )
+            + partial_note,
             parse_mode=ParseMode.MARKDOWN,
             attachments=[create_data_leak_check_kb()],
         )
+    elif not result.checked:
+        await message.reply(
+            "😔 **Не удалось проверить данные:** базы утечек сейчас не отвечают.\n\n"
+            "Пожалуйста, попробуйте еще раз через пару минут.",
+            attachments=[create_data_leak_check_kb()],
+        )
     else:
         await message.reply(
             "🥳 **Отличные новости!** Ваши данные **НЕ** найдены в общедоступных базах утечек!\n\n"
-            "Продолжайте соблюдать цифровую гигиену! 💪",
+            "Продолжайте соблюдать цифровую гигиену! 💪" + partial_note,
             attachments=[create_data_leak_check_kb()],
         )
 
 
-def is_online_link(url_string: str) -> Optional[str]:
+BULK_ITEM_TYPES = {
+    "Email": "email",
+    "Number": "телефон",
+    "Password_or_login": "логин/пароль",
+}
+
+
+def mask_secret(value: str) -> str:
+    """Пароль или логин в отчёте: видны только первый и последний символы."""
+    if len(value) <= 2:
+        return "*" * len(value)
+    return value[0] + "*" * (len(value) - 2) + value[-1]
+
+
+class BulkLeakReport:
     """
-    Проверяет, является ли строка валидной ссылкой (с протоколом или без).
-    Возвращает URL с https://, если всё корректно.
+    Итоги массовой проверки утечек: счётчики и CSV-отчёт во временном файле.
+    Строки отчёта копятся в памяти и дописываются в файл пачками через flush().
     """
-    if "://" not in url_string:
-        candidate = "https://" + url_string
-    else:
-        candidate = url_string
 
+    def __init__(self, path: str):
+        self.path = path
+        self._rows: List[List[Any]] = [
+            ["Значение", "Тип", "Статус", "Утечек", "Сервисы"]
+        ]
+
+        self.checked = 0
+        self.leaked = 0
+        self.partial = 0
+        self.failed = 0
+        self.breaches: Counter = Counter()
+
+    def add(self, item: CheckItem, result: LeakSearchResult) -> None:
+        self.checked += 1
+        if not result.checked:
+            self.failed += 1
+            status = "не проверено"
+        elif result.leaks:
+            self.leaked += 1
+            status = "найдено в утечках"
+        else:
+            status = "не найдено"
+        if result.checked and result.is_partial:
+            self.partial += 1
+            status += " (неполная проверка)"
+
+        sites = [leak.site or "Неизвестно" for leak in result.leaks]
+        self.breaches.update(site for site in sites if site != "Неизвестно")
+        value = (
+            mask_secret(item.value) if item.type == "Password_or_login" else item.value
+        )
+        self._rows.append(
+            [
+                value,
+                BULK_ITEM_TYPES.get(item.type or "", ""),
+                status,
+                len(result.leaks),
+                ", ".join(sites),
+            ]
+        )
+
+    async def flush(self) -> None:
+        rows, self._rows = self._rows, []
+        if rows:
+            await asyncio.to_thread(self._write_rows, rows)
+
+    def _write_rows(self, rows: List[List[Any]]) -> None:
+        with open(self.path, "a", newline="", encoding="utf-8-sig") as f:
+            csv.writer(f, delimiter=";").writerows(rows)
+
+    def summary(self, truncated: bool) -> str:
+        lines = [
+            "📋 **Массовая проверка завершена**\n",
+            f"Проверено значений: **{self.checked}**",
+            f"🚨 Найдены в утечках: **{self.leaked}**",
+        ]
+        if self.partial:
+            lines.append(f"⚠️ Проверены не всеми базами: {self.partial}")
+        if self.failed:
+            lines.append(f"❌ Не удалось проверить: {self.failed}")
+        if self.breaches:
+            top = self.breaches.most_common(MAX_SUMMARY_BREACHES)
+            lines.append(
+                "\nЧаще всего встречаются утечки: "
+                + ", ".join(f"{site} ({count})" for site, count in top)
+            )
+        if truncated:
+            lines.append(
+                f"\n⚠️ Проверены только первые {settings.LEAK_BULK_MAX_ITEMS} значений."
+            )
+        lines.append("\nПодробности по каждому значению — в файле отчёта 👇")
+        return "\n".join(lines)
+
+
+def count_lines(file) -> int:
+    file.seek(0)
+    total = sum(1 for _ in file)
+    file.seek(0)
+    return total
+
+
+async def bulk_check_leaks_and_send_report(
+    message: Message, attachment: DownloadedAttachment
+) -> None:
+    """
+    Проверяет список из файла: строки читаются и проверяются потоково,
+    прогресс обновляется в одном сообщении, в конце приходит CSV-отчёт.
+    """
+    user_id = message.sender.user_id
     try:
-        result = urlparse(candidate)
+        with tempfile.TemporaryDirectory(dir=settings.TMP_DIR) as tmp:
+            await run_bulk_leak_check(
+                message, attachment, os.path.join(tmp, "leaks_report.csv")
+            )
+    except Exception as e:
+        logging.error(f"Ошибка массовой проверки утечек: {e}")
+        await message.reply(
+            "😔 **Не удалось проверить список.** Пожалуйста, попробуйте еще раз позже.",
+            attachments=[create_data_leak_check_kb()],
+        )
+    finally:
+        attachment.close()
+        _BULK_LEAK_CHECKS.discard(user_id)
+
 
-        # Извлекаем домен
-        hostname = result.hostname
+async def run_bulk_leak_check(
+    message: Message, attachment: DownloadedAttachment, report_path: str
+) -> None:
+    total_lines = await asyncio.to_thread(count_lines, attachment.file)
+    lines_read = 0
 
-        is_valid = (
-            hostname is not None and re.match(r"^[a-zA-Z0-9.-]+$", hostname) is not None
+    def read_lines():
+        nonlocal lines_read
+        for raw in attachment.file:
+            lines_read += 1
+            yield raw.decode("utf-8", errors="replace")
+
+    table = attachment.filename.lower().endswith(".csv")
+    parsed = parse_bulk_lines(read_lines(), table=table)
+
+    report = BulkLeakReport(report_path)
+    progress = await message.reply(
+        f"⏳ Проверяю список: {total_lines} строк. Это может занять время — "
+        "я буду обновлять это сообщение."
+    )
+
+    async def show_progress() -> None:
+        shown = None
+        while True:
+            await asyncio.sleep(settings.LEAK_BULK_PROGRESS_INTERVAL)
+            text = (
+                f"⏳ Проверено строк: {lines_read} из {total_lines}\n"
+                f"Значений проверено: {report.checked}, "
+                f"найдено в утечках: {report.leaked}"
+            )
+            if text == shown:
+                continue
+            try:
+                await progress.message.edit(text=text)
+                shown = text
+            except Exception as e:
+                logging.warning(f"Не удалось обновить прогресс проверки: {e}")
+
+    # Файл читается и отчёт пишется пачками в отдельном потоке, чтобы
+    # не блокировать event loop.
+    progress_task = asyncio.create_task(show_progress())
+    try:
+        remaining = settings.LEAK_BULK_MAX_ITEMS
+        while remaining > 0:
+            batch = await asyncio.to_thread(
+                lambda: list(islice(parsed, min(BULK_READ_BATCH, remaining)))
+            )
+            if not batch:
+                break
+            remaining -= len(batch)
+            await search_leaks_bulk(iter(batch), report.add)
+            await report.flush()
+        await report.flush()
+    finally:
+        progress_task.cancel()
+
+    truncated = await asyncio.to_thread(next, parsed, None) is not None
+    try:
+        await progress.message.edit(
+            text=f"✅ Список проверен: {report.checked} значений."
         )
+    except Exception as e:
+        logging.warning(f"Не удалось обновить прогресс проверки: {e}")
 
-        if is_valid:
-            return candidate
-        return None
-    except Exception:
-        return None
+    await message.reply(
+        text=report.summary(truncated),
+        attachments=[InputMedia(report_path), create_data_leak_check_kb()],
+    )
 
 
 async def bot_entry(max_bot_token: str):
     bot = Bot(max_bot_token)
     dp.middleware(IgnoreOldUpdatesMiddleware())
-    bot_task = asyncio.create_task(dp.start_polling(bot))
+    bot_task = None
 
     try:
         init_ai_analyzer(settings.AI_TUNNEL_TOKEN)
-        init_balance_checker(settings.AI_TUNNEL_TOKEN)
+        init_balance_checker(settings.AI_TUNNEL_TOKEN).start()
         logging.info("AI анализатор и баланс-чекер инициализированы")
     except Exception as e:
         logging.error(f"Ошибка инициализации AI: {e}")
     try:
+        # Всё, что нужно обработчикам, готовится до начала опроса обновлений.
+        await warm_up_http_clients()
+        await setup_breach_catalog()
+        bot_task = asyncio.create_task(dp.start_polling(bot))
         return await bot_task
     except asyncio.CancelledError:
-        bot_task.cancel()
-        try:
-            await bot_task
-        except:
-            pass
+        if bot_task is not None:
+            bot_task.cancel()
+            try:
+                await bot_task
+            except:
+                pass
     finally:
         await bot.close_session()
-        await shutdown_all_clients()
         await exit_vt_client()
+        await close_breach_catalog()
+        await close_ai_analyzer()
+        balance_checker = get_balance_checker()
+        if balance_checker:
+            await balance_checker.stop()
+        await close_http_clients()
+        close_offline_index()
@@ -1,3 +1,4 @@
+from typing import Dict, List, Literal, Optional
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import Field
 
@@ -8,6 +9,97 @@ class Settings(BaseSettings):
     LEAKLOOKUP_PUBLIC_KEY: str = Field(default=...)
     AI_TUNNEL_TOKEN: str = Field(default=...)
 
+    ADMIN_USER_IDS: List[int] = Field(default=[])
+    DATA_DIR: str = Field(default="data")
+    TMP_DIR: Optional[str] = Field(default=None)
+
+    VT_CACHE_MEMORY_SIZE: int = Field(default=10_000)
+    VT_CACHE_CLEAN_TTL: int = Field(default=6 * 60 * 60)
+    VT_CACHE_MALICIOUS_TTL: int = Field(default=7 * 24 * 60 * 60)
+
+    THREAT_BLOCKLIST_PATH: Optional[str] = Field(default=None)
+    THREAT_ALLOWLIST_PATH: Optional[str] = Field(default=None)
+
+    VIRUSTOTAL_API_TOKENS: List[str] = Field(default=[])
+    VT_REQUESTS_PER_MINUTE: int = Field(default=4)
+    VT_REQUESTS_PER_DAY: int = Field(default=500)
+    LINK_SCAN_CONCURRENCY: int = Field(default=4)
+    VT_MAX_FILE_SIZE: int = Field(default=32 * 1024 * 1024)
+    ATTACHMENT_SPOOL_MEMORY: int = Field(default=4 * 1024 * 1024)
+    ATTACHMENT_CHUNK_SIZE: int = Field(default=256 * 1024)
+
+    ARCHIVE_MAX_MEMBERS: int = Field(default=500)
+    ARCHIVE_MAX_TOTAL_SIZE: int = Field(default=256 * 1024 * 1024)
+    ARCHIVE_MAX_RATIO: float = Field(default=100.0)
+    ARCHIVE_MAX_DEPTH: int = Field(default=2)
+    ARCHIVE_MAX_UPLOADS: int = Field(default=3)
+
+    GROUP_SCAN_DEDUPE_WINDOW: int = Field(default=60 * 60)
+    GROUP_SCAN_CHAT_REQUESTS_PER_HOUR: float = Field(default=20.0)
+    GROUP_SCAN_CHAT_BURST: float = Field(default=5.0)
+    GROUP_SCAN_QUEUE_SOFT_LIMIT: int = Field(default=20)
+    GROUP_SCAN_QUEUE_HARD_LIMIT: int = Field(default=100)
+
+    VT_POLL_INITIAL_DELAY: float = Field(default=5.0)
+    VT_POLL_MAX_DELAY: float = Field(default=60.0)
+    VT_ANALYSIS_TIMEOUT: float = Field(default=600.0)
+
+    HTTP_POOL_SIZE: int = Field(default=100)
+    HTTP_POOL_SIZE_PER_HOST: int = Field(default=20)
+    HTTP_DNS_CACHE_TTL: int = Field(default=300)
+    HTTP_KEEPALIVE_TIMEOUT: float = Field(default=60.0)
+    HTTP_CONNECT_TIMEOUT: float = Field(default=5.0)
+    AI_REQUEST_TIMEOUT: float = Field(default=30.0)
+    AI_STREAMING: bool = Field(default=True)
+    AI_CONCURRENCY: int = Field(default=4)
+    AI_REQUESTS_PER_MINUTE: float = Field(default=60.0)
+    AI_QUEUE_MAX: int = Field(default=50)
+    AI_RATE_LIMIT_COOLDOWN: float = Field(default=10.0)
+    AI_LONG_TEXT_CHARS: int = Field(default=1500)
+    AI_PROMPT_TOKEN_BUDGET: int = Field(default=2500)
+    AI_SYSTEM_PROMPT: Literal["auto", "full", "compact"] = Field(default="auto")
+    AI_MIN_BALANCE: float = Field(default=50.0)
+    AI_BALANCE_REFRESH_INTERVAL: float = Field(default=10 * 60)
+    AI_BALANCE_LOW_REFRESH_INTERVAL: float = Field(default=60.0)
+    AI_BALANCE_LOW_MARGIN: float = Field(default=50.0)
+    # Цены модели в рублях за миллион токенов — по тарифу AI Tunnel.
+    AI_PRICE_PROMPT_PER_MILLION: float = Field(default=30.0)
+    AI_PRICE_COMPLETION_PER_MILLION: float = Field(default=120.0)
+
+    SCAM_CACHE_SIZE: int = Field(default=5000)
+    SCAM_CACHE_TTL: float = Field(default=24 * 60 * 60)
+    SCAM_CACHE_MAX_DISTANCE: int = Field(default=6)
+    SCAM_CACHE_MIN_CHARS: int = Field(default=40)
+    SCAM_CACHE_AUDIT_RATE: float = Field(default=0.02)
+
+    PREFILTER_MODEL_PATH: Optional[str] = Field(default=None)
+    PREFILTER_SCAM_THRESHOLD: float = Field(default=0.99)
+    PREFILTER_BENIGN_THRESHOLD: float = Field(default=0.01)
+    PREFILTER_MAX_CHARS: int = Field(default=1500)
+
+    PWNED_TIMEOUT: float = Field(default=5.0)
+    PWNED_CACHE_SIZE: int = Field(default=2048)
+    PWNED_CACHE_TTL: int = Field(default=24 * 60 * 60)
+    PWNED_OFFLINE_PATH: Optional[str] = Field(default=None)
+    XON_TIMEOUT: float = Field(default=8.0)
+    LEAKLOOKUP_TIMEOUT: float = Field(default=8.0)
+    VT_REQUEST_TIMEOUT: float = Field(default=15.0)
+    CIRCUIT_FAILURE_THRESHOLD: int = Field(default=5)
+    CIRCUIT_RESET_TIMEOUT: float = Field(default=30.0)
+    LEAK_CACHE_SIZE: int = Field(default=10_000)
+    LEAK_CACHE_TTL: int = Field(default=6 * 60 * 60)
+    LEAK_CACHE_PARTIAL_TTL: int = Field(default=5 * 60)
+    BREACH_CATALOG_SYNC_INTERVAL: int = Field(default=24 * 60 * 60)
+    LEAK_BULK_MAX_ITEMS: int = Field(default=10_000)
+    LEAK_BULK_CONCURRENCY: int = Field(default=4)
+    LEAK_BULK_PROGRESS_INTERVAL: float = Field(default=3.0)
+    # Запросов в секунду к каждому провайдеру при массовой проверке.
+    LEAK_BULK_PROVIDER_RPS: Dict[str, float] = Field(
+        default={"Pwned Passwords": 10.0, "XposedOrNot": 1.0, "Leak-Lookup": 1.0}
+    )
+    # Соль ключей кэша утечек; без неё генерируется случайная при каждом запуске.
+    LEAK_CACHE_SALT: Optional[str] = Field(default=None)
+
     model_config = SettingsConfigDict(env_file=".env")
 
 
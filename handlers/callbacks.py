@@ -1,10 +1,19 @@
 from maxapi.types import MessageCallback
 from maxapi.context import MemoryContext
-from services.ai_analyzer import analyze_message_safe, AnalysisResult
+from services.ai_analyzer import (
+    analyze_message_safe,
+    analysis_queue_wait,
+    AnalysisResult,
+    PartialAnalysis,
+    QueueFullError,
+)
+import asyncio
 import logging
 
 logger = logging.getLogger(__name__)
 
+STATUS_EDIT_INTERVAL = 1.5
+
 
 async def handle_complete_conversation(event: MessageCallback, context: MemoryContext):
     user_data = await context.get_data()
@@ -22,20 +31,71 @@ async def handle_complete_conversation(event: MessageCallback, context: MemoryCo
         f"🔍 Анализирую {message_count} сообщений..."
     )
 
+    # Промежуточные результаты приходят чаще, чем их стоит показывать:
+    # первое обновление — сразу, дальше не чаще раза в STATUS_EDIT_INTERVAL.
+    latest: dict = {}
+    updated = asyncio.Event()
+
+    def on_progress(partial: PartialAnalysis) -> None:
+        latest["partial"] = partial
+        latest.pop("position", None)
+        updated.set()
+
+    def on_queue(position: int) -> None:
+        # Первый в очереди вот-вот начнёт анализ, место показываем остальным.
+        if position > 1:
+            latest["position"] = position
+        else:
+            latest.pop("position", None)
+        updated.set()
+
+    async def edit_status() -> None:
+        shown = format_partial_analysis(PartialAnalysis(), message_count)
+        while True:
+            await updated.wait()
+            updated.clear()
+            if "position" in latest:
+                text = format_queue_position(latest["position"], message_count)
+            else:
+                text = format_partial_analysis(
+                    latest.get("partial", PartialAnalysis()), message_count
+                )
+            if text != shown:
+                try:
+                    await analyzing_msg.message.edit(text=text)
+                    shown = text
+                except Exception as e:
+                    logger.warning(f"Не удалось обновить статус анализа: {e}")
+            await asyncio.sleep(STATUS_EDIT_INTERVAL)
+
+    status_task = asyncio.create_task(edit_status())
+    keep_messages = False
     try:
-        analysis_result = await analyze_message_safe(conversation_text)
+        analysis_result = await analyze_message_safe(
+            conversation_text, on_progress, chat_type, on_queue
+        )
+        status_task.cancel()
         response = format_analysis_response(
             analysis_result, message_count, chat_type, messages
         )
         await event.message.answer(response)
 
+    except QueueFullError as e:
+        logger.warning(f"Анализ отклонён: {e}")
+        keep_messages = True
+        await event.message.answer(
+            "⏳ Сейчас слишком много запросов на анализ. Сообщения сохранены — "
+            "нажмите кнопку анализа ещё раз через минуту."
+        )
     except Exception as e:
         logger.error(f"Ошибка при анализе диалога: {e}")
         await event.message.answer("❌ Произошла ошибка при анализе. Попробуйте позже.")
     finally:
-        await context.clear()
+        status_task.cancel()
+        if not keep_messages:
+            await context.clear()
         try:
-            await analyzing_msg.delete()
+            await analyzing_msg.message.delete()
         except:
             pass
 
@@ -78,24 +138,48 @@ def format_conversation_text(messages: list, chat_type: str) -> str:
     return "\n".join(conversation)
 
 
+def get_risk_level(risk_score: int) -> tuple[str, str]:
+    if risk_score >= 90:
+        return "🚫", "ОЧЕНЬ ВЫСОКИЙ"
+    elif risk_score >= 70:
+        return "🔴", "ВЫСОКИЙ"
+    elif risk_score >= 50:
+        return "🟠", "ПОВЫШЕННЫЙ"
+    elif risk_score >= 30:
+        return "🟡", "СРЕДНИЙ"
+    else:
+        return "🟢", "НИЗКИЙ"
+
+
+def format_queue_position(position: int, message_count: int) -> str:
+    wait = int(analysis_queue_wait(position)) + 1
+    return (
+        f"⏳ Анализ {message_count} сообщений: вы #{position} в очереди, "
+        f"ожидание примерно {wait} сек."
+    )
+
+
+def format_partial_analysis(partial: PartialAnalysis, message_count: int) -> str:
+    lines = [f"🔍 Анализирую {message_count} сообщений..."]
+
+    if partial.risk_score is not None:
+        risk_emoji, risk_level = get_risk_level(partial.risk_score)
+        lines.append(
+            f"\n{risk_emoji} Уровень риска: {partial.risk_score}% ({risk_level})"
+        )
+    if partial.scam_indicators:
+        lines.append("\nОбнаруженные признаки:")
+        lines += [f"• {indicator}" for indicator in partial.scam_indicators]
+    if partial.analysis:
+        lines.append(f"\nАнализ:\n{partial.analysis}▌")
+
+    return "\n".join(lines)
+
+
 def format_analysis_response(
     result: AnalysisResult, message_count: int, chat_type: str, messages: list
 ) -> str:
-    if result.risk_score >= 90:
-        risk_emoji = "🚫"
-        risk_level = "ОЧЕНЬ ВЫСОКИЙ"
-    elif result.risk_score >= 70:
-        risk_emoji = "🔴"
-        risk_level = "ВЫСОКИЙ"
-    elif result.risk_score >= 50:
-        risk_emoji = "🟠"
-        risk_level = "ПОВЫШЕННЫЙ"
-    elif result.risk_score >= 30:
-        risk_emoji = "🟡"
-        risk_level = "СРЕДНИЙ"
-    else:
-        risk_emoji = "🟢"
-        risk_level = "НИЗКИЙ"
+    risk_emoji, risk_level = get_risk_level(result.risk_score)
 
     indicators_text = (
         "\n".join([f"• {indicator}" for indicator in result.scam_indicators])
@@ -1,10 +1,32 @@
-import aiohttp
+import asyncio
 import hashlib
+import hmac
+import secrets
+from collections import Counter
 from datetime import datetime
-from typing import List, Literal, Optional, Union
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Literal,
+    Optional,
+    Union,
+)
 from pydantic import BaseModel, Field
 import re
 from config import settings
+from services.breach_catalog import canonical_breach_name, get_breach_catalog
+from services.http import get_session
+from services.metrics import register_metrics
+from services.pwned_passwords import get_offline_index, is_password_pwned
+from services.rate_limit import TokenBucket
+from services.resilience import CircuitOpenError, ProviderGuard, provider_guard
+from services.singleflight import SingleFlight
+from services.ttl_cache import TTLCache
 import logging
 
 logging.basicConfig(
@@ -22,6 +44,22 @@ class CheckItem(BaseModel):
 class LeakInfo(BaseModel):
     site: Optional[str] = None
     breach_date: Optional[datetime] = None
+    records: Optional[int] = None
+    data_classes: List[str] = Field(default_factory=list)
+    sources: List[str] = Field(default_factory=list)
+
+
+class LeakSearchResult(BaseModel):
+    leaks: List[LeakInfo] = Field(default_factory=list)
+    checked: List[str] = Field(default_factory=list)
+    # Провайдеры, которые не ответили вовремя или вернули ошибку:
+    # их данных в результате нет, он может быть неполным.
+    timed_out: List[str] = Field(default_factory=list)
+    failed: List[str] = Field(default_factory=list)
+
+    @property
+    def is_partial(self) -> bool:
+        return bool(self.timed_out or self.failed)
 
 
 EMAIL_REGEX = re.compile(r"^[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}$")
@@ -38,84 +76,79 @@ def build_check_item(value: str) -> CheckItem:
     return CheckItem(value=s, type="Password_or_login")
 
 
-_PWNED_SESSION: aiohttp.ClientSession | None = None
-_XON_SESSION: aiohttp.ClientSession | None = None
-_LEAKLOOKUP_SESSION: aiohttp.ClientSession | None = None
-
-
-# ================================
-# SETUP / EXIT: Pwned Passwords
-# ================================
-async def setup_pwned_session():
-    global _PWNED_SESSION
-    if _PWNED_SESSION is None:
-        _PWNED_SESSION = aiohttp.ClientSession()
-
-
-async def exit_pwned_session():
-    global _PWNED_SESSION
-    if _PWNED_SESSION:
-        await _PWNED_SESSION.close()
-        _PWNED_SESSION = None
-        logging.info("Pwned API client closed.")
+def normalize_phone(value: str) -> str:
+    """
+    Телефон в формате E.164: "+" и только цифры.
+    Российские номера приводятся к +7: 8XXXXXXXXXX и 9XXXXXXXXX -> +7XXXXXXXXXX.
+    """
+    digits = re.sub(r"\D", "", value)
+    if len(digits) == 11 and digits.startswith("8"):
+        digits = "7" + digits[1:]
+    elif len(digits) == 10 and digits.startswith("9") and not value.startswith("+"):
+        digits = "7" + digits
+    return "+" + digits
 
 
-# ================================
-# SETUP / EXIT: XposedOrNot
-# ================================
-async def setup_xon_session():
-    global _XON_SESSION
-    if _XON_SESSION is None:
-        _XON_SESSION = aiohttp.ClientSession()
+def normalize_check_value(item: CheckItem) -> str:
+    """Значение в каноническом виде: одинаковые данные дают одинаковую строку."""
+    value = item.value.strip()
+    if item.type == "Email":
+        return value.lower()
+    if item.type == "Number":
+        return normalize_phone(value)
+    return value
 
 
-async def exit_xon_session():
-    global _XON_SESSION
-    if _XON_SESSION:
-        await _XON_SESSION.close()
-        _XON_SESSION = None
-        logging.info("XposedOrNot API client closed.")
+_LEAK_KEY_SALT = (
+    settings.LEAK_CACHE_SALT.encode()
+    if settings.LEAK_CACHE_SALT
+    else secrets.token_bytes(16)
+)
 
 
-# ================================
-# SETUP / EXIT: Leak-Lookup
-# ================================
-async def setup_leaklookup_session():
-    global _LEAKLOOKUP_SESSION
-    if _LEAKLOOKUP_SESSION is None:
-        _LEAKLOOKUP_SESSION = aiohttp.ClientSession()
+def leak_query_key(item: CheckItem) -> str:
+    """
+    Ключ запроса для кэша и объединения одинаковых проверок: HMAC-SHA256
+    нормализованного значения с солью. Само значение нигде не хранится,
+    а без соли ключ нельзя подобрать перебором по словарю паролей или номеров.
+    """
+    data = f"{item.type}:{normalize_check_value(item)}".encode()
+    return hmac.new(_LEAK_KEY_SALT, data, hashlib.sha256).hexdigest()
 
 
-async def exit_leaklookup_session():
-    global _LEAKLOOKUP_SESSION
-    if _LEAKLOOKUP_SESSION:
-        await _LEAKLOOKUP_SESSION.close()
-        _LEAKLOOKUP_SESSION = None
-        logging.info("Leak-Lookup API client closed.")
+_LEAK_CACHE: TTLCache[LeakSearchResult] = TTLCache(
+    settings.LEAK_CACHE_SIZE, settings.LEAK_CACHE_TTL
+)
+_LEAK_CACHE_STATS: Counter = Counter()
+register_metrics("leak_cache", lambda: {"size": len(_LEAK_CACHE), **_LEAK_CACHE_STATS})
+
+_LEAK_FLIGHTS = SingleFlight()
+register_metrics("leaks_singleflight", _LEAK_FLIGHTS.stats)
+
+_PROVIDER_STATS: Counter = Counter()
+register_metrics("leak_providers", lambda: dict(_PROVIDER_STATS))
+
+# Таймауты провайдеров подстраиваются под их p95, а настройки *_TIMEOUT
+# задают верхнюю границу. Проверка email в XposedOrNot — идемпотентный GET,
+# его можно дублировать при медленном ответе. Pwned Passwords защищается
+# внутри services/pwned_passwords.py: там отвечают кэш и офлайн-база,
+# и замерять нужно только сетевые запросы.
+_PROVIDER_GUARDS: Dict[str, ProviderGuard] = {
+    "XposedOrNot": provider_guard(
+        "XposedOrNot", settings.XON_TIMEOUT, min_timeout=2.0, hedge=True
+    ),
+    "Leak-Lookup": provider_guard(
+        "Leak-Lookup", settings.LEAKLOOKUP_TIMEOUT, min_timeout=2.0
+    ),
+}
 
 
 # ================================
 # CHECK: Pwned Passwords
 # ================================
 async def check_pwned_password(password: str) -> List[LeakInfo]:
-    await setup_pwned_session()
-    if _PWNED_SESSION is None:
-        return []
-
-    sha1 = hashlib.sha1(password.encode()).hexdigest().upper()
-    prefix, suffix = sha1[:5], sha1[5:]
-
-    url = f"https://api.pwnedpasswords.com/range/{prefix}"
-
-    async with _PWNED_SESSION.get(url) as resp:
-        if resp.status != 200:
-            return []
-        text = await resp.text()
-
-    for line in text.splitlines():
-        hash_suffix, count = line.split(":")
-        if hash_suffix == suffix:
-            return [LeakInfo(site=None, breach_date=None)]
+    if await is_password_pwned(password):
+        return [LeakInfo(site=None, breach_date=None)]
     return []
 
 
@@ -123,19 +156,22 @@ async def check_pwned_password(password: str) -> List[LeakInfo]:
 # CHECK: XposedOrNot
 # ================================
 async def check_xposedornot(email: str) -> List[LeakInfo]:
-    await setup_xon_session()
-    if _XON_SESSION is None:
-        return []
-
     url = f"https://api.xposedornot.com/v1/check-email/{email}"
-    async with _XON_SESSION.get(url) as resp:
+    async with get_session("xon").get(url) as resp:
+        if resp.status >= 500:
+            resp.raise_for_status()
         if resp.status != 200:
             return []
         data = await resp.json()
 
     leaks: List[LeakInfo] = []
 
-    for breach in data.get("breaches", []):
+    for breach in data.get("breaches") or []:
+        # API отдаёт имена утечек списком ([["Adobe", "VK"]]); подробности
+        # о каждой берутся из локального каталога.
+        if isinstance(breach, list):
+            leaks += [LeakInfo(site=name) for name in breach if name]
+            continue
         leaks.append(
             LeakInfo(
                 site=breach.get("name", None),
@@ -154,14 +190,12 @@ async def check_xposedornot(email: str) -> List[LeakInfo]:
 # CHECK: Leak-Lookup
 # ================================
 async def check_leaklookup(query: str) -> List[LeakInfo]:
-    await setup_leaklookup_session()
-    if _LEAKLOOKUP_SESSION is None:
-        return []
-
     url = "https://leak-lookup.com/api/search"
     payload = {"key": settings.LEAKLOOKUP_PUBLIC_KEY, "query": query}
 
-    async with _LEAKLOOKUP_SESSION.post(url, json=payload) as resp:
+    async with get_session("leaklookup").post(url, json=payload) as resp:
+        if resp.status >= 500:
+            resp.raise_for_status()
         if resp.status != 200:
             return []
         data = await resp.json()
@@ -174,26 +208,207 @@ async def check_leaklookup(query: str) -> List[LeakInfo]:
     return leaks
 
 
-async def search_leaks(item: CheckItem | str) -> List[LeakInfo]:
-    results: List[LeakInfo] = []
+def get_cached_leaks(item: CheckItem) -> Optional[LeakSearchResult]:
+    return _LEAK_CACHE.get(leak_query_key(item))
+
 
+async def search_leaks(item: CheckItem | str) -> LeakSearchResult:
     if isinstance(item, str):
         item = build_check_item(item)
 
+    key = leak_query_key(item)
+    cached = _LEAK_CACHE.get(key)
+    if cached is not None:
+        _LEAK_CACHE_STATS["hits"] += 1
+        return cached
+
+    _LEAK_CACHE_STATS["misses"] += 1
+    return await _LEAK_FLIGHTS.do(key, lambda: _search_and_cache(key, item))
+
+
+async def _search_and_cache(key: str, item: CheckItem) -> LeakSearchResult:
+    result = await _search_leaks(item)
+    # Если не ответил ни один провайдер, кэшировать нечего; неполный
+    # результат храним недолго, чтобы скоро перепроверить.
+    if result.checked:
+        ttl = settings.LEAK_CACHE_PARTIAL_TTL if result.is_partial else None
+        _LEAK_CACHE.set(key, result, ttl)
+    return result
+
+
+LeakProvider = Callable[[], Awaitable[List[LeakInfo]]]
+
+
+def _providers_for(item: CheckItem) -> Dict[str, LeakProvider]:
+    """Провайдеры, которые умеют искать данный тип данных."""
+    providers: Dict[str, LeakProvider] = {}
+
     if item.type == "Password_or_login":
-        results += await check_pwned_password(item.value)
+        providers["Pwned Passwords"] = lambda: check_pwned_password(item.value)
 
     if item.type == "Email":
-        results += await check_xposedornot(item.value)
-        results += await check_leaklookup(item.value)
+        providers["XposedOrNot"] = lambda: check_xposedornot(item.value)
+
+    providers["Leak-Lookup"] = lambda: check_leaklookup(item.value)
+    return providers
+
+
+async def _run_provider(name: str, provider: LeakProvider) -> List[LeakInfo] | str:
+    """Результат провайдера или статус "timed_out"/"failed", если его нет."""
+    guard = _PROVIDER_GUARDS.get(name)
+    try:
+        leaks = await (guard.call(provider) if guard is not None else provider())
+    except CircuitOpenError as e:
+        logging.warning(f"{name} skipped: {e}")
+        _PROVIDER_STATS[f"{name} circuit_open"] += 1
+        return "failed"
+    except TimeoutError:
+        timeout = f" in {guard.timeout:.1f} s" if guard is not None else ""
+        logging.warning(f"{name} did not answer{timeout}")
+        _PROVIDER_STATS[f"{name} timeouts"] += 1
+        return "timed_out"
+    except Exception as e:
+        logging.error(f"{name} lookup failed: {e}")
+        _PROVIDER_STATS[f"{name} errors"] += 1
+        return "failed"
+
+    _PROVIDER_STATS[f"{name} ok"] += 1
+    for leak in leaks:
+        leak.sources.append(name)
+    return leaks
 
-    if item.type in ("Password_or_login", "Number"):
-        results += await check_leaklookup(item.value)
 
-    return results
+def enrich_leak(leak: LeakInfo) -> LeakInfo:
+    """Дополняет утечку сведениями из локального каталога, если она там есть."""
+    catalog = get_breach_catalog()
+    record = catalog.lookup(leak.site) if catalog is not None else None
+    if record is None:
+        return leak
+
+    leak.site = record.name
+    leak.breach_date = leak.breach_date or record.breach_date
+    leak.records = leak.records or record.records
+    leak.data_classes = leak.data_classes or list(record.data_classes)
+    return leak
+
+
+def merge_leaks(leaks: List[LeakInfo]) -> List[LeakInfo]:
+    """
+    Объединяет одну и ту же утечку от разных провайдеров (по каноническому
+    имени из каталога или имени без регистра и знаков препинания), сохраняя
+    известные сведения и все источники. Утечки без имени не объединяются.
+    """
+    merged: Dict[str, LeakInfo] = {}
+    result: List[LeakInfo] = []
+    for leak in leaks:
+        key = canonical_breach_name(leak.site) or (leak.site or "").strip()
+        existing = merged.get(key) if key else None
+        if existing is None:
+            leak = leak.model_copy(deep=True)
+            result.append(leak)
+            if key:
+                merged[key] = leak
+            continue
+
+        existing.breach_date = existing.breach_date or leak.breach_date
+        existing.site = existing.site or leak.site
+        existing.records = existing.records or leak.records
+        existing.data_classes = existing.data_classes or leak.data_classes
+        existing.sources += [s for s in leak.sources if s not in existing.sources]
+
+    return result
+
+
+async def _search_leaks(item: CheckItem) -> LeakSearchResult:
+    providers = _providers_for(item)
+    outcomes = await asyncio.gather(
+        *(_run_provider(name, provider) for name, provider in providers.items())
+    )
+
+    result = LeakSearchResult()
+    found: List[LeakInfo] = []
+    for name, outcome in zip(providers, outcomes):
+        if outcome == "timed_out":
+            result.timed_out.append(name)
+        elif outcome == "failed":
+            result.failed.append(name)
+        else:
+            result.checked.append(name)
+            found += outcome  # type: ignore
+
+    result.leaks = merge_leaks([enrich_leak(leak) for leak in found])
+    return result
 
 
-async def shutdown_all_clients():
-    await exit_pwned_session()
-    await exit_xon_session()
-    await exit_leaklookup_session()
+# ================================
+# BULK: проверка списка из файла
+# ================================
+BULK_DELIMITERS = re.compile(r"[,;\t]")
+FORMATTED_PHONE_REGEX = re.compile(r"^\+?[0-9][0-9 ()-]{5,}[0-9]$")
+
+_BULK_PACERS: Dict[str, TokenBucket] = {
+    name: TokenBucket(rps, capacity=max(rps, 1.0))
+    for name, rps in settings.LEAK_BULK_PROVIDER_RPS.items()
+}
+
+
+def parse_bulk_lines(lines: Iterable[str], table: bool = False) -> Iterator[CheckItem]:
+    """
+    Построчно разбирает список для массовой проверки, повторы пропускаются.
+    В текстовом файле каждая строка — одно значение; в таблице (CSV)
+    из ячеек берутся только email и телефоны, остальные колонки — это имена,
+    должности и т.п.
+    """
+    seen: set[str] = set()
+    for line in lines:
+        line = line.strip().lstrip("\ufeff")
+        if not line:
+            continue
+
+        cells = BULK_DELIMITERS.split(line) if table else [line]
+        for cell in cells:
+            cell = cell.strip().strip('"').strip()
+            if not cell:
+                continue
+            # В таблицах телефоны обычно записаны с пробелами и дефисами.
+            if table and FORMATTED_PHONE_REGEX.match(cell):
+                cell = re.sub(r"[ ()-]", "", cell)
+            item = build_check_item(cell)
+            if table and item.type == "Password_or_login":
+                continue
+
+            key = leak_query_key(item)
+            if key not in seen:
+                seen.add(key)
+                yield item
+
+
+async def _pace_bulk_item(item: CheckItem) -> None:
+    """Ждёт своей очереди к каждому провайдеру, к которому пойдёт запрос."""
+    if get_cached_leaks(item) is not None:
+        return
+    for name in _providers_for(item):
+        if name == "Pwned Passwords" and get_offline_index() is not None:
+            continue
+        pacer = _BULK_PACERS.get(name)
+        if pacer is not None:
+            await pacer.acquire()
+
+
+async def search_leaks_bulk(
+    items: Iterator[CheckItem],
+    on_result: Callable[[CheckItem, LeakSearchResult], None],
+    concurrency: int = settings.LEAK_BULK_CONCURRENCY,
+) -> None:
+    """
+    Проверяет значения из итератора не больше чем concurrency одновременно,
+    соблюдая лимиты провайдеров. Итератор читается по мере проверки, поэтому
+    весь список в памяти не держится.
+    """
+
+    async def worker() -> None:
+        for item in items:
+            await _pace_bulk_item(item)
+            on_result(item, await search_leaks(item))
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
@@ -0,0 +1,233 @@
+"""
+Допуск запросов к модели: очередь с приоритетами перед AI Tunnel.
+
+Одновременно выполняется не больше concurrency запросов, а их отправка
+выравнивается token bucket'ом на уровне лимита провайдера, поэтому 429 не
+возникают пачками. Если 429 всё же пришёл, отправка приостанавливается на
+rate_limit_cooldown, а запрос возвращается в начало своей очереди — вместо
+ответа «Сервис перегружен» пользователю.
+
+Приоритеты: личные диалоги раньше групп, короткие переписки раньше длинных.
+Когда очередь слишком длинная, новые запросы отклоняются QueueFullError;
+запросы из групп — уже при половине очереди.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+from services.rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+PRIORITY_PRIVATE_SHORT = 0
+PRIORITY_PRIVATE_LONG = 1
+PRIORITY_GROUP_SHORT = 2
+PRIORITY_GROUP_LONG = 3
+
+DURATION_SMOOTHING = 0.2
+
+
+class QueueFullError(Exception):
+    """Очередь на анализ переполнена, запрос не принят."""
+
+    def __init__(self, queued: int):
+        super().__init__(f"analysis queue is full ({queued} waiting)")
+        self.queued = queued
+
+
+class RateLimitedError(Exception):
+    """Провайдер ответил 429, запрос стоит повторить позже."""
+
+
+def analysis_priority(chat_type: str, text_length: int, long_text: int) -> int:
+    if chat_type == "group":
+        return PRIORITY_GROUP_LONG if text_length > long_text else PRIORITY_GROUP_SHORT
+    return PRIORITY_PRIVATE_LONG if text_length > long_text else PRIORITY_PRIVATE_SHORT
+
+
+class _Ticket:
+    def __init__(
+        self,
+        fn: Callable[[], Awaitable[Any]],
+        priority: int,
+        future: asyncio.Future,
+        on_position: Optional[Callable[[int], None]],
+    ):
+        self.fn = fn
+        self.priority = priority
+        self.future = future
+        self.on_position = on_position
+        self.position: Optional[int] = None
+        self.attempts = 0
+
+
+class AdmissionQueue:
+    def __init__(
+        self,
+        concurrency: int,
+        requests_per_minute: float,
+        max_queue: int,
+        rate_limit_cooldown: float = 10.0,
+        max_rate_limit_retries: int = 3,
+    ):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.rate_limit_cooldown = rate_limit_cooldown
+        self.max_rate_limit_retries = max_rate_limit_retries
+        # Небольшой запас: пачка после простоя не должна упереться в лимит.
+        self.bucket = TokenBucket(
+            requests_per_minute / 60,
+            max(1.0, min(concurrency, requests_per_minute / 60)),
+        )
+
+        self._heap: List[tuple] = []
+        self._seq = itertools.count()
+        self._front_seq = itertools.count(-1, -1)
+        self._active = 0
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._running: set[asyncio.Task] = set()
+        self._duration: Optional[float] = None
+
+        self.dispatched = 0
+        self.shed = 0
+        self.rate_limited = 0
+
+    async def run(
+        self,
+        fn: Callable[[], Awaitable[T]],
+        priority: int = PRIORITY_PRIVATE_SHORT,
+        on_position: Optional[Callable[[int], None]] = None,
+    ) -> T:
+        """
+        Ставит вызов в очередь и ждёт результат. on_position получает номер
+        в очереди (с 1) при каждом его изменении, пока вызов не начался.
+        """
+        queued = self.queue_size()
+        limit = (
+            self.max_queue if priority < PRIORITY_GROUP_SHORT else self.max_queue // 2
+        )
+        if queued >= limit:
+            self.shed += 1
+            raise QueueFullError(queued)
+
+        future = asyncio.get_running_loop().create_future()
+        # Отменённые и завершённые вызовы сдвигают очередь для остальных.
+        future.add_done_callback(lambda _: self._notify_positions())
+        self._push(_Ticket(fn, priority, future, on_position))
+        return await future
+
+    def _push(self, ticket: _Ticket, front: bool = False) -> None:
+        seq = next(self._front_seq) if front else next(self._seq)
+        heapq.heappush(self._heap, (ticket.priority, seq, ticket))
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._dispatch())
+        self._notify_positions()
+        self._wakeup.set()
+
+    def queue_size(self) -> int:
+        return sum(1 for _, _, ticket in self._heap if not ticket.future.done())
+
+    def estimated_wait(self, position: int) -> float:
+        """Примерное ожидание в секундах для позиции в очереди."""
+        by_rate = max(position - self.bucket.tokens, 0.0) / self.bucket.rate
+        by_slots = position * (self._duration or 0.0) / self.concurrency
+        return max(by_rate, by_slots)
+
+    def _notify_positions(self) -> None:
+        waiting = [t for _, _, t in sorted(self._heap) if not t.future.done()]
+        for position, ticket in enumerate(waiting, 1):
+            if ticket.position != position:
+                ticket.position = position
+                if ticket.on_position is not None:
+                    ticket.on_position(position)
+
+    def _pop(self) -> Optional[_Ticket]:
+        while self._heap:
+            _, _, ticket = heapq.heappop(self._heap)
+            if not ticket.future.done():
+                return ticket
+        return None
+
+    async def _dispatch(self) -> None:
+        while True:
+            if not self.queue_size() or self._active >= self.concurrency:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            await self.bucket.acquire()
+            ticket = self._pop()
+            if ticket is None:
+                continue
+
+            self._active += 1
+            self.dispatched += 1
+            task = asyncio.create_task(self._execute(ticket))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+            self._notify_positions()
+
+    async def _execute(self, ticket: _Ticket) -> None:
+        ticket.attempts += 1
+        ticket.position = None
+        started = time.monotonic()
+        try:
+            result = await ticket.fn()
+        except RateLimitedError as e:
+            self.rate_limited += 1
+            self.bucket.pause(self.rate_limit_cooldown)
+            if (
+                ticket.attempts <= self.max_rate_limit_retries
+                and not ticket.future.done()
+            ):
+                logger.warning(
+                    f"AI Tunnel ответил 429, повтор через {self.rate_limit_cooldown:.0f} с"
+                )
+                self._push(ticket, front=True)
+            elif not ticket.future.done():
+                ticket.future.set_exception(e)
+        except Exception as e:
+            if not ticket.future.done():
+                ticket.future.set_exception(e)
+        else:
+            duration = time.monotonic() - started
+            self._duration = (
+                duration
+                if self._duration is None
+                else self._duration + DURATION_SMOOTHING * (duration - self._duration)
+            )
+            if not ticket.future.done():
+                ticket.future.set_result(result)
+        finally:
+            self._active -= 1
+            self._wakeup.set()
+
+    async def stop(self) -> None:
+        tasks = [t for t in (self._task, *self._running) if t is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+
+        for _, _, ticket in self._heap:
+            ticket.future.cancel()
+        self._heap.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self.queue_size(),
+            "active": self._active,
+            "dispatched": self.dispatched,
+            "shed": self.shed,
+            "rate_limited": self.rate_limited,
+            "avg_duration": round(self._duration, 2) if self._duration else "-",
+            "tokens": round(self.bucket.tokens, 2),
+        }
@@ -1,11 +1,41 @@
 import aiohttp
 import json
 import logging
-from services.balance_checker import get_balance_checker
+import os
+import re
+import time
+from typing import Callable, Optional, Tuple
+from services.ai_admission import (
+    AdmissionQueue,
+    QueueFullError,
+    RateLimitedError,
+    analysis_priority,
+)
+from services.balance_checker import estimate_cost, get_balance_checker
+from services.http import get_session
+from services.metrics import register_metrics
+from services.prompt_builder import build_prompt, record_usage
+from services.resilience import CircuitOpenError, provider_guard
+from services.scam_cache import NearDuplicateCache
+from services.scam_prefilter import PrefilterVerdict, ScamPrefilter
 from config import settings
 
 logger = logging.getLogger(__name__)
 
+# Ответ модели может занимать десятки секунд, поэтому нижняя граница таймаута выше.
+_GUARD = provider_guard("AITunnel", settings.AI_REQUEST_TIMEOUT, min_timeout=10.0)
+
+STREAM_PARSE_INTERVAL = 0.25
+# Порог риска, по разные стороны которого вердикты считаются противоречащими.
+RISKY_SCORE = 50
+
+RISK_SCORE_RE = re.compile(r'"risk_score"\s*:\s*(\d+)\s*[,}\s]')
+INDICATORS_RE = re.compile(r'"scam_indicators"\s*:\s*\[')
+ANALYSIS_RE = re.compile(r'"analysis"\s*:\s*"')
+JSON_STRING_RE = re.compile(r'"((?:[^"\\]|\\.)*)"')
+JSON_STRING_BODY_RE = re.compile(r'(?:[^"\\]|\\.)*')
+INCOMPLETE_ESCAPE_RE = re.compile(r"\\u[0-9a-fA-F]{0,3}$")
+
 
 class AnalysisResult:
     def __init__(
@@ -15,12 +45,72 @@ class AnalysisResult:
         analysis: str,
         confidence: float = 0.0,
         cost: float = 0.0,
+        error: bool = False,
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
     ):
         self.risk_score = risk_score
         self.scam_indicators = scam_indicators
         self.analysis = analysis
         self.confidence = confidence
         self.cost = cost
+        self.error = error
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+
+
+class PartialAnalysis:
+    """Поля ответа модели, уже полученные при потоковой генерации."""
+
+    def __init__(
+        self,
+        risk_score: Optional[int] = None,
+        scam_indicators: Optional[list] = None,
+        analysis: str = "",
+    ):
+        self.risk_score = risk_score
+        self.scam_indicators = scam_indicators or []
+        self.analysis = analysis
+
+
+def _decode_json_string(body: str) -> str:
+    body = INCOMPLETE_ESCAPE_RE.sub("", body)
+    try:
+        return json.loads(f'"{body}"')
+    except json.JSONDecodeError:
+        return body.replace("\\n", "\n").replace('\\"', '"')
+
+
+def parse_partial_analysis(content: str) -> PartialAnalysis:
+    """
+    Достаёт поля из недописанного JSON-ответа модели: оценку риска — как только
+    дописано число, признаки — только целиком дописанные строки, анализ —
+    всё, что уже пришло.
+    """
+    partial = PartialAnalysis()
+
+    match = RISK_SCORE_RE.search(content)
+    if match:
+        partial.risk_score = int(match.group(1))
+
+    match = INDICATORS_RE.search(content)
+    if match:
+        pos = match.end()
+        while True:
+            while pos < len(content) and content[pos] in " \t\r\n,":
+                pos += 1
+            item = JSON_STRING_RE.match(content, pos)
+            if item is None:
+                break
+            partial.scam_indicators.append(_decode_json_string(item.group(1)))
+            pos = item.end()
+
+    match = ANALYSIS_RE.search(content)
+    if match:
+        body = JSON_STRING_BODY_RE.match(content, match.end())
+        partial.analysis = _decode_json_string(body.group(0) if body else "")
+
+    return partial
 
 
 class AITunnelAnalyzer:
@@ -32,7 +122,7 @@ class AITunnelAnalyzer:
         self.max_tokens = 800
         self.temperature = 0.1
 
-        self.min_balance = 50
+        self.min_balance = settings.AI_MIN_BALANCE
 
     async def check_balance_and_limits(self):
         balance_checker = get_balance_checker()
@@ -41,7 +131,15 @@ class AITunnelAnalyzer:
             logger.error("Баланс-чекер не инициализирован")
             return False
 
-        balance = await balance_checker.get_balance()
+        # Баланс обновляется в фоне; запрос к API — только если его ещё нет
+        # или он ниже минимума (возможно, счёт уже пополнили).
+        balance = balance_checker.balance
+        if balance is None:
+            balance = await balance_checker.refresh()
+        elif balance < self.min_balance:
+            balance = await balance_checker.refresh(
+                max_age=settings.AI_BALANCE_LOW_REFRESH_INTERVAL
+            )
 
         if balance is None:
             logger.error("Не удалось получить баланс")
@@ -49,19 +147,13 @@ class AITunnelAnalyzer:
 
         if balance < self.min_balance:
             logger.error(
-                f"Низкий баланс: {balance} RUB (минимум: {self.min_balance} RUB)"
+                f"Низкий баланс: {balance:.2f} RUB (минимум: {self.min_balance} RUB)"
             )
             return False
 
-        logger.info(f"Достаточный баланс: {balance} RUB")
         return True
 
-    async def analyze_message(self, text: str) -> AnalysisResult:
-        if not await self.check_balance_and_limits():
-            return self._create_balance_error_result()
-
-        system_prompt = self._create_enhanced_system_prompt()
-
+    def _build_payload(self, text: str, stream: bool, system_prompt: str) -> dict:
         payload = {
             "model": self.model,
             "messages": [
@@ -70,54 +162,167 @@ class AITunnelAnalyzer:
             ],
             "max_tokens": self.max_tokens,
             "temperature": self.temperature,
-            "stream": False,
+            "stream": stream,
         }
+        if stream:
+            # Без этого в потоковом режиме не приходит расход токенов.
+            payload["stream_options"] = {"include_usage": True}
+        return payload
 
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json",
-        }
+    async def analyze_message(
+        self,
+        text: str,
+        on_progress: Optional[Callable[[PartialAnalysis], None]] = None,
+        system_prompt: Optional[str] = None,
+    ) -> AnalysisResult:
+        """
+        Анализирует текст. Если передан on_progress, ответ модели читается
+        потоком и on_progress получает уже известные поля; при сбое потокового
+        режима запрос повторяется обычным. По умолчанию используется полный
+        системный промпт.
+        """
+        if not await self.check_balance_and_limits():
+            return self._create_balance_error_result()
 
+        headers = {"Authorization": f"Bearer {self.api_key}"}
+        system_prompt = system_prompt or self._create_enhanced_system_prompt()
+
+        if on_progress is not None and settings.AI_STREAMING:
+            payload = self._build_payload(text, True, system_prompt)
+            result = await self._complete(
+                text,
+                lambda: self._stream_completion(payload, headers, on_progress),
+                streaming=True,
+            )
+            if result is not None:
+                return result
+            logger.warning("Потоковый анализ не удался, повторяю без стриминга")
+
+        payload = self._build_payload(text, False, system_prompt)
+        result = await self._complete(
+            text, lambda: self._request_completion(payload, headers)
+        )
+        return result  # type: ignore
+
+    async def _complete(
+        self, text: str, request, streaming: bool = False
+    ) -> Optional[AnalysisResult]:
+        """
+        Выполняет запрос к модели и превращает ответ в результат анализа.
+        Для потокового запроса возвращает None, если стоит повторить его обычным.
+        """
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    f"{self.base_url}/chat/completions",
-                    json=payload,
-                    headers=headers,
-                    timeout=aiohttp.ClientTimeout(total=30),
-                ) as response:
-
-                    if response.status == 200:
-                        data = await response.json()
-                        return self._parse_success_response(data, text)
-
-                    elif response.status == 402:
-                        logger.error("Недостаточно средств на балансе")
-                        return self._create_balance_error_result()
-
-                    elif response.status == 429:
-                        logger.warning("Превышен лимит запросов")
-                        return self._create_rate_limit_result(text)
-
-                    elif response.status == 400:
-                        error_data = await response.json()
-                        logger.error(f"Ошибка запроса: {error_data}")
-                        error_msg = self._parse_provider_error(error_data)
-                        return self._create_error_result(text, error_msg)
-
-                    else:
-                        logger.error(f"Неизвестная ошибка API: {response.status}")
-                        return self._create_error_result(
-                            text, f"Ошибка сервиса: {response.status}"
-                        )
-
-        except aiohttp.ClientError as e:
+            status, data = await _GUARD.call(request)
+        except CircuitOpenError as e:
+            logger.warning(f"Анализ пропущен: {e}")
+            return self._create_error_result(text, "Сервис анализа временно недоступен")
+        except TimeoutError:
+            logger.error(f"AI Tunnel не ответил за {_GUARD.timeout:.1f} с")
+            return self._create_error_result(text, "Сервис анализа не ответил вовремя")
+        except aiohttp.ClientResponseError as e:
+            logger.error(f"Ошибка сервера AI Tunnel: {e.status}")
+            return self._create_error_result(text, f"Ошибка сервиса: {e.status}")
+        except (aiohttp.ClientError, ValueError) as e:
+            if streaming:
+                logger.warning(f"Поток ответа AI Tunnel прерван: {e}")
+                return None
             logger.error(f"Сетевая ошибка: {e}")
             return self._create_error_result(text, "Сетевая ошибка")
         except Exception as e:
             logger.error(f"Неожиданная ошибка: {e}")
             return self._create_error_result(text, "Внутренняя ошибка")
 
+        if status == 200:
+            return self._parse_success_response(data, text)
+
+        elif status == 402:
+            logger.error("Недостаточно средств на балансе")
+            return self._create_balance_error_result()
+
+        elif status == 429:
+            logger.warning("Превышен лимит запросов")
+            raise RateLimitedError()
+
+        elif status == 400:
+            logger.error(f"Ошибка запроса: {data}")
+            # Возможно, провайдер не поддерживает параметры стриминга.
+            if streaming:
+                return None
+            error_msg = self._parse_provider_error(data)
+            return self._create_error_result(text, error_msg)
+
+        else:
+            logger.error(f"Неизвестная ошибка API: {status}")
+            return self._create_error_result(text, f"Ошибка сервиса: {status}")
+
+    async def _stream_completion(
+        self,
+        payload: dict,
+        headers: dict,
+        on_progress: Callable[[PartialAnalysis], None],
+    ) -> Tuple[int, dict]:
+        """
+        Читает ответ chat/completions в формате SSE и собирает его в тот же вид,
+        что и обычный ответ. Поля по мере генерации передаются в on_progress
+        не чаще раза в STREAM_PARSE_INTERVAL секунд.
+        """
+        async with get_session("aitunnel").post(
+            f"{self.base_url}/chat/completions",
+            json=payload,
+            headers=headers,
+        ) as response:
+            if response.status >= 500:
+                response.raise_for_status()
+            if response.status != 200:
+                data = await response.json() if response.status == 400 else {}
+                return response.status, data
+            if response.content_type != "text/event-stream":
+                return response.status, await response.json()
+
+            parts: list = []
+            usage: dict = {}
+            parsed_at = 0.0
+            async for raw_line in response.content:
+                line = raw_line.decode("utf-8").strip()
+                if not line.startswith("data:"):
+                    continue
+                chunk = line[len("data:") :].strip()
+                if chunk == "[DONE]":
+                    break
+
+                event = json.loads(chunk)
+                usage = event.get("usage") or usage
+                for choice in event.get("choices") or []:
+                    delta = (choice.get("delta") or {}).get("content")
+                    if delta:
+                        parts.append(delta)
+
+                now = time.monotonic()
+                if parts and now - parsed_at >= STREAM_PARSE_INTERVAL:
+                    parsed_at = now
+                    on_progress(parse_partial_analysis("".join(parts)))
+
+        if not parts:
+            raise ValueError("empty stream")
+        content = "".join(parts)
+        on_progress(parse_partial_analysis(content))
+        return 200, {"choices": [{"message": {"content": content}}], "usage": usage}
+
+    async def _request_completion(self, payload: dict, headers: dict):
+        """
+        Статус и тело ответа chat/completions. Ошибки сервера (5xx)
+        пробрасываются, чтобы их учитывал автоматический выключатель.
+        """
+        async with get_session("aitunnel").post(
+            f"{self.base_url}/chat/completions",
+            json=payload,
+            headers=headers,
+        ) as response:
+            if response.status >= 500:
+                response.raise_for_status()
+            data = await response.json() if response.status in (200, 400) else {}
+            return response.status, data
+
     def _parse_provider_error(self, error_data: dict) -> str:
         error_msg = error_data.get("error", {}).get(
             "message", "Неизвестная ошибка провайдера"
@@ -200,6 +405,19 @@ class AITunnelAnalyzer:
 
 Будь объективным и анализируй весь контекст диалога. Учитывай последовательность сообщений и взаимодействие между собеседниками."""
 
+    def _create_compact_system_prompt(self):
+        return """Ты эксперт по мошенничествам в переписках. Оцени диалог на признаки мошенничества.
+
+Ищи: просьбы о срочных переводах (в том числе от имени родственников и взломанных друзей), запросы CVV, кодов из СМС, паролей и кодов от Госуслуг, выдачу за сотрудников банков и полиции, «безопасные счета», сообщения о блокировке карты, выигрыши и компенсации, инвестиции с гарантированным доходом, предоплату без гарантий, подозрительные ссылки и приложения для удалённого доступа, давление срочностью и просьбы держать всё в секрете. Учитывай роли собеседников и кто начинает опасные темы.
+
+ФОРМАТ ОТВЕТА (ТОЛЬКО JSON):
+{
+    "risk_score": 0-100,
+    "scam_indicators": ["маркер: описание с цитатой из диалога"],
+    "analysis": "Анализ на русском с конкретными фразами из диалога.",
+    "confidence": 0.0-1.0
+}"""
+
     def _parse_success_response(self, data: dict, original_text: str) -> AnalysisResult:
         try:
             choice = data["choices"][0]
@@ -209,15 +427,22 @@ class AITunnelAnalyzer:
 
             usage = data.get("usage", {})
             total_tokens = usage.get("total_tokens", 0)
+            cost = estimate_cost(usage)
+
+            balance_checker = get_balance_checker()
+            if balance_checker:
+                balance_checker.charge(cost)
 
-            logger.info(f"Использовано токенов: {total_tokens}")
+            logger.info(f"Использовано токенов: {total_tokens}, ~{cost:.4f} RUB")
 
             return AnalysisResult(
                 risk_score=result_data.get("risk_score", 0),
                 scam_indicators=result_data.get("scam_indicators", []),
                 analysis=result_data.get("analysis", ""),
                 confidence=result_data.get("confidence", 0.5),
-                cost=0.0,
+                cost=cost,
+                prompt_tokens=usage.get("prompt_tokens", 0) or 0,
+                completion_tokens=usage.get("completion_tokens", 0) or 0,
             )
 
         except (KeyError, json.JSONDecodeError, IndexError) as e:
@@ -232,6 +457,7 @@ class AITunnelAnalyzer:
             analysis="Сервис анализа временно недоступен из-за недостатка средств. Попробуйте позже.",
             confidence=0.0,
             cost=0.0,
+            error=True,
         )
 
     def _create_rate_limit_result(self, text: str) -> AnalysisResult:
@@ -241,6 +467,7 @@ class AITunnelAnalyzer:
             analysis="Сервис перегружен. Попробуйте через несколько минут.",
             confidence=0.0,
             cost=0.0,
+            error=True,
         )
 
     def _create_error_result(self, text: str, error_msg: str) -> AnalysisResult:
@@ -250,19 +477,112 @@ class AITunnelAnalyzer:
             analysis=f"{error_msg}. Используется резервный анализ.",
             confidence=0.0,
             cost=0.0,
+            error=True,
         )
 
 
 ai_analyzer = None
+_ADMISSION: Optional[AdmissionQueue] = None
+
+_VERDICTS: NearDuplicateCache[AnalysisResult] = NearDuplicateCache(
+    settings.SCAM_CACHE_SIZE,
+    settings.SCAM_CACHE_TTL,
+    max_distance=settings.SCAM_CACHE_MAX_DISTANCE,
+    min_chars=settings.SCAM_CACHE_MIN_CHARS,
+    audit_rate=settings.SCAM_CACHE_AUDIT_RATE,
+)
+register_metrics("scam_cache", _VERDICTS.stats)
+
+_PREFILTER: Optional[ScamPrefilter] = None
+_PREFILTER_FAILED = False
+
+
+def get_prefilter() -> Optional[ScamPrefilter]:
+    """Локальный классификатор, если файл модели есть и открывается."""
+    global _PREFILTER, _PREFILTER_FAILED
+    if _PREFILTER is None and not _PREFILTER_FAILED:
+        path = settings.PREFILTER_MODEL_PATH or os.path.join(
+            settings.DATA_DIR, "scam_prefilter.json.gz"
+        )
+        if not os.path.exists(path):
+            _PREFILTER_FAILED = True
+            return None
+        try:
+            _PREFILTER = ScamPrefilter.load(
+                path,
+                scam_threshold=settings.PREFILTER_SCAM_THRESHOLD,
+                benign_threshold=settings.PREFILTER_BENIGN_THRESHOLD,
+                max_chars=settings.PREFILTER_MAX_CHARS,
+            )
+            register_metrics("scam_prefilter", _PREFILTER.stats)
+            logger.info(f"Локальный классификатор загружен: {path}")
+        except (OSError, ValueError, KeyError) as e:
+            _PREFILTER_FAILED = True
+            logger.error(f"Не удалось загрузить локальный классификатор {path}: {e}")
+    return _PREFILTER
+
+
+def _create_prefilter_result(verdict: PrefilterVerdict) -> AnalysisResult:
+    if verdict.decision == "scam":
+        return AnalysisResult(
+            risk_score=round(verdict.probability * 100),
+            scam_indicators=verdict.markers,
+            analysis=(
+                "Переписка содержит типичные признаки мошенничества. "
+                "Вердикт вынесен локальной проверкой без обращения к модели."
+            ),
+            confidence=verdict.probability,
+        )
+    return AnalysisResult(
+        risk_score=round(verdict.probability * 100),
+        scam_indicators=[],
+        analysis=(
+            "Типичных признаков мошенничества не найдено. "
+            "Вердикт вынесен локальной проверкой без обращения к модели."
+        ),
+        confidence=1 - verdict.probability,
+    )
 
 
 def init_ai_analyzer(api_key):
-    global ai_analyzer
+    global ai_analyzer, _ADMISSION
     ai_analyzer = AITunnelAnalyzer(api_key)
+    if _ADMISSION is None:
+        _ADMISSION = AdmissionQueue(
+            settings.AI_CONCURRENCY,
+            settings.AI_REQUESTS_PER_MINUTE,
+            settings.AI_QUEUE_MAX,
+            rate_limit_cooldown=settings.AI_RATE_LIMIT_COOLDOWN,
+        )
+        register_metrics("ai_queue", _ADMISSION.stats)
     return ai_analyzer
 
 
-async def analyze_message_safe(text: str) -> AnalysisResult:
+async def close_ai_analyzer() -> None:
+    global _ADMISSION
+    if _ADMISSION is not None:
+        await _ADMISSION.stop()
+        _ADMISSION = None
+
+
+def analysis_queue_wait(position: int) -> float:
+    """Примерное ожидание в секундах для позиции в очереди на анализ."""
+    if _ADMISSION is None:
+        return 0.0
+    return _ADMISSION.estimated_wait(position)
+
+
+async def analyze_message_safe(
+    text: str,
+    on_progress: Optional[Callable[[PartialAnalysis], None]] = None,
+    chat_type: str = "private",
+    on_queue: Optional[Callable[[int], None]] = None,
+) -> AnalysisResult:
+    """
+    Анализ переписки с локальной проверкой, кэшем и очередью к модели.
+    on_queue получает номер в очереди, пока запрос ждёт отправки.
+    Бросает QueueFullError, если очередь переполнена.
+    """
     if not ai_analyzer:
         api_key = settings.AI_TUNNEL_TOKEN
         if not api_key:
@@ -272,10 +592,58 @@ async def analyze_message_safe(text: str) -> AnalysisResult:
                 analysis="Сервис анализа не настроен. Проверьте конфигурацию AI_TUNNEL_API_KEY.",
                 confidence=0.0,
                 cost=0.0,
+                error=True,
             )
         init_ai_analyzer(api_key)
 
-    if len(text) > 4000:
-        text = text[:4000] + "... [текст обрезан]"
-
-    return await ai_analyzer.analyze_message(text)  # type: ignore
+    prefilter = get_prefilter()
+    if prefilter is not None:
+        verdict = prefilter.classify(text)
+        if verdict.decision is not None:
+            logger.info(f"Локальный вердикт: {verdict.decision}")
+            return _create_prefilter_result(verdict)
+
+    fingerprint = _VERDICTS.fingerprint(text)
+    cached = _VERDICTS.get(fingerprint) if fingerprint is not None else None
+    if cached is not None and not _VERDICTS.should_audit():
+        logger.info("Вердикт взят из кэша похожих переписок")
+        cached.cost = 0.0
+        return cached
+
+    prompt = build_prompt(
+        text,
+        ai_analyzer._create_enhanced_system_prompt(),  # type: ignore
+        ai_analyzer._create_compact_system_prompt(),  # type: ignore
+        settings.AI_PROMPT_TOKEN_BUDGET,
+        settings.AI_SYSTEM_PROMPT,
+    )
+    if prompt.dropped:
+        logger.info(f"Переписка сокращена: пропущено {prompt.dropped} сообщений")
+
+    priority = analysis_priority(
+        chat_type, len(prompt.user), settings.AI_LONG_TEXT_CHARS
+    )
+    try:
+        result = await _ADMISSION.run(  # type: ignore
+            lambda: ai_analyzer.analyze_message(  # type: ignore
+                prompt.user, on_progress, prompt.system
+            ),
+            priority,
+            on_queue,
+        )
+    except RateLimitedError:
+        return ai_analyzer._create_rate_limit_result(text)  # type: ignore
+    if result.error:
+        return result
+
+    record_usage(prompt, result.prompt_tokens, result.completion_tokens)
+    if fingerprint is None:
+        return result
+
+    if cached is not None:
+        _VERDICTS.record_divergence(
+            abs(result.risk_score - cached.risk_score),
+            (result.risk_score >= RISKY_SCORE) != (cached.risk_score >= RISKY_SCORE),
+        )
+    _VERDICTS.set(fingerprint, result)
+    return result
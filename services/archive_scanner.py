@@ -0,0 +1,225 @@
+import hashlib
+import lzma
+import posixpath
+import tarfile
+import zipfile
+import zlib
+from typing import BinaryIO, Callable, IO, Iterator, List, Optional, Tuple
+
+from services.attachments import spooled_file
+
+CHUNK_SIZE = 256 * 1024
+SPOOL_MEMORY = 4 * 1024 * 1024
+# Коэффициент сжатия проверяется только для крупных файлов: мелкие текстовые
+# файлы законно сжимаются в сотни раз.
+RATIO_CHECK_MIN_SIZE = 10 * 1024 * 1024
+
+ZIP_EXTENSIONS = (".zip",)
+TAR_EXTENSIONS = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+
+EntryOpener = Callable[[], IO[bytes]]
+
+
+class ArchiveBombError(Exception):
+    pass
+
+
+class UnsupportedArchiveError(Exception):
+    pass
+
+
+class ArchiveLimits:
+    def __init__(
+        self,
+        max_members: int,
+        max_total_size: int,
+        max_ratio: float,
+        max_depth: int,
+        tmp_dir: Optional[str] = None,
+    ):
+        self.max_members = max_members
+        self.max_total_size = max_total_size
+        self.max_ratio = max_ratio
+        self.max_depth = max_depth
+        self.tmp_dir = tmp_dir
+
+
+class ArchiveMember:
+    def __init__(self, path: Tuple[str, ...], sha256: str, size: int, expanded: bool):
+        self.path = path
+        self.sha256 = sha256
+        self.size = size
+        # Вложенный архив, содержимое которого тоже разобрано.
+        self.expanded = expanded
+
+    @property
+    def name(self) -> str:
+        return " / ".join(self.path)
+
+
+def is_archive_name(filename: Optional[str]) -> bool:
+    """Архив, который имеет смысл распаковать (офисные zip-форматы не трогаем)."""
+    if not filename:
+        return False
+    filename = filename.lower()
+    return filename.endswith(ZIP_EXTENSIONS) or filename.endswith(TAR_EXTENSIONS)
+
+
+def _iter_entries(
+    file: BinaryIO,
+) -> Iterator[Tuple[str, int, Optional[int], EntryOpener]]:
+    """(имя, заявленный размер, сжатый размер, открыть на чтение) для файлов архива."""
+    file.seek(0)
+    if zipfile.is_zipfile(file):
+        file.seek(0)
+        try:
+            archive = zipfile.ZipFile(file)
+        except zipfile.BadZipFile as e:
+            raise UnsupportedArchiveError(str(e)) from e
+
+        with archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                if info.flag_bits & 0x1:
+                    raise UnsupportedArchiveError("encrypted zip member")
+                yield info.filename, info.file_size, info.compress_size, (
+                    lambda info=info: archive.open(info)
+                )
+        return
+
+    file.seek(0)
+    try:
+        archive = tarfile.open(fileobj=file, mode="r:*")
+    except (tarfile.TarError, EOFError, OSError) as e:
+        raise UnsupportedArchiveError(str(e)) from e
+
+    with archive:
+        for info in archive:
+            if not info.isfile():
+                continue
+            yield info.name, info.size, None, (
+                lambda info=info: archive.extractfile(info)  # type: ignore
+            )
+
+
+class _Budget:
+    def __init__(self, limits: ArchiveLimits, archive_size: int):
+        self.limits = limits
+        self.archive_size = max(archive_size, 1)
+        self.members = 0
+        self.total_size = 0
+
+    def add_member(self, declared: int, compressed: Optional[int]) -> None:
+        self.members += 1
+        if self.members > self.limits.max_members:
+            raise ArchiveBombError(f"more than {self.limits.max_members} members")
+        if (
+            compressed is not None
+            and declared > RATIO_CHECK_MIN_SIZE
+            and declared > self.limits.max_ratio * max(compressed, 1)
+        ):
+            raise ArchiveBombError(f"compression ratio above {self.limits.max_ratio}")
+
+    def consume(self, size: int) -> None:
+        # Заявленным размерам в заголовках не верим: считаем реально прочитанное.
+        self.total_size += size
+        if self.total_size > self.limits.max_total_size:
+            raise ArchiveBombError(f"unpacked size above {self.limits.max_total_size}")
+        if (
+            self.total_size > RATIO_CHECK_MIN_SIZE
+            and self.total_size > self.limits.max_ratio * self.archive_size
+        ):
+            raise ArchiveBombError(f"compression ratio above {self.limits.max_ratio}")
+
+
+def _spool(limits: ArchiveLimits, name: str) -> IO[bytes]:
+    return spooled_file(
+        posixpath.basename(name), max_size=SPOOL_MEMORY, dir=limits.tmp_dir
+    )
+
+
+def _walk(
+    file: BinaryIO,
+    prefix: Tuple[str, ...],
+    depth: int,
+    budget: _Budget,
+    members: List[ArchiveMember],
+) -> None:
+    for name, declared, compressed, opener in _iter_entries(file):
+        budget.add_member(declared, compressed)
+        path = prefix + (name,)
+        nested = depth < budget.limits.max_depth and is_archive_name(name)
+        spool = _spool(budget.limits, name) if nested else None
+
+        try:
+            digest = hashlib.sha256()
+            size = 0
+            with opener() as source:
+                while chunk := source.read(CHUNK_SIZE):
+                    budget.consume(len(chunk))
+                    size += len(chunk)
+                    digest.update(chunk)
+                    if spool is not None:
+                        spool.write(chunk)
+
+            member = ArchiveMember(path, digest.hexdigest(), size, expanded=False)
+            members.append(member)
+
+            if spool is not None:
+                try:
+                    _walk(spool, path, depth + 1, budget, members)  # type: ignore
+                    member.expanded = True
+                except UnsupportedArchiveError:
+                    pass
+        except (
+            zipfile.BadZipFile,
+            tarfile.TarError,
+            RuntimeError,
+            EOFError,
+            OSError,
+            zlib.error,
+            lzma.LZMAError,
+        ) as e:
+            raise UnsupportedArchiveError(str(e)) from e
+        finally:
+            if spool is not None:
+                spool.close()
+
+
+def hash_archive_members(
+    file: BinaryIO, archive_size: int, limits: ArchiveLimits
+) -> List[ArchiveMember]:
+    """
+    Потоково распаковывает архив (zip, tar.*; вложенные — до limits.max_depth)
+    и считает SHA-256 каждого файла. Блокирующая функция, вызывать в потоке.
+    Бросает ArchiveBombError при превышении лимитов и UnsupportedArchiveError
+    для зашифрованных или повреждённых архивов.
+    """
+    members: List[ArchiveMember] = []
+    _walk(file, (), 0, _Budget(limits, archive_size), members)
+    return members
+
+
+def extract_member(
+    file: BinaryIO, path: Tuple[str, ...], limits: ArchiveLimits
+) -> IO[bytes]:
+    """Извлекает файл архива (в т. ч. из вложенных архивов) во временный буфер."""
+    current: BinaryIO = file
+    for name in path:
+        spool = None
+        for entry_name, _, _, opener in _iter_entries(current):
+            if entry_name == name:
+                spool = _spool(limits, name)
+                with opener() as source:
+                    while chunk := source.read(CHUNK_SIZE):
+                        spool.write(chunk)
+                spool.seek(0)
+                break
+
+        if current is not file:
+            current.close()
+        if spool is None:
+            raise FileNotFoundError(" / ".join(path))
+        current = spool  # type: ignore
+    return current
@@ -0,0 +1,146 @@
+import asyncio
+import hashlib
+import logging
+import tempfile
+from typing import IO, Awaitable, Callable, Optional, TypeVar
+
+import aiohttp
+
+from config import settings
+from services.http import get_session
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class AttachmentTooLarge(Exception):
+    pass
+
+
+class AttachmentDownloadError(Exception):
+    pass
+
+
+class _SpooledAttachment(tempfile.SpooledTemporaryFile):
+    """
+    SpooledTemporaryFile с исходным именем файла (его видит VirusTotal).
+    Пока файл удерживается через hold(), close() откладывается до последнего
+    release(): так общий запрос может дочитать файл, даже если вызвавший его
+    обработчик уже завершился.
+    """
+
+    def __init__(self, filename: str, **kwargs):
+        super().__init__(**kwargs)
+        self._filename = filename
+        self._holds = 0
+        self._close_pending = False
+
+    @property
+    def name(self):
+        return self._filename
+
+    def hold(self) -> None:
+        self._holds += 1
+
+    def release(self) -> None:
+        self._holds -= 1
+        if not self._holds and self._close_pending:
+            self._close_pending = False
+            super().close()
+
+    def close(self) -> None:
+        if self._holds:
+            self._close_pending = True
+            return
+        super().close()
+
+
+def spooled_file(filename: str, max_size: int, dir: Optional[str] = None) -> IO[bytes]:
+    """
+    Временный буфер с именем файла: держится в памяти до max_size байт,
+    дальше уходит во временный файл в dir. Поддерживает keep_open.
+    """
+    return _SpooledAttachment(filename, max_size=max_size, dir=dir)
+
+
+def keep_open(
+    file: IO[bytes], fn: Callable[[], Awaitable[T]]
+) -> Callable[[], "asyncio.Future[T]"]:
+    """
+    Оборачивает fn для SingleFlight: файл вызывающего не закрывается, пока
+    общий запрос не завершится, даже если сам вызывающий уже ушёл.
+    """
+
+    def start() -> "asyncio.Future[T]":
+        task = asyncio.ensure_future(fn())
+        if isinstance(file, _SpooledAttachment):
+            file.hold()
+            task.add_done_callback(lambda _: file.release())
+        return task
+
+    return start
+
+
+class DownloadedAttachment:
+    def __init__(self, file: _SpooledAttachment, sha256: str, size: int):
+        self.file = file
+        self.sha256 = sha256
+        self.size = size
+
+    @property
+    def filename(self) -> str:
+        return self.file.name
+
+    def close(self) -> None:
+        self.file.close()
+
+
+async def download_attachment(
+    url: str, filename: Optional[str] = None
+) -> DownloadedAttachment:
+    """
+    Потоково скачивает вложение MAX: SHA-256 считается на лету, содержимое
+    держится в памяти и только сверх ATTACHMENT_SPOOL_MEMORY уходит во временный
+    файл (tmpfs). Файлы больше VT_MAX_FILE_SIZE отклоняются.
+    """
+    max_size = settings.VT_MAX_FILE_SIZE
+    spool_size = settings.ATTACHMENT_SPOOL_MEMORY
+    buffer = _SpooledAttachment(
+        filename or "attachment",
+        max_size=spool_size,
+        dir=settings.TMP_DIR,
+    )
+    digest = hashlib.sha256()
+    size = 0
+
+    try:
+        async with get_session("max_cdn").get(url) as resp:
+            if not resp.ok:
+                raise AttachmentDownloadError(f"MAX CDN status {resp.status}")
+            if resp.content_length and resp.content_length > max_size:
+                raise AttachmentTooLarge(resp.content_length)
+
+            chunk_size = settings.ATTACHMENT_CHUNK_SIZE
+            async for chunk in resp.content.iter_chunked(chunk_size):
+                size += len(chunk)
+                if size > max_size:
+                    raise AttachmentTooLarge(size)
+
+                digest.update(chunk)
+                # Пока данные помещаются в память, запись мгновенная;
+                # после переноса на диск пишем вне event loop.
+                if size > spool_size:
+                    await asyncio.to_thread(buffer.write, chunk)
+                else:
+                    buffer.write(chunk)
+    except aiohttp.ClientError as e:
+        buffer.close()
+        raise AttachmentDownloadError(str(e)) from e
+    except BaseException:
+        buffer.close()
+        raise
+
+    buffer.seek(0)
+    logger.info(f"Вложение скачано: {size} байт, sha256={digest.hexdigest()}")
+    return DownloadedAttachment(buffer, digest.hexdigest(), size)
@@ -1,40 +1,80 @@
+import asyncio
 import aiohttp
 import logging
+import time
+from typing import Any, Dict, Optional
+from config import settings
+from services.http import get_session
+from services.metrics import register_metrics
 
 logger = logging.getLogger(__name__)
 
 
+def estimate_cost(usage: Dict[str, Any]) -> float:
+    """Стоимость запроса к модели в рублях по числу токенов из ответа API."""
+    prompt = usage.get("prompt_tokens", 0) or 0
+    completion = usage.get("completion_tokens", 0) or 0
+    return (
+        prompt * settings.AI_PRICE_PROMPT_PER_MILLION
+        + completion * settings.AI_PRICE_COMPLETION_PER_MILLION
+    ) / 1_000_000
+
+
 class BalanceChecker:
-    def __init__(self, api_key):
+    """
+    Баланс AI Tunnel с локальным учётом расходов. Фоновая задача обновляет его
+    раз в refresh_interval, а когда он приближается к min_balance —
+    раз в low_refresh_interval. Между обновлениями стоимость каждого анализа
+    списывается из закэшированного значения, без запросов к API.
+    """
+
+    def __init__(
+        self,
+        api_key,
+        min_balance: float = settings.AI_MIN_BALANCE,
+        refresh_interval: float = settings.AI_BALANCE_REFRESH_INTERVAL,
+        low_refresh_interval: float = settings.AI_BALANCE_LOW_REFRESH_INTERVAL,
+        low_margin: float = settings.AI_BALANCE_LOW_MARGIN,
+    ):
         self.api_key = api_key
         self.base_url = "https://api.aitunnel.ru/v1"
+        self.min_balance = min_balance
+        self.refresh_interval = refresh_interval
+        self.low_refresh_interval = low_refresh_interval
+        self.low_margin = low_margin
+
+        self.balance: Optional[float] = None
+        self.updated_at = 0.0
+        self.spent_since_refresh = 0.0
+        self.refreshes = 0
+        self.refresh_errors = 0
+
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
 
     async def get_balance(self):
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json",
-        }
+        headers = {"Authorization": f"Bearer {self.api_key}"}
 
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(
-                    f"{self.base_url}/aitunnel/balance", headers=headers
-                ) as response:
-
-                    if response.status == 200:
-                        data = await response.json()
-                        balance = data.get("balance", 0)
-                        logger.info(f"Баланс AI Tunnel: {balance} RUB")
-                        return balance
-                    elif response.status == 401:
-                        logger.error("Неверный API ключ AI Tunnel")
-                        return None
-                    elif response.status == 429:
-                        logger.error("Превышен лимит запросов к API статистики")
-                        return None
-                    else:
-                        logger.error(f"Ошибка получения баланса: {response.status}")
-                        return None
+            async with get_session("aitunnel").get(
+                f"{self.base_url}/aitunnel/balance", headers=headers
+            ) as response:
+
+                if response.status == 200:
+                    data = await response.json()
+                    balance = data.get("balance", 0)
+                    logger.info(f"Баланс AI Tunnel: {balance} RUB")
+                    return balance
+                elif response.status == 401:
+                    logger.error("Неверный API ключ AI Tunnel")
+                    return None
+                elif response.status == 429:
+                    logger.error("Превышен лимит запросов к API статистики")
+                    return None
+                else:
+                    logger.error(f"Ошибка получения баланса: {response.status}")
+                    return None
 
         except aiohttp.ClientError as e:
             logger.error(f"Сетевая ошибка при проверке баланса: {e}")
@@ -43,6 +83,84 @@ class BalanceChecker:
             logger.error(f"Неожиданная ошибка при проверке баланса: {e}")
             return None
 
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.updated_at if self.updated_at else float("inf")
+
+    @property
+    def is_low(self) -> bool:
+        return (
+            self.balance is not None
+            and self.balance < self.min_balance + self.low_margin
+        )
+
+    async def refresh(self, max_age: float = 0.0) -> Optional[float]:
+        """
+        Запрашивает баланс у API, если закэшированное значение старше max_age
+        секунд. Одновременные вызовы делают один запрос.
+        """
+        async with self._lock:
+            if self.balance is not None and self.age <= max_age:
+                return self.balance
+
+            balance = await self.get_balance()
+            if balance is None:
+                self.refresh_errors += 1
+                return self.balance
+
+            self.balance = float(balance)
+            self.updated_at = time.monotonic()
+            self.spent_since_refresh = 0.0
+            self.refreshes += 1
+            return self.balance
+
+    def charge(self, amount: float) -> None:
+        """Списывает стоимость анализа из закэшированного баланса."""
+        if self.balance is None or amount <= 0:
+            return
+        was_low = self.is_low
+        self.balance -= amount
+        self.spent_since_refresh += amount
+        if self.is_low and not was_low:
+            self._wakeup.set()
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            # Не чаще раза в low_refresh_interval, даже если баланс резко упал.
+            await asyncio.sleep(max(self.low_refresh_interval - self.age, 0.0))
+            await self.refresh()
+
+            interval = (
+                self.low_refresh_interval if self.is_low else self.refresh_interval
+            )
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "balance": round(self.balance, 2) if self.balance is not None else "-",
+            "spent_since_refresh": round(self.spent_since_refresh, 4),
+            "age_s": int(self.age) if self.updated_at else "-",
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+        }
+
 
 _balance_checker_instance = None
 
@@ -54,4 +172,5 @@ def get_balance_checker():
 def init_balance_checker(api_key):
     global _balance_checker_instance
     _balance_checker_instance = BalanceChecker(api_key)
+    register_metrics("ai_balance", _balance_checker_instance.stats)
     return _balance_checker_instance
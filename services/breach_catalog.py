@@ -0,0 +1,293 @@
+"""
+Локальный каталог утечек по списку XposedOrNot (/v1/breaches): дата утечки,
+число записей и типы утёкших данных. Каталог хранится в SQLite, при старте
+загружается в память и раз в BREACH_CATALOG_SYNC_INTERVAL обновляется в фоне,
+так что обогащение результатов провайдеров не требует отдельных запросов.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import aiohttp
+from pydantic import BaseModel, Field
+
+from config import settings
+from services.http import get_session
+from services.metrics import register_metrics
+
+logger = logging.getLogger(__name__)
+
+BREACHES_URL = "https://api.xposedornot.com/v1/breaches"
+SYNC_TIMEOUT = 60.0
+RETRY_DELAY = 15 * 60
+
+
+class BreachRecord(BaseModel):
+    name: str
+    domain: Optional[str] = None
+    breach_date: Optional[datetime] = None
+    records: Optional[int] = None
+    data_classes: List[str] = Field(default_factory=list)
+
+
+def canonical_breach_name(name: Optional[str]) -> str:
+    """
+    Каноническое имя утечки: "VK", "vk.com" и "Vk.Com" — это "vk".
+    Буквы любых алфавитов сохраняются; у безымянной утечки имя пустое.
+    """
+    name = re.sub(r"\.(com|net|org|ru|io)$", "", (name or "").strip().lower())
+    return re.sub(r"[\W_]", "", name, flags=re.UNICODE)
+
+
+def _parse_date(value: Any) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+
+def parse_breaches(data: Dict[str, Any]) -> List[BreachRecord]:
+    """Разбирает ответ /v1/breaches, пропуская записи без имени."""
+    records: List[BreachRecord] = []
+    for entry in data.get("exposedBreaches") or []:
+        name = entry.get("breachID")
+        if not name:
+            continue
+
+        data_classes = entry.get("exposedData") or []
+        if isinstance(data_classes, str):
+            data_classes = [c.strip() for c in data_classes.split(";") if c.strip()]
+
+        exposed = entry.get("exposedRecords")
+        records.append(
+            BreachRecord(
+                name=name,
+                domain=entry.get("domain") or None,
+                breach_date=_parse_date(entry.get("breachedDate")),
+                records=int(exposed) if isinstance(exposed, (int, float)) else None,
+                data_classes=[str(c) for c in data_classes],
+            )
+        )
+    return records
+
+
+async def fetch_breaches() -> List[BreachRecord]:
+    async with get_session("xon").get(
+        BREACHES_URL, timeout=aiohttp.ClientTimeout(total=SYNC_TIMEOUT)
+    ) as resp:
+        resp.raise_for_status()
+        data = await resp.json()
+    return parse_breaches(data)
+
+
+class BreachCatalog:
+    """
+    Каталог утечек: SQLite на диске (таблица утечек и индекс по каноническим
+    именам и доменам) и словарь в памяти для поиска без обращения к диску.
+    """
+
+    def __init__(
+        self,
+        db_path: Optional[str],
+        sync_interval: float,
+        fetch: Callable[[], Awaitable[List[BreachRecord]]] = fetch_breaches,
+    ):
+        self.db_path = db_path
+        self.sync_interval = sync_interval
+        self.fetch = fetch
+
+        self._by_key: Dict[str, BreachRecord] = {}
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+        self.synced_at = 0.0
+        self.syncs = 0
+        self.sync_errors = 0
+
+    def open(self) -> None:
+        if not self.db_path or self._db is not None:
+            return
+
+        try:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            db = sqlite3.connect(self.db_path, check_same_thread=False)
+            db.executescript(
+                "CREATE TABLE IF NOT EXISTS breaches ("
+                "name TEXT PRIMARY KEY, domain TEXT, breach_date TEXT, "
+                "records INTEGER, data_classes TEXT NOT NULL);"
+                "CREATE TABLE IF NOT EXISTS breach_keys ("
+                "key TEXT PRIMARY KEY, name TEXT NOT NULL);"
+                "CREATE TABLE IF NOT EXISTS meta ("
+                "key TEXT PRIMARY KEY, value REAL NOT NULL);"
+            )
+            records = [
+                BreachRecord(
+                    name=name,
+                    domain=domain,
+                    breach_date=_parse_date(breach_date),
+                    records=count,
+                    data_classes=json.loads(data_classes),
+                )
+                for name, domain, breach_date, count, data_classes in db.execute(
+                    "SELECT name, domain, breach_date, records, data_classes "
+                    "FROM breaches"
+                )
+            ]
+            row = db.execute(
+                "SELECT value FROM meta WHERE key = 'synced_at'"
+            ).fetchone()
+            self._by_key = self._index(records)
+            self.synced_at = row[0] if row else 0.0
+            self._db = db
+            logger.info(f"Каталог утечек открыт: {len(records)} утечек")
+        except (sqlite3.Error, OSError, ValueError) as e:
+            logger.error(f"Не удалось открыть каталог утечек {self.db_path}: {e}")
+
+    def close(self) -> None:
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    @staticmethod
+    def _index(records: List[BreachRecord]) -> Dict[str, BreachRecord]:
+        by_key: Dict[str, BreachRecord] = {}
+        for record in records:
+            for key in (
+                canonical_breach_name(record.name),
+                canonical_breach_name(record.domain),
+            ):
+                if key:
+                    by_key.setdefault(key, record)
+        return by_key
+
+    def __len__(self) -> int:
+        return len({record.name for record in self._by_key.values()})
+
+    def lookup(self, site: Optional[str]) -> Optional[BreachRecord]:
+        """Утечка по имени или домену в любом написании."""
+        return self._by_key.get(canonical_breach_name(site))
+
+    async def sync(self) -> None:
+        records = await self.fetch()
+        if not records:
+            raise ValueError("empty breach listing")
+
+        by_key = self._index(records)
+        if self._db is not None:
+            await asyncio.to_thread(self._db_replace, records, by_key)
+        self._by_key = by_key
+        self.synced_at = time.time()
+        self.syncs += 1
+        logger.info(f"Каталог утечек обновлён: {len(records)} утечек")
+
+    def _db_replace(
+        self, records: List[BreachRecord], by_key: Dict[str, BreachRecord]
+    ) -> None:
+        with self._db_lock:
+            if self._db is None:
+                return
+            try:
+                with self._db:
+                    self._db.execute("DELETE FROM breaches")
+                    self._db.execute("DELETE FROM breach_keys")
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO breaches VALUES (?, ?, ?, ?, ?)",
+                        [
+                            (
+                                r.name,
+                                r.domain,
+                                r.breach_date.isoformat() if r.breach_date else None,
+                                r.records,
+                                json.dumps(r.data_classes, ensure_ascii=False),
+                            )
+                            for r in records
+                        ],
+                    )
+                    self._db.executemany(
+                        "INSERT INTO breach_keys VALUES (?, ?)",
+                        [(key, r.name) for key, r in by_key.items()],
+                    )
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO meta VALUES ('synced_at', ?)",
+                        (time.time(),),
+                    )
+            except sqlite3.Error as e:
+                logger.error(f"Не удалось сохранить каталог утечек: {e}")
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        delay = max(self.synced_at + self.sync_interval - time.time(), 0.0)
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                await self.sync()
+                delay = self.sync_interval
+            except Exception as e:
+                self.sync_errors += 1
+                logger.warning(f"Не удалось обновить каталог утечек: {e}")
+                delay = min(RETRY_DELAY, self.sync_interval)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "breaches": len(self),
+            "age_hours": (
+                round((time.time() - self.synced_at) / 3600, 1)
+                if self.synced_at
+                else "-"
+            ),
+            "syncs": self.syncs,
+            "sync_errors": self.sync_errors,
+        }
+
+
+_CATALOG: Optional[BreachCatalog] = None
+
+
+def get_breach_catalog() -> Optional[BreachCatalog]:
+    return _CATALOG
+
+
+async def setup_breach_catalog() -> BreachCatalog:
+    """Открывает каталог утечек и запускает его фоновое обновление."""
+    global _CATALOG
+    if _CATALOG is None:
+        _CATALOG = BreachCatalog(
+            os.path.join(settings.DATA_DIR, "breach_catalog.sqlite3"),
+            sync_interval=settings.BREACH_CATALOG_SYNC_INTERVAL,
+        )
+        await asyncio.to_thread(_CATALOG.open)
+        register_metrics("breach_catalog", _CATALOG.stats)
+    _CATALOG.start()
+    return _CATALOG
+
+
+async def close_breach_catalog() -> None:
+    global _CATALOG
+    if _CATALOG is not None:
+        await _CATALOG.stop()
+        await asyncio.to_thread(_CATALOG.close)
+        _CATALOG = None
@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Optional, Set
+
+from services.rate_limit import TokenBucket
+from services.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+MAX_TRACKED_CHATS = 10_000
+MAX_SEEN_KEYS = 100_000
+BUCKET_IDLE_TTL = 24 * 60 * 60
+
+
+class GroupScanner:
+    """
+    Пассивная проверка ссылок и файлов в группах, где её включил администратор.
+    Решает, стоит ли тратить квоту VirusTotal на очередную ссылку из чата:
+    повторы в пределах окна пропускаются, у каждого чата свой бюджет запросов,
+    а при длинной очереди к VirusTotal проверяется лишь часть сообщений.
+    """
+
+    def __init__(
+        self,
+        db_path: Optional[str],
+        dedupe_window: float,
+        chat_requests_per_hour: float,
+        chat_burst: float,
+        queue_soft_limit: int,
+        queue_hard_limit: int,
+        queue_size: Callable[[], int],
+    ):
+        self.db_path = db_path
+        self.dedupe_window = dedupe_window
+        self.chat_rate = chat_requests_per_hour / 3600
+        self.chat_burst = chat_burst
+        self.queue_soft_limit = queue_soft_limit
+        self.queue_hard_limit = queue_hard_limit
+        self.queue_size = queue_size
+
+        self._enabled: Set[int] = set()
+        self._seen: TTLCache[bool] = TTLCache(MAX_SEEN_KEYS, dedupe_window)
+        self._buckets: TTLCache[TokenBucket] = TTLCache(
+            MAX_TRACKED_CHATS, BUCKET_IDLE_TTL
+        )
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+
+        self.admitted = 0
+        self.duplicates = 0
+        self.over_budget = 0
+        self.sampled_out = 0
+
+    def open(self) -> None:
+        if not self.db_path or self._db is not None:
+            return
+
+        try:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            db = sqlite3.connect(self.db_path, check_same_thread=False)
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS group_scan ("
+                "chat_id INTEGER PRIMARY KEY, enabled_by INTEGER, "
+                "enabled_at REAL NOT NULL)"
+            )
+            db.commit()
+            self._enabled = {
+                row[0] for row in db.execute("SELECT chat_id FROM group_scan")
+            }
+            self._db = db
+            logger.info(f"Пассивная проверка включена в чатах: {len(self._enabled)}")
+        except sqlite3.Error as e:
+            logger.error(f"Не удалось открыть настройки групп {self.db_path}: {e}")
+
+    def close(self) -> None:
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def is_enabled(self, chat_id: int) -> bool:
+        return chat_id in self._enabled
+
+    async def set_enabled(self, chat_id: int, user_id: int, enabled: bool) -> None:
+        if enabled:
+            self._enabled.add(chat_id)
+        else:
+            self._enabled.discard(chat_id)
+            self._buckets.pop(chat_id)
+
+        if self._db is not None:
+            await asyncio.to_thread(self._db_set_enabled, chat_id, user_id, enabled)
+
+    def _db_set_enabled(self, chat_id: int, user_id: int, enabled: bool) -> None:
+        with self._db_lock:
+            if self._db is None:
+                return
+            try:
+                if enabled:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO group_scan VALUES (?, ?, ?)",
+                        (chat_id, user_id, time.time()),
+                    )
+                else:
+                    self._db.execute(
+                        "DELETE FROM group_scan WHERE chat_id = ?", (chat_id,)
+                    )
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.error(f"Не удалось сохранить настройку чата {chat_id}: {e}")
+
+    def seen(self, chat_id: int, key: Hashable) -> bool:
+        """Проверялось ли это в чате за последние dedupe_window секунд."""
+        return self._seen.get((chat_id, key)) is not None
+
+    def mark_seen(self, chat_id: int, key: Hashable) -> None:
+        self._seen.set((chat_id, key), True)
+
+    def forget(self, chat_id: int, key: Hashable) -> None:
+        """Снимает отметку о проверке, например если она не удалась."""
+        self._seen.pop((chat_id, key))
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(rate=self.chat_rate, capacity=self.chat_burst)
+            self._buckets.set(chat_id, bucket)
+        return bucket
+
+    def has_budget(self, chat_id: int, cost: float = 1.0) -> bool:
+        """Хватит ли бюджета чата на cost запросов; сам бюджет не тратится."""
+        return self._bucket(chat_id).tokens >= min(cost, self.chat_burst)
+
+    def admit(self, chat_id: int, key: Hashable, cost: float = 1.0) -> bool:
+        """
+        Можно ли потратить на проверку cost запросов VirusTotal из бюджета чата.
+        При успехе ключ запоминается, и повтор в пределах окна не проверяется.
+        """
+        if self.seen(chat_id, key):
+            self.duplicates += 1
+            return False
+
+        queue_size = self.queue_size()
+        if queue_size >= self.queue_hard_limit or (
+            queue_size > self.queue_soft_limit
+            and random.random() > self.queue_soft_limit / queue_size
+        ):
+            self.sampled_out += 1
+            return False
+
+        if not self._bucket(chat_id).try_acquire(cost):
+            self.over_budget += 1
+            return False
+
+        self.mark_seen(chat_id, key)
+        self.admitted += 1
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled_chats": len(self._enabled),
+            "admitted": self.admitted,
+            "duplicates": self.duplicates,
+            "over_budget": self.over_budget,
+            "sampled_out": self.sampled_out,
+        }
@@ -0,0 +1,163 @@
+import asyncio
+import logging
+from collections import Counter
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from config import settings
+from services.metrics import register_metrics
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = "max-infosec-bot"
+WARM_UP_TIMEOUT = 5.0
+
+
+class ServiceConfig:
+    def __init__(
+        self,
+        origin: Optional[str],
+        total_timeout: Optional[float],
+        read_timeout: Optional[float] = None,
+        headers: Optional[Dict[str, str]] = None,
+    ):
+        self.origin = origin
+        self.total_timeout = total_timeout
+        self.read_timeout = read_timeout
+        self.headers = headers or {}
+
+
+# Внешние сервисы бота: адрес для прогрева соединений, таймауты и заголовки.
+SERVICES: Dict[str, ServiceConfig] = {
+    # Add-Padding: ответы дополняются фиктивными записями до одного размера,
+    # чтобы по длине ответа нельзя было угадать префикс.
+    "pwned": ServiceConfig(
+        "https://api.pwnedpasswords.com",
+        settings.PWNED_TIMEOUT,
+        headers={"Add-Padding": "true"},
+    ),
+    "xon": ServiceConfig(
+        "https://api.xposedornot.com",
+        settings.XON_TIMEOUT,
+        headers={"Accept": "application/json"},
+    ),
+    "leaklookup": ServiceConfig(
+        "https://leak-lookup.com",
+        settings.LEAKLOOKUP_TIMEOUT,
+        headers={"Accept": "application/json"},
+    ),
+    "aitunnel": ServiceConfig(
+        "https://api.aitunnel.ru",
+        settings.AI_REQUEST_TIMEOUT,
+        headers={"Accept": "application/json"},
+    ),
+    # Вложения могут скачиваться долго: ограничиваем паузы в чтении, а не общее время.
+    "max_cdn": ServiceConfig(None, None, read_timeout=30.0),
+}
+
+_CONNECTOR: aiohttp.TCPConnector | None = None
+_SESSIONS: Dict[str, aiohttp.ClientSession] = {}
+_STATS: Counter = Counter()
+
+
+def create_connector() -> aiohttp.TCPConnector:
+    """TCPConnector с пулом keep-alive соединений и кэшем DNS."""
+    return aiohttp.TCPConnector(
+        limit=settings.HTTP_POOL_SIZE,
+        limit_per_host=settings.HTTP_POOL_SIZE_PER_HOST,
+        use_dns_cache=True,
+        ttl_dns_cache=settings.HTTP_DNS_CACHE_TTL,
+        keepalive_timeout=settings.HTTP_KEEPALIVE_TIMEOUT,
+    )
+
+
+def _counter(name: str):
+    async def on_event(*_: Any) -> None:
+        _STATS[name] += 1
+
+    return on_event
+
+
+def _trace_config() -> aiohttp.TraceConfig:
+    """Счётчики запросов, новых и переиспользованных соединений, кэша DNS."""
+    trace = aiohttp.TraceConfig()
+    trace.on_request_start.append(_counter("requests"))
+    trace.on_connection_create_end.append(_counter("connections_created"))
+    trace.on_connection_reuseconn.append(_counter("connections_reused"))
+    trace.on_dns_cache_hit.append(_counter("dns_cache_hits"))
+    trace.on_dns_cache_miss.append(_counter("dns_cache_misses"))
+    return trace
+
+
+def get_session(service: str) -> aiohttp.ClientSession:
+    """
+    Сессия для внешнего сервиса с его таймаутами и заголовками.
+    Все сессии работают поверх одного пула соединений.
+    """
+    global _CONNECTOR
+    session = _SESSIONS.get(service)
+    if session is not None and not session.closed:
+        return session
+
+    config = SERVICES[service]
+    if _CONNECTOR is None or _CONNECTOR.closed:
+        _CONNECTOR = create_connector()
+
+    session = aiohttp.ClientSession(
+        connector=_CONNECTOR,
+        connector_owner=False,
+        timeout=aiohttp.ClientTimeout(
+            total=config.total_timeout,
+            sock_connect=settings.HTTP_CONNECT_TIMEOUT,
+            sock_read=config.read_timeout,
+        ),
+        headers={"User-Agent": USER_AGENT, **config.headers},
+        trace_configs=[_trace_config()],
+    )
+    _SESSIONS[service] = session
+    return session
+
+
+async def _warm_up_service(service: str, origin: str) -> None:
+    try:
+        async with get_session(service).head(
+            origin, timeout=aiohttp.ClientTimeout(total=WARM_UP_TIMEOUT)
+        ):
+            pass
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.warning(
+            f"Не удалось прогреть соединение с {urlsplit(origin).hostname}: {e}"
+        )
+
+
+async def warm_up_http_clients() -> None:
+    """Заранее устанавливает TLS-соединения с внешними сервисами."""
+    await asyncio.gather(
+        *(
+            _warm_up_service(service, config.origin)
+            for service, config in SERVICES.items()
+            if config.origin
+        )
+    )
+    logger.info("HTTP-соединения с внешними сервисами прогреты")
+
+
+async def close_http_clients() -> None:
+    global _CONNECTOR
+    for session in _SESSIONS.values():
+        await session.close()
+    _SESSIONS.clear()
+
+    if _CONNECTOR is not None:
+        await _CONNECTOR.close()
+        _CONNECTOR = None
+        logger.info("HTTP-клиенты закрыты")
+
+
+def http_stats() -> Dict[str, Any]:
+    return {"sessions": len(_SESSIONS), **_STATS}
+
+
+register_metrics("http", http_stats)
@@ -0,0 +1,121 @@
+import re
+from typing import Iterable, List, Optional
+from urllib.parse import urlsplit, urlunsplit
+
+MAX_LINKS_PER_MESSAGE = 10
+
+_TRAILING_PUNCTUATION = ".,;:!?'\"»)]}>…"
+
+_MARKDOWN_LINK_RE = re.compile(r"\[[^\]]*\]\(\s*<?([^)\s>]+)>?\s*\)")
+_HTML_LINK_RE = re.compile(r"""<a\s[^>]*href\s*=\s*["']([^"']+)["']""", re.IGNORECASE)
+_SCHEME_URL_RE = re.compile(r"\b(?:https?|hxxps?)://[^\s<>\"'`]+", re.IGNORECASE)
+_BARE_URL_RE = re.compile(
+    r"(?<![\w@./-])"
+    r"((?:[^\W_](?:[\w-]{0,61}[^\W_])?\.)+"
+    r"(?:[^\W\d_]{2,24}|xn--[a-z0-9-]{2,59}))"
+    r"(?::\d{2,5})?"
+    r"(/[^\s<>\"'`]*)?",
+    re.IGNORECASE,
+)
+
+# Расширения файлов, которые легко спутать с доменами верхнего уровня в тексте.
+_FILE_EXTENSIONS = set(
+    "apk bat bin cmd csv doc docx exe gif htm html jpeg jpg js json log md mp3 mp4 "
+    "msi pdf php png ppt pptx py rar scr sh svg tar tmp txt webp xls xlsx xml zip".split()
+)
+
+
+def _strip_trailing(candidate: str) -> str:
+    while candidate and candidate[-1] in _TRAILING_PUNCTUATION:
+        # Закрывающая скобка — часть ссылки, если внутри неё есть открывающая.
+        if candidate[-1] == ")" and candidate.count("(") >= candidate.count(")"):
+            break
+        candidate = candidate[:-1]
+    return candidate
+
+
+def canonicalize_link(candidate: str) -> Optional[str]:
+    """
+    Приводит найденную ссылку к виду, пригодному для проверки:
+    добавляет схему, переводит IDN-домены в punycode, убирает якорь.
+    """
+    candidate = _strip_trailing(candidate.strip())
+    if not candidate:
+        return None
+
+    if re.match(r"^hxxps?://", candidate, re.IGNORECASE):
+        candidate = "http" + candidate[4:]
+    if "://" not in candidate:
+        candidate = "https://" + candidate
+
+    try:
+        parts = urlsplit(candidate)
+        hostname = parts.hostname
+        port = parts.port
+    except ValueError:
+        return None
+
+    if parts.scheme.lower() not in ("http", "https") or not hostname:
+        return None
+
+    try:
+        host = hostname.rstrip(".").encode("idna").decode("ascii").lower()
+    except UnicodeError:
+        return None
+    if "." not in host:
+        return None
+
+    netloc = f"{host}:{port}" if port else host
+    return urlunsplit(
+        (parts.scheme.lower(), netloc, parts.path or "/", parts.query, "")
+    )
+
+
+def _is_probably_filename(host: str, path: Optional[str]) -> bool:
+    tld = host.rsplit(".", 1)[-1].lower()
+    return not path and tld in _FILE_EXTENSIONS
+
+
+def extract_links(
+    texts: Iterable[Optional[str]],
+    markup_urls: Iterable[Optional[str]] = (),
+    limit: int = MAX_LINKS_PER_MESSAGE,
+) -> List[str]:
+    """
+    Находит все ссылки в текстах сообщения: с протоколом и без, IDN-домены,
+    markdown- и HTML-ссылки, а также ссылки из разметки MAX.
+    Возвращает не более limit уникальных ссылок в порядке появления.
+    """
+    found: List[str] = []
+    seen = set()
+
+    def add(candidate: Optional[str]) -> None:
+        if not candidate or len(found) >= limit:
+            return
+        link = canonicalize_link(candidate)
+        if link and link not in seen:
+            seen.add(link)
+            found.append(link)
+
+    for url in markup_urls:
+        add(url)
+
+    for text in texts:
+        if not text:
+            continue
+
+        for match in _MARKDOWN_LINK_RE.finditer(text):
+            add(match.group(1))
+        for match in _HTML_LINK_RE.finditer(text):
+            add(match.group(1))
+
+        rest = _HTML_LINK_RE.sub(" ", _MARKDOWN_LINK_RE.sub(" ", text))
+        for match in _SCHEME_URL_RE.finditer(rest):
+            add(match.group(0))
+
+        rest = _SCHEME_URL_RE.sub(" ", rest)
+        for match in _BARE_URL_RE.finditer(rest):
+            if not _is_probably_filename(match.group(1), match.group(2)):
+                add(match.group(0))
+
+    return found
@@ -0,0 +1,37 @@
+import logging
+from typing import Any, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+_PROVIDERS: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+
+def register_metrics(name: str, provider: Callable[[], Dict[str, Any]]) -> None:
+    """Регистрирует источник метрик, который вызывается при сборе статистики."""
+    _PROVIDERS[name] = provider
+
+
+def collect_metrics() -> Dict[str, Dict[str, Any]]:
+    metrics: Dict[str, Dict[str, Any]] = {}
+
+    for name, provider in _PROVIDERS.items():
+        try:
+            metrics[name] = provider()
+        except Exception as e:
+            logger.error(f"Ошибка сбора метрик {name}: {e}")
+
+    return metrics
+
+
+def format_metrics() -> str:
+    metrics = collect_metrics()
+    if not metrics:
+        return "Метрик пока нет"
+
+    lines = []
+    for name, values in metrics.items():
+        lines.append(f"📊 {name}")
+        for key, value in values.items():
+            lines.append(f"  • {key}: {value}")
+
+    return "\n".join(lines)
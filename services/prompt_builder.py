@@ -0,0 +1,227 @@
+"""
+Сборка запроса к модели в пределах бюджета токенов.
+
+Токены считаются локально: через tiktoken, если он установлен, иначе
+оценкой по словам (с небольшим запасом в большую сторону). Если переписка
+вместе с полным системным промптом не укладывается в бюджет, берётся
+компактный промпт. Если не укладывается и с ним, переписка сокращается по
+значимости, а не по позиции: сначала остаются сообщения с маркерами
+мошенничества и ссылками, затем последние, затем первое, остальные — от новых
+к старым. Пропуски помечаются в тексте, порядок сообщений сохраняется.
+"""
+
+import logging
+import re
+from collections import Counter
+from functools import lru_cache
+from typing import Any, Dict, List, Tuple
+
+from services.metrics import register_metrics
+from services.scam_cache import CONTEXT_RE
+from services.scam_prefilter import SPEAKER_RE, find_markers, prepare_text
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+ENCODING = "o200k_base"
+# Служебные токены чата: по несколько на каждое сообщение system и user.
+CHAT_OVERHEAD_TOKENS = 7
+MIN_CONVERSATION_TOKENS = 300
+GAP_TOKENS = 12
+
+PROMPT_FULL = "full"
+PROMPT_COMPACT = "compact"
+PROMPT_AUTO = "auto"
+
+WORD_RE = re.compile(r"\w+|[^\w\s]")
+
+_ENCODER: Any = None
+_ENCODER_FAILED = tiktoken is None
+_STATS: Counter = Counter()
+
+
+def _get_encoder() -> Any:
+    global _ENCODER, _ENCODER_FAILED
+    if _ENCODER is None and not _ENCODER_FAILED:
+        try:
+            _ENCODER = tiktoken.get_encoding(ENCODING)
+        except Exception as e:
+            _ENCODER_FAILED = True
+            logger.warning(f"tiktoken недоступен, токены считаются оценкой: {e}")
+    return _ENCODER
+
+
+def count_tokens(text: str) -> int:
+    encoder = _get_encoder()
+    if encoder is not None:
+        return len(encoder.encode(text))
+
+    tokens = 0
+    for word in WORD_RE.findall(text):
+        if not (word[0].isalnum() or word[0] == "_"):
+            tokens += 1
+        elif word.isascii():
+            tokens += (len(word) + 3) // 4
+        else:
+            tokens += (len(word) + 2) // 3
+    return tokens
+
+
+@lru_cache(maxsize=8)
+def _prompt_tokens(prompt: str) -> int:
+    return count_tokens(prompt)
+
+
+def split_conversation(text: str) -> Tuple[List[str], str]:
+    """Сообщения переписки и служебная строка контекста в конце (если есть)."""
+    footer = ""
+    contexts = list(CONTEXT_RE.finditer(text))
+    if contexts:
+        last = contexts[-1]
+        footer = last.group(0)
+        text = text[: last.start()] + text[last.end() :]
+
+    starts = [m.start() for m in SPEAKER_RE.finditer(text)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    bounds = zip(starts, starts[1:] + [len(text)])
+    messages = [text[a:b].strip() for a, b in bounds]
+    return [m for m in messages if m], footer
+
+
+def truncate_to_tokens(text: str, budget: int) -> str:
+    """Начало и конец текста, укладывающиеся примерно в budget токенов."""
+    tokens = count_tokens(text)
+    if tokens <= budget:
+        return text
+    chars = max(int(len(text) * budget / tokens * 0.9) // 2, 1)
+    return f"{text[:chars]} … {text[-chars:]}"
+
+
+def _ranking(messages: List[str]) -> List[int]:
+    last = len(messages) - 1
+    marked = []
+    for i in range(last, -1, -1):
+        prepared = prepare_text(messages[i])
+        if find_markers(prepared) or " url " in prepared:
+            marked.append(i)
+    order = marked + [last, 0] + list(range(last, -1, -1))
+    return list(dict.fromkeys(order))
+
+
+def trim_conversation(text: str, budget: int) -> Tuple[str, int]:
+    """
+    Переписка, сокращённая до budget токенов по значимости сообщений.
+    Возвращает текст и число выброшенных сообщений.
+    """
+    if count_tokens(text) <= budget:
+        return text, 0
+
+    messages, footer = split_conversation(text)
+    available = budget - count_tokens(footer)
+    costs = [count_tokens(m) + 1 for m in messages]
+    ranking = _ranking(messages)
+
+    last = len(messages) - 1
+    keep: Dict[int, str] = {}
+    # Пока ничего не оставлено, вся переписка — один пропуск.
+    used = GAP_TOKENS
+    for i in ranking:
+        # Сообщение делит пропуск надвое, если соседи с обеих сторон тоже
+        # пропущены, и сокращает число пропусков, если оба соседа оставлены.
+        left_gap = i > 0 and i - 1 not in keep
+        right_gap = i < last and i + 1 not in keep
+        cost = costs[i] + GAP_TOKENS * (left_gap + right_gap - 1)
+        if used + cost <= available:
+            keep[i] = messages[i]
+            used += cost
+
+    if not keep:
+        top = ranking[0]
+        keep[top] = truncate_to_tokens(messages[top], available - GAP_TOKENS)
+
+    parts: List[str] = []
+    previous = -1
+    for i in sorted(keep):
+        if i - previous > 1:
+            parts.append(f"[… пропущено сообщений: {i - previous - 1} …]")
+        parts.append(keep[i])
+        previous = i
+    if previous < last:
+        parts.append(f"[… пропущено сообщений: {last - previous} …]")
+    if footer:
+        parts.append(f"\n{footer}")
+
+    return "\n".join(parts), len(messages) - len(keep)
+
+
+class Prompt:
+    def __init__(self, system: str, user: str, compact: bool, dropped: int):
+        self.system = system
+        self.user = user
+        self.compact = compact
+        self.dropped = dropped
+        self.tokens = _prompt_tokens(system) + count_tokens(user) + CHAT_OVERHEAD_TOKENS
+
+
+def build_prompt(
+    text: str, full_system: str, compact_system: str, budget: int, mode: str
+) -> Prompt:
+    """Системный промпт и переписка, укладывающиеся в budget токенов."""
+    text_tokens = count_tokens(text)
+    full_tokens = _prompt_tokens(full_system)
+
+    compact = mode == PROMPT_COMPACT or (
+        mode == PROMPT_AUTO
+        and full_tokens + text_tokens + CHAT_OVERHEAD_TOKENS > budget
+    )
+    system = compact_system if compact else full_system
+
+    available = max(
+        budget - _prompt_tokens(system) - CHAT_OVERHEAD_TOKENS,
+        MIN_CONVERSATION_TOKENS,
+    )
+    user, dropped = trim_conversation(text, available)
+    return Prompt(system, user, compact, dropped)
+
+
+def record_usage(prompt: Prompt, prompt_tokens: int, completion_tokens: int) -> None:
+    """Учитывает расход токенов вызова и точность локальной оценки."""
+    _STATS["calls"] += 1
+    _STATS["compact_prompts"] += prompt.compact
+    _STATS["trimmed"] += prompt.dropped > 0
+    _STATS["dropped_messages"] += prompt.dropped
+    _STATS["prompt_tokens"] += prompt_tokens
+    _STATS["completion_tokens"] += completion_tokens
+    if prompt_tokens:
+        _STATS["estimate_error"] += abs(prompt.tokens - prompt_tokens)
+
+
+def token_stats() -> Dict[str, Any]:
+    calls = _STATS["calls"]
+    prompt_tokens = _STATS["prompt_tokens"]
+    return {
+        "tokenizer": "tiktoken" if _get_encoder() is not None else "heuristic",
+        "calls": calls,
+        "compact_prompts": _STATS["compact_prompts"],
+        "trimmed": _STATS["trimmed"],
+        "dropped_messages": _STATS["dropped_messages"],
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": _STATS["completion_tokens"],
+        "avg_prompt_tokens": round(prompt_tokens / calls) if calls else 0,
+        "avg_completion_tokens": (
+            round(_STATS["completion_tokens"] / calls) if calls else 0
+        ),
+        "estimate_error_pct": (
+            round(_STATS["estimate_error"] / prompt_tokens * 100, 1)
+            if prompt_tokens
+            else "-"
+        ),
+    }
+
+
+register_metrics("ai_tokens", token_stats)
@@ -0,0 +1,217 @@
+"""
+Офлайн-база Pwned Passwords: проверка пароля без сетевых запросов.
+
+Исходные данные — выгрузка HIBP (PwnedPasswordsDownloader или
+pwned-passwords-sha1-ordered-by-hash), строки вида "SHA1:COUNT",
+отсортированные по хэшу. Конвертер один раз превращает её в бинарный файл:
+    заголовок (MAGIC, число записей),
+    индекс по 5-символьному префиксу: 2^20 + 1 смещений uint64,
+    ключи: первые 64 бита суффикса хэша, uint64, отсортированы,
+    счётчики утечек, uint32.
+Файл открывается через mmap: индекс сужает поиск до ~1000 записей префикса,
+дальше — бинарный поиск. В памяти держатся только прочитанные страницы.
+
+Конвертация и бенчмарк:
+    python -m services.pwned_offline convert pwnedpasswords.txt data/pwned.bin
+    python -m services.pwned_offline lookup data/pwned.bin P@ssw0rd
+    python -m services.pwned_offline bench --entries 5000000
+"""
+
+import argparse
+import bisect
+import hashlib
+import mmap
+import os
+import random
+import struct
+import sys
+import tempfile
+import time
+from array import array
+from typing import Iterable, Iterator, Tuple
+
+MAGIC = b"HIBP0001"
+HEADER = struct.Struct("<8sQ")
+PREFIXES = 1 << 20
+INDEX_SIZE = (PREFIXES + 1) * 8
+WRITE_BATCH = 1 << 16
+
+
+def split_hash(sha1: str) -> Tuple[int, int]:
+    """Номер 5-символьного префикса и 64-битный ключ суффикса SHA-1."""
+    return int(sha1[:5], 16), int(sha1[5:21], 16)
+
+
+def _parse_lines(lines: Iterable[str]) -> Iterator[Tuple[str, int]]:
+    for line in lines:
+        sha1, _, count = line.strip().partition(":")
+        if len(sha1) == 40:
+            yield sha1.upper(), int(count or 1)
+
+
+def convert(lines: Iterable[str], out_path: str) -> int:
+    """
+    Собирает бинарный файл из отсортированных строк "SHA1:COUNT"
+    и атомарно заменяет out_path. Возвращает число записей.
+    """
+    if sys.byteorder != "little":
+        raise RuntimeError("offline Pwned Passwords index requires little-endian")
+
+    out_dir = os.path.dirname(out_path) or "."
+    os.makedirs(out_dir, exist_ok=True)
+    index = array("Q", bytes(INDEX_SIZE))
+    fd, tmp_path = tempfile.mkstemp(dir=out_dir, suffix=".tmp")
+
+    try:
+        with os.fdopen(fd, "w+b") as out, tempfile.TemporaryFile(dir=out_dir) as counts:
+            out.write(HEADER.pack(MAGIC, 0))
+            out.write(bytes(INDEX_SIZE))
+
+            keys_batch, counts_batch = array("Q"), array("I")
+            total = 0
+            last = ""
+            for sha1, count in _parse_lines(lines):
+                if sha1 <= last:
+                    raise ValueError(f"input is not sorted by hash near {sha1}")
+                last = sha1
+
+                prefix, key = split_hash(sha1)
+                index[prefix + 1] += 1
+                keys_batch.append(key)
+                counts_batch.append(min(count, 0xFFFFFFFF))
+                total += 1
+
+                if len(keys_batch) >= WRITE_BATCH:
+                    keys_batch.tofile(out)
+                    counts_batch.tofile(counts)
+                    keys_batch, counts_batch = array("Q"), array("I")
+
+            keys_batch.tofile(out)
+            counts_batch.tofile(counts)
+
+            counts.seek(0)
+            while chunk := counts.read(1 << 20):
+                out.write(chunk)
+
+            # Число записей по префиксам -> смещение начала каждого префикса.
+            for prefix in range(PREFIXES):
+                index[prefix + 1] += index[prefix]
+
+            out.seek(0)
+            out.write(HEADER.pack(MAGIC, total))
+            index.tofile(out)
+
+        os.replace(tmp_path, out_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+    return total
+
+
+class OfflinePwnedIndex:
+    """Открытый через mmap файл офлайн-базы Pwned Passwords."""
+
+    def __init__(self, path: str):
+        if sys.byteorder != "little":
+            raise RuntimeError("offline Pwned Passwords index requires little-endian")
+
+        self.path = path
+        with open(path, "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.size = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC:
+            self._mmap.close()
+            raise ValueError(f"{path}: not an offline Pwned Passwords file")
+
+        view = memoryview(self._mmap)
+        keys_start = HEADER.size + INDEX_SIZE
+        counts_start = keys_start + self.size * 8
+        self._index = view[HEADER.size : keys_start].cast("Q")
+        self._keys = view[keys_start:counts_start].cast("Q")
+        self._counts = view[counts_start : counts_start + self.size * 4].cast("I")
+
+    def count(self, sha1: str) -> int:
+        """Сколько раз хэш встречался в утечках (0 — не встречался)."""
+        prefix, key = split_hash(sha1.upper())
+        lo, hi = self._index[prefix], self._index[prefix + 1]
+        i = bisect.bisect_left(self._keys, key, lo, hi)
+        if i < hi and self._keys[i] == key:
+            return self._counts[i]
+        return 0
+
+    def count_password(self, password: str) -> int:
+        return self.count(hashlib.sha1(password.encode()).hexdigest())
+
+    def close(self) -> None:
+        self._index.release()
+        self._keys.release()
+        self._counts.release()
+        self._mmap.close()
+
+
+def _bench(entries: int, lookups: int) -> None:
+    rng = random.Random(42)
+    hashes = sorted(f"{rng.getrandbits(160):040X}" for _ in range(entries))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "pwned.bin")
+
+        started = time.perf_counter()
+        convert((f"{sha1}:{i % 1000 + 1}" for i, sha1 in enumerate(hashes)), path)
+        print(f"convert: {entries} hashes in {time.perf_counter() - started:.2f} s")
+        print(f"file size: {os.path.getsize(path) / 1024 / 1024:.1f} MiB")
+
+        index = OfflinePwnedIndex(path)
+        hits = [rng.choice(hashes) for _ in range(lookups)]
+        misses = [f"{rng.getrandbits(160):040X}" for _ in range(lookups)]
+
+        for name, sample in (("hit", hits), ("miss", misses)):
+            started = time.perf_counter()
+            found = sum(index.count(sha1) > 0 for sha1 in sample)
+            per_lookup = (time.perf_counter() - started) / lookups * 1e6
+            print(f"lookup ({name}): {per_lookup:.2f} us/lookup, found {found}")
+
+        index.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m services.pwned_offline")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    convert_cmd = commands.add_parser(
+        "convert", help="собрать бинарный файл из выгрузки HIBP"
+    )
+    convert_cmd.add_argument("source", help="текстовый файл SHA1:COUNT или - для stdin")
+    convert_cmd.add_argument("out")
+
+    lookup = commands.add_parser("lookup", help="проверить пароли по файлу")
+    lookup.add_argument("index")
+    lookup.add_argument("passwords", nargs="+")
+
+    bench = commands.add_parser("bench", help="бенчмарк на синтетических данных")
+    bench.add_argument("--entries", type=int, default=1_000_000)
+    bench.add_argument("--lookups", type=int, default=100_000)
+
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        started = time.perf_counter()
+        if args.source == "-":
+            count = convert(sys.stdin, args.out)
+        else:
+            with open(args.source, encoding="ascii", errors="replace") as source:
+                count = convert(source, args.out)
+        print(f"{args.out}: {count} hashes in {time.perf_counter() - started:.2f} s")
+    elif args.command == "lookup":
+        index = OfflinePwnedIndex(args.index)
+        for password in args.passwords:
+            print(f"{password}: {index.count_password(password)}")
+        index.close()
+    else:
+        _bench(args.entries, args.lookups)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Проверка паролей по базе Pwned Passwords (HIBP): локально по офлайн-базе
+(см. services/pwned_offline.py) или через k-anonymity API:
+на сервер уходят только первые 5 символов SHA-1, ответ — все суффиксы
+хэшей с этим префиксом.
+
+Разобранные ответы кэшируются: каждый диапазон хранится как отсортированный
+массив 64-битных префиксов суффиксов (~6 КБ вместо ~30 КБ текста), поиск —
+бинарный. Ложное совпадение по 64 битам среди ~800 записей диапазона
+практически невозможно.
+
+Адаптивный таймаут и выключатель (services/resilience.py) стоят только на
+сетевом запросе: попадания в кэш и офлайн-базу занимают микросекунды
+и исказили бы p95 задержки API.
+"""
+
+import bisect
+import hashlib
+import logging
+from array import array
+from collections import Counter
+from typing import Any, Dict, Optional, Tuple
+
+from config import settings
+from services.http import get_session
+from services.metrics import register_metrics
+from services.resilience import provider_guard
+from services.pwned_offline import OfflinePwnedIndex
+from services.singleflight import SingleFlight
+from services.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+RANGE_URL = "https://api.pwnedpasswords.com/range/{}"
+
+_RANGES: TTLCache[array] = TTLCache(settings.PWNED_CACHE_SIZE, settings.PWNED_CACHE_TTL)
+_RANGE_FLIGHTS = SingleFlight()
+_GUARD = provider_guard("Pwned Passwords", settings.PWNED_TIMEOUT, min_timeout=2.0)
+_STATS: Counter = Counter()
+_OFFLINE_INDEX: OfflinePwnedIndex | None = None
+_OFFLINE_FAILED = False
+
+
+def split_sha1(password: str) -> Tuple[str, str]:
+    """Префикс (5 символов) и суффикс (35 символов) SHA-1 пароля."""
+    sha1 = hashlib.sha1(password.encode()).hexdigest().upper()
+    return sha1[:5], sha1[5:]
+
+
+def suffix_key(suffix: str) -> int:
+    return int(suffix[:16], 16)
+
+
+def parse_range(text: str) -> array:
+    """
+    Разбирает ответ /range/{prefix} в отсортированный массив ключей.
+    Строки с нулевым счётчиком — это заполнение (Add-Padding), они пропускаются.
+    """
+    keys = array("Q")
+    for line in text.splitlines():
+        suffix, _, count = line.strip().partition(":")
+        if len(suffix) == 35 and count and int(count) > 0:
+            keys.append(suffix_key(suffix))
+    return array("Q", sorted(keys))
+
+
+def range_contains(keys: array, suffix: str) -> bool:
+    key = suffix_key(suffix)
+    i = bisect.bisect_left(keys, key)
+    return i < len(keys) and keys[i] == key
+
+
+async def _download_range(prefix: str) -> str:
+    async with get_session("pwned").get(RANGE_URL.format(prefix)) as resp:
+        resp.raise_for_status()
+        return await resp.text()
+
+
+async def _fetch_range(prefix: str) -> array:
+    text = await _GUARD.call(lambda: _download_range(prefix))
+    keys = parse_range(text)
+    _RANGES.set(prefix, keys)
+    return keys
+
+
+async def get_range(prefix: str) -> array:
+    """Диапазон хэшей для префикса: из кэша или одним запросом к API."""
+    keys = _RANGES.get(prefix)
+    if keys is not None:
+        _STATS["cache_hits"] += 1
+        return keys
+
+    _STATS["cache_misses"] += 1
+    return await _RANGE_FLIGHTS.do(prefix, lambda: _fetch_range(prefix))
+
+
+def get_offline_index() -> Optional[OfflinePwnedIndex]:
+    """Офлайн-база из PWNED_OFFLINE_PATH, если она настроена и открывается."""
+    global _OFFLINE_INDEX, _OFFLINE_FAILED
+    if _OFFLINE_INDEX is None and settings.PWNED_OFFLINE_PATH and not _OFFLINE_FAILED:
+        try:
+            _OFFLINE_INDEX = OfflinePwnedIndex(settings.PWNED_OFFLINE_PATH)
+            logger.info(
+                f"Офлайн-база Pwned Passwords открыта: {_OFFLINE_INDEX.size} хэшей"
+            )
+        except (OSError, ValueError, RuntimeError) as e:
+            _OFFLINE_FAILED = True
+            logger.error(f"Не удалось открыть офлайн-базу Pwned Passwords: {e}")
+    return _OFFLINE_INDEX
+
+
+def close_offline_index() -> None:
+    global _OFFLINE_INDEX
+    if _OFFLINE_INDEX is not None:
+        _OFFLINE_INDEX.close()
+        _OFFLINE_INDEX = None
+
+
+async def is_password_pwned(password: str) -> bool:
+    """
+    Встречался ли пароль в утечках. При настроенной офлайн-базе проверка идёт
+    локально без сетевых запросов, иначе через API. Ошибки API пробрасываются.
+    """
+    prefix, suffix = split_sha1(password)
+
+    offline = get_offline_index()
+    if offline is not None:
+        _STATS["offline_lookups"] += 1
+        return offline.count(prefix + suffix) > 0
+
+    return range_contains(await get_range(prefix), suffix)
+
+
+def pwned_stats() -> Dict[str, Any]:
+    return {"cached_ranges": len(_RANGES), **_STATS}
+
+
+register_metrics("pwned_passwords", pwned_stats)
@@ -0,0 +1,58 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """Классический token bucket: rate токенов в секунду, не больше capacity."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        if now < self._paused_until:
+            self._updated_at = now
+            return
+        start = max(self._updated_at, self._paused_until)
+        self._tokens = min(self.capacity, self._tokens + (now - start) * self.rate)
+        self._updated_at = now
+
+    @property
+    def tokens(self) -> float:
+        self._refill()
+        return self._tokens
+
+    def try_acquire(self, cost: float = 1.0) -> bool:
+        cost = min(cost, self.capacity)
+        self._refill()
+        if self._tokens >= cost:
+            self._tokens -= cost
+            return True
+        return False
+
+    @property
+    def paused_for(self) -> float:
+        """Сколько секунд ещё длится пауза, выставленная через pause()."""
+        return max(self._paused_until - time.monotonic(), 0.0)
+
+    def time_until_available(self, cost: float = 1.0) -> float:
+        self._refill()
+        paused_for = self.paused_for
+        missing = min(cost, self.capacity) - self._tokens
+        if missing <= 0:
+            return paused_for
+        return paused_for + missing / self.rate
+
+    async def acquire(self, cost: float = 1.0) -> None:
+        while not self.try_acquire(cost):
+            await asyncio.sleep(self.time_until_available(cost))
+
+    def pause(self, seconds: float) -> None:
+        """Обнуляет запас токенов и останавливает пополнение на seconds секунд."""
+        self._tokens = 0.0
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._updated_at = time.monotonic()
@@ -0,0 +1,203 @@
+"""
+Защита вызовов внешних провайдеров: адаптивные таймауты, автоматический
+выключатель (circuit breaker) и дублирующие (hedged) запросы.
+
+Таймаут вызова — FACTOR * p95 последних задержек, но в пределах
+[min_timeout, max_timeout]; пока замеров мало, действует max_timeout.
+После failure_threshold ошибок подряд выключатель размыкается, и вызовы
+сразу завершаются CircuitOpenError, не дожидаясь таймаута. Через
+reset_timeout пропускается один пробный вызов: успех замыкает выключатель,
+ошибка снова размыкает.
+
+Дублирующий запрос нужен только для идемпотентных GET: если ответа нет
+дольше p95, отправляется второй такой же запрос, берётся первый ответ.
+"""
+
+import asyncio
+import logging
+import time
+from collections import Counter, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+from config import settings
+from services.metrics import register_metrics
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+FACTOR = 2.0
+MIN_SAMPLES = 20
+WINDOW = 200
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Провайдер недавно не отвечал, вызов отклонён без обращения к нему."""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} is unavailable, retry in {retry_after:.0f} s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class ProviderGuard:
+    def __init__(
+        self,
+        name: str,
+        max_timeout: float,
+        min_timeout: float = 1.0,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        hedge: bool = False,
+        is_failure: Callable[[Exception], bool] = lambda e: True,
+    ):
+        self.name = name
+        self.max_timeout = max_timeout
+        self.min_timeout = min(min_timeout, max_timeout)
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.hedge = hedge
+        self.is_failure = is_failure
+
+        self.state = CLOSED
+        self._latencies: Deque[float] = deque(maxlen=WINDOW)
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_running = False
+        self._stats: Counter = Counter()
+
+    def percentile(self, q: float) -> Optional[float]:
+        if len(self._latencies) < MIN_SAMPLES:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+    @property
+    def timeout(self) -> float:
+        p95 = self.percentile(0.95)
+        if p95 is None:
+            return self.max_timeout
+        return min(max(p95 * FACTOR, self.min_timeout), self.max_timeout)
+
+    def check(self) -> None:
+        """Бросает CircuitOpenError, если сейчас вызывать провайдера нельзя."""
+        if self.state == CLOSED:
+            return
+
+        retry_after = self._opened_at + self.reset_timeout - time.monotonic()
+        if self.state == OPEN and retry_after <= 0:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN and not self._probe_running:
+            return
+
+        self._stats["rejected"] += 1
+        raise CircuitOpenError(self.name, max(retry_after, 0.0))
+
+    async def call(self, fn: Callable[[], Awaitable[T]], timed: bool = True) -> T:
+        """
+        Вызывает fn с защитой выключателем. timed=False отключает адаптивный
+        таймаут и замер задержки — для долгих вызовов вроде загрузки файлов.
+        """
+        self.check()
+        probe = self.state == HALF_OPEN
+        if probe:
+            self._probe_running = True
+
+        started = time.monotonic()
+        try:
+            if timed:
+                async with asyncio.timeout(self.timeout):
+                    result = await (self._hedged(fn) if self.hedge else fn())
+            else:
+                result = await fn()
+        except Exception as e:
+            if isinstance(e, TimeoutError):
+                self._stats["timeouts"] += 1
+            if isinstance(e, TimeoutError) or self.is_failure(e):
+                self._record_failure()
+            else:
+                self._record_success()
+            raise
+        else:
+            if timed:
+                self._latencies.append(time.monotonic() - started)
+            self._record_success()
+            return result
+        finally:
+            if probe:
+                self._probe_running = False
+
+    async def _hedged(self, fn: Callable[[], Awaitable[T]]) -> T:
+        delay = self.percentile(0.95)
+        first = asyncio.ensure_future(fn())
+        tasks = {first}
+        try:
+            if delay is not None:
+                await asyncio.wait(tasks, timeout=delay)
+                if not first.done():
+                    self._stats["hedges"] += 1
+                    tasks.add(asyncio.ensure_future(fn()))
+
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            self._stats["hedge_wins"] += 1
+                        return task.result()
+            # Все запросы завершились ошибкой: отдаём ошибку исходного.
+            return first.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def _record_success(self) -> None:
+        self._stats["ok"] += 1
+        self._failures = 0
+        if self.state != CLOSED:
+            logger.info(f"{self.name}: провайдер снова отвечает, выключатель замкнут")
+            self.state = CLOSED
+
+    def _record_failure(self) -> None:
+        self._stats["failures"] += 1
+        self._failures += 1
+        if self.state == HALF_OPEN or self._failures >= self.failure_threshold:
+            if self.state != OPEN:
+                self._stats["trips"] += 1
+                logger.warning(
+                    f"{self.name}: {self._failures} ошибок подряд, выключатель "
+                    f"разомкнут на {self.reset_timeout:.0f} с"
+                )
+            self.state = OPEN
+            self._opened_at = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        p50, p95 = self.percentile(0.5), self.percentile(0.95)
+        return {
+            "state": self.state,
+            "timeout": round(self.timeout, 2),
+            "p50": round(p50, 3) if p50 is not None else "-",
+            "p95": round(p95, 3) if p95 is not None else "-",
+            **self._stats,
+        }
+
+
+_GUARDS: Dict[str, ProviderGuard] = {}
+
+
+def provider_guard(name: str, max_timeout: float, **kwargs: Any) -> ProviderGuard:
+    """Защита вызовов провайдера name; создаётся один раз и попадает в метрики."""
+    guard = _GUARDS.get(name)
+    if guard is None:
+        kwargs.setdefault("failure_threshold", settings.CIRCUIT_FAILURE_THRESHOLD)
+        kwargs.setdefault("reset_timeout", settings.CIRCUIT_RESET_TIMEOUT)
+        guard = _GUARDS[name] = ProviderGuard(name, max_timeout, **kwargs)
+        register_metrics(f"circuit {name}", guard.stats)
+    return guard
@@ -0,0 +1,203 @@
+"""
+Кэш вердиктов ИИ для почти одинаковых текстов. Цепочки мошеннических
+сообщений пересылают тысячи раз с мелкими правками, и каждая копия не должна
+стоить отдельного запроса к модели.
+
+Текст нормализуется (регистр, ссылки, числа, пунктуация), разбивается на
+шинглы по три слова, и по ним считается 64-битный SimHash. Тексты считаются
+одинаковыми, если их отпечатки отличаются не больше чем в max_distance битах.
+Поиск кандидатов — LSH по полосам: отпечаток делится на max_distance + 1
+полос, и по принципу Дирихле у двух отпечатков на таком расстоянии хотя бы
+одна полоса совпадает целиком. Сами тексты в кэше не хранятся.
+
+Часть попаданий (audit_rate) всё равно отправляется в модель, чтобы измерять,
+насколько переиспользованные вердикты расходятся со свежими.
+"""
+
+import copy
+import hashlib
+import random
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Generic, List, Optional, Set, Tuple, TypeVar
+
+V = TypeVar("V")
+
+FINGERPRINT_BITS = 64
+SHINGLE_SIZE = 3
+
+URL_RE = re.compile(r"(https?://|www\.)\S+")
+CONTEXT_RE = re.compile(r"^\[Контекст:.*\]$", re.MULTILINE)
+NON_WORD_RE = re.compile(r"[^\w]+")
+DIGITS_RE = re.compile(r"\d+")
+
+
+def normalize_text(text: str) -> str:
+    """Текст без различий, которые не меняют смысл: регистр, ссылки, числа."""
+    text = CONTEXT_RE.sub(" ", text.lower()).replace("ё", "е")
+    text = URL_RE.sub(" url ", text)
+    text = DIGITS_RE.sub("0", text)
+    return " ".join(NON_WORD_RE.sub(" ", text).split())
+
+
+def _feature_hash(feature: str) -> int:
+    digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def simhash(normalized: str) -> int:
+    words = normalized.split()
+    if len(words) >= SHINGLE_SIZE:
+        features = [
+            " ".join(words[i : i + SHINGLE_SIZE])
+            for i in range(len(words) - SHINGLE_SIZE + 1)
+        ]
+    else:
+        features = words
+
+    weights = [0] * FINGERPRINT_BITS
+    for feature in features:
+        h = _feature_hash(feature)
+        for bit in range(FINGERPRINT_BITS):
+            weights[bit] += 1 if h >> bit & 1 else -1
+
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class _Entry(Generic[V]):
+    def __init__(self, fingerprint: int, value: V, expires_at: float):
+        self.fingerprint = fingerprint
+        self.value = value
+        self.expires_at = expires_at
+
+
+class NearDuplicateCache(Generic[V]):
+    """LRU-кэш с TTL, где ключ — SimHash, а поиск идёт по расстоянию Хэмминга."""
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: float,
+        max_distance: int = 6,
+        min_chars: int = 40,
+        audit_rate: float = 0.0,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.min_chars = min_chars
+        self.audit_rate = audit_rate
+
+        bands = max_distance + 1
+        self._band_bits = FINGERPRINT_BITS // bands
+        self._bands = bands
+        self._entries: "OrderedDict[int, _Entry[V]]" = OrderedDict()
+        self._index: Dict[Tuple[int, int], Set[int]] = {}
+
+        self.lookups = 0
+        self.hits = 0
+        self.exact_hits = 0
+        self.audits = 0
+        self.divergence_total = 0.0
+        self.divergence_max = 0.0
+        self.disagreements = 0
+
+    def fingerprint(self, text: str) -> Optional[int]:
+        """Отпечаток текста или None, если текст слишком короткий для сравнения."""
+        normalized = normalize_text(text)
+        if len(normalized) < self.min_chars:
+            return None
+        return simhash(normalized)
+
+    def _band_keys(self, fingerprint: int) -> List[Tuple[int, int]]:
+        mask = (1 << self._band_bits) - 1
+        return [
+            (band, fingerprint >> (band * self._band_bits) & mask)
+            for band in range(self._bands)
+        ]
+
+    def get(self, fingerprint: int) -> Optional[V]:
+        self.lookups += 1
+        now = time.monotonic()
+
+        best: Optional[_Entry[V]] = None
+        best_distance = self.max_distance + 1
+        for key in self._band_keys(fingerprint):
+            for candidate in list(self._index.get(key, ())):
+                entry = self._entries.get(candidate)
+                if entry is None:
+                    continue
+                if entry.expires_at <= now:
+                    self._remove(candidate)
+                    continue
+                distance = hamming_distance(fingerprint, candidate)
+                if distance < best_distance:
+                    best, best_distance = entry, distance
+
+        if best is None:
+            return None
+
+        self._entries.move_to_end(best.fingerprint)
+        self.hits += 1
+        if best_distance == 0:
+            self.exact_hits += 1
+        return copy.copy(best.value)
+
+    def set(self, fingerprint: int, value: V) -> None:
+        if self.maxsize <= 0:
+            return
+        if fingerprint in self._entries:
+            self._remove(fingerprint)
+
+        self._entries[fingerprint] = _Entry(
+            fingerprint, value, time.monotonic() + self.ttl
+        )
+        for key in self._band_keys(fingerprint):
+            self._index.setdefault(key, set()).add(fingerprint)
+
+        while len(self._entries) > self.maxsize:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, fingerprint: int) -> None:
+        if self._entries.pop(fingerprint, None) is None:
+            return
+        for key in self._band_keys(fingerprint):
+            bucket = self._index.get(key)
+            if bucket is not None:
+                bucket.discard(fingerprint)
+                if not bucket:
+                    del self._index[key]
+
+    def should_audit(self) -> bool:
+        return random.random() < self.audit_rate
+
+    def record_divergence(self, divergence: float, disagree: bool) -> None:
+        """Расхождение переиспользованного вердикта со свежим ответом модели."""
+        self.audits += 1
+        self.divergence_total += divergence
+        self.divergence_max = max(self.divergence_max, divergence)
+        if disagree:
+            self.disagreements += 1
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / self.lookups, 3) if self.lookups else 0.0,
+            "exact_hits": self.exact_hits,
+            "audits": self.audits,
+            "divergence_avg": (
+                round(self.divergence_total / self.audits, 1) if self.audits else 0.0
+            ),
+            "divergence_max": self.divergence_max,
+            "disagreements": self.disagreements,
+        }
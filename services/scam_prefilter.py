@@ -0,0 +1,419 @@
+"""
+Локальная предварительная классификация переписок перед запросом к модели.
+
+Два этапа:
+    словарь маркеров мошенничества (CVV, код из СМС, безопасный счёт, ...),
+    по которому текст проходится автоматом Ахо — Корасик за один проход;
+    наивный байесовский классификатор по словам текста и найденным маркерам.
+Уверенные случаи (вероятность мошенничества выше scam_threshold при хотя бы
+одном маркере или ниже benign_threshold без маркеров и ссылок) получают
+вердикт сразу, остальные и переписки длиннее max_chars уходят в модель.
+
+Модель — сжатый JSON с логарифмами отношения правдоподобий слов. Обучающая
+выборка — CSV со столбцами label (1 — мошенничество, 0 — нет) и text:
+    python -m services.scam_prefilter train dataset.csv --out data/scam_prefilter.json.gz
+    python -m services.scam_prefilter eval data/scam_prefilter.json.gz testset.csv
+    python -m services.scam_prefilter check data/scam_prefilter.json.gz "Назовите CVV"
+"""
+
+import argparse
+import csv
+import gzip
+import json
+import math
+import random
+import re
+import sys
+import time
+from collections import Counter, deque
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from services.scam_cache import normalize_text
+
+MODEL_VERSION = 1
+MIN_TOKEN_COUNT = 2
+
+SPEAKER_RE = re.compile(r"^Собеседник \d+:", re.MULTILINE)
+
+# Шаблоны записаны в нормализованном виде (см. normalize_text): пробел в начале
+# означает начало слова, без пробела в конце совпадает любое окончание.
+MARKERS: Dict[str, Tuple[str, ...]] = {
+    "Запрос данных карты": (
+        " cvv",
+        " cvc",
+        " три цифры на обороте",
+        " цифры с обратной стороны",
+        " срок действия карты",
+        " полный номер карты",
+    ),
+    "Запрос кода из СМС": (
+        " код из смс",
+        " код из sms",
+        " код из сообщения",
+        " продиктуйте код",
+        " продиктуй код",
+        " назовите код",
+        " назови код",
+        " сообщите код",
+        " код подтверждения",
+    ),
+    "Срочный перевод денег": (
+        " срочно переве",
+        " срочно нужны деньги",
+        " срочно нужно перевести",
+        " срочно скинь",
+        " переведи деньги",
+        " переведите деньги",
+        " скинь на карту",
+    ),
+    "Безопасный счёт": (
+        " безопасный счет",
+        " безопасного счета",
+        " безопасную ячейку",
+        " резервный счет",
+        " защищенный счет",
+    ),
+    "Выдача за сотрудника банка или полиции": (
+        " служба безопасности банка",
+        " службы безопасности банка",
+        " сотрудник банка",
+        " сотрудник службы безопасности",
+        " центробанк",
+        " центрального банка",
+        " следователь",
+        " сотрудник полиции",
+    ),
+    "Блокировка счёта": (
+        " ваша карта заблокирована",
+        " карта заблокирована",
+        " счет заблокирован",
+        " подозрительная операция",
+        " подозрительную операцию",
+    ),
+    "Выигрыш или компенсация": (
+        " вы выиграли",
+        " ваш выигрыш",
+        " положена компенсация",
+        " получить компенсацию",
+        " розыгрыш призов",
+    ),
+    "Гарантированный доход": (
+        " гарантированный доход",
+        " гарантированную прибыль",
+        " пассивный доход",
+        " доход от 0",
+    ),
+    "Предоплата": (
+        " предоплат",
+        " оплатите доставку",
+        " оплатить доставку",
+    ),
+    "Удалённый доступ к устройству": (
+        " anydesk",
+        " teamviewer",
+        " rustdesk",
+        " демонстрацию экрана",
+        " установите приложение",
+    ),
+    "Код от Госуслуг": (
+        " код от госуслуг",
+        " код для госуслуг",
+    ),
+    "Просьба о секретности": (
+        " никому не говори",
+        " никому не сообщайте",
+        " это секретно",
+        " не говорите родственникам",
+    ),
+}
+
+
+class AhoCorasick:
+    """
+    Поиск всех шаблонов в тексте за один проход по символам. Переходы по
+    ссылкам неудачи вычисляются заранее, так что на символ текста приходится
+    один поиск в словаре.
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        goto: List[Dict[str, int]] = [{}]
+        out: List[Tuple[int, ...]] = [()]
+
+        for pattern_id, pattern in enumerate(patterns):
+            state = 0
+            for ch in pattern:
+                next_state = goto[state].get(ch)
+                if next_state is None:
+                    next_state = len(goto)
+                    goto[state][ch] = next_state
+                    goto.append({})
+                    out.append(())
+                state = next_state
+            out[state] += (pattern_id,)
+
+        # Обход в ширину: ссылка неудачи состояния ведёт в менее глубокое
+        # состояние, чьи переходы к этому моменту уже достроены.
+        fail = [0] * len(goto)
+        delta: List[Dict[str, int]] = [dict(goto[0])] + [{}] * (len(goto) - 1)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            delta[state] = {**delta[fail[state]], **goto[state]}
+            out[state] += out[fail[state]]
+            for ch, next_state in goto[state].items():
+                fail[next_state] = delta[fail[state]].get(ch, 0) if state else 0
+                queue.append(next_state)
+
+        self._delta = delta
+        self._out = out
+
+    def search(self, text: str) -> Set[int]:
+        delta, out = self._delta, self._out
+        found: Set[int] = set()
+        state = 0
+        for ch in text:
+            state = delta[state].get(ch, 0)
+            if out[state]:
+                found.update(out[state])
+        return found
+
+
+_PATTERN_LABELS = [label for label, patterns in MARKERS.items() for _ in patterns]
+_MATCHER = AhoCorasick(p for patterns in MARKERS.values() for p in patterns)
+
+
+def prepare_text(text: str) -> str:
+    """Нормализованный текст без служебных подписей собеседников."""
+    return f" {normalize_text(SPEAKER_RE.sub(' ', text))} "
+
+
+def find_markers(prepared: str) -> List[str]:
+    """Категории маркеров, найденные в тексте, в порядке словаря."""
+    labels = {_PATTERN_LABELS[i] for i in _MATCHER.search(prepared)}
+    return [label for label in MARKERS if label in labels]
+
+
+def extract_features(prepared: str, markers: List[str]) -> Set[str]:
+    return set(prepared.split()) | {f"#{label}" for label in markers}
+
+
+class PrefilterVerdict:
+    def __init__(self, probability: float, markers: List[str], decision: Optional[str]):
+        self.probability = probability
+        self.markers = markers
+        # "scam", "benign" или None, если нужен анализ моделью.
+        self.decision = decision
+
+
+class ScamPrefilter:
+    """Наивный байесовский классификатор поверх словаря маркеров."""
+
+    def __init__(
+        self,
+        weights: Dict[str, float],
+        prior: float,
+        scam_threshold: float = 0.99,
+        benign_threshold: float = 0.01,
+        max_chars: int = 1500,
+    ):
+        self.weights = weights
+        self.prior = prior
+        self.scam_threshold = scam_threshold
+        self.benign_threshold = benign_threshold
+        # Длинные переписки требуют разбора контекста, их сразу отдаём модели.
+        self.max_chars = max_chars
+
+        self._stats: Counter = Counter()
+        self._elapsed = 0.0
+        self._classified = 0
+
+    @classmethod
+    def load(cls, path: str, **kwargs: Any) -> "ScamPrefilter":
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != MODEL_VERSION:
+            raise ValueError(f"unsupported model version: {data.get('version')}")
+        return cls(data["weights"], data["prior"], **kwargs)
+
+    def save(self, path: str) -> None:
+        data = {"version": MODEL_VERSION, "prior": self.prior, "weights": self.weights}
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+
+    @classmethod
+    def train(
+        cls, samples: List[Tuple[int, str]], alpha: float = 1.0, **kwargs: Any
+    ) -> "ScamPrefilter":
+        """
+        Обучение на парах (метка, текст). Признак учитывается один раз на текст
+        (бинаризованный NB), редкие слова отбрасываются ради размера модели.
+        """
+        counts: Tuple[Counter, Counter] = (Counter(), Counter())
+        totals = [0, 0]
+        for label, text in samples:
+            prepared = prepare_text(text)
+            features = extract_features(prepared, find_markers(prepared))
+            counts[label].update(features)
+            totals[label] += 1
+
+        if not totals[0] or not totals[1]:
+            raise ValueError("training set must contain both classes")
+
+        weights: Dict[str, float] = {}
+        for token in counts[0].keys() | counts[1].keys():
+            scam, ham = counts[1][token], counts[0][token]
+            if scam + ham < MIN_TOKEN_COUNT and not token.startswith("#"):
+                continue
+            weight = math.log((scam + alpha) / (totals[1] + 2 * alpha)) - math.log(
+                (ham + alpha) / (totals[0] + 2 * alpha)
+            )
+            weights[token] = round(weight, 3)
+
+        return cls(weights, round(math.log(totals[1] / totals[0]), 3), **kwargs)
+
+    def probability(self, prepared: str, markers: List[str]) -> float:
+        log_odds = self.prior + sum(
+            self.weights.get(f, 0.0) for f in extract_features(prepared, markers)
+        )
+        if log_odds < -30:
+            return 0.0
+        return 1 / (1 + math.exp(-min(log_odds, 30)))
+
+    def classify(self, text: str) -> PrefilterVerdict:
+        if len(text) > self.max_chars:
+            self._stats["too_long"] += 1
+            return PrefilterVerdict(0.5, [], None)
+
+        started = time.perf_counter()
+        prepared = prepare_text(text)
+        markers = find_markers(prepared)
+        probability = self.probability(prepared, markers)
+
+        decision = None
+        if markers and probability >= self.scam_threshold:
+            decision = "scam"
+        elif (
+            not markers
+            and " url " not in prepared
+            and probability <= self.benign_threshold
+        ):
+            decision = "benign"
+
+        self._elapsed += time.perf_counter() - started
+        self._classified += 1
+        self._stats[decision or "escalated"] += 1
+        return PrefilterVerdict(probability, markers, decision)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "weights": len(self.weights),
+            "scam": self._stats["scam"],
+            "benign": self._stats["benign"],
+            "escalated": self._stats["escalated"],
+            "too_long": self._stats["too_long"],
+            "avg_us": (
+                round(self._elapsed / self._classified * 1e6, 1)
+                if self._classified
+                else 0.0
+            ),
+        }
+
+
+def read_dataset(path: str) -> List[Tuple[int, str]]:
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        return [
+            (int(row["label"]), row["text"])
+            for row in csv.DictReader(f)
+            if row.get("label", "").strip() in ("0", "1") and row.get("text")
+        ]
+
+
+def evaluate(prefilter: ScamPrefilter, samples: List[Tuple[int, str]]) -> None:
+    outcomes: Counter = Counter()
+    timings: List[float] = []
+    for label, text in samples:
+        started = time.perf_counter()
+        verdict = prefilter.classify(text)
+        timings.append(time.perf_counter() - started)
+        outcomes[(verdict.decision, label)] += 1
+
+    total = len(samples)
+    scam_ok, scam_wrong = outcomes[("scam", 1)], outcomes[("scam", 0)]
+    benign_ok, benign_wrong = outcomes[("benign", 0)], outcomes[("benign", 1)]
+    local = scam_ok + scam_wrong + benign_ok + benign_wrong
+    timings.sort()
+
+    print(f"samples: {total}")
+    print(f"decided locally: {local} ({local / total:.1%}), escalated: {total - local}")
+    print(f"scam verdicts: {scam_ok + scam_wrong}, false positives: {scam_wrong}")
+    print(f"benign verdicts: {benign_ok + benign_wrong}, missed scams: {benign_wrong}")
+    if local:
+        print(f"local accuracy: {(scam_ok + benign_ok) / local:.2%}")
+    print(
+        f"latency: avg {sum(timings) / total * 1e6:.0f} us, "
+        f"p99 {timings[min(int(total * 0.99), total - 1)] * 1e6:.0f} us"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m services.scam_prefilter")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    train = commands.add_parser("train", help="обучить модель на CSV (label,text)")
+    train.add_argument("dataset")
+    train.add_argument("--out", required=True)
+    train.add_argument(
+        "--holdout",
+        type=float,
+        default=0.2,
+        help="доля выборки, отложенная для оценки",
+    )
+
+    evaluate_cmd = commands.add_parser("eval", help="оценить модель на CSV")
+    evaluate_cmd.add_argument("model")
+    evaluate_cmd.add_argument("dataset")
+
+    for command in (train, evaluate_cmd):
+        command.add_argument("--scam-threshold", type=float, default=0.99)
+        command.add_argument("--benign-threshold", type=float, default=0.01)
+        command.add_argument("--max-chars", type=int, default=1500)
+
+    check = commands.add_parser("check", help="классифицировать тексты")
+    check.add_argument("model")
+    check.add_argument("texts", nargs="+")
+
+    args = parser.parse_args()
+
+    if args.command == "check":
+        prefilter = ScamPrefilter.load(args.model)
+        for text in args.texts:
+            verdict = prefilter.classify(text)
+            print(
+                f"{verdict.decision or 'escalate'} p={verdict.probability:.3f} "
+                f"markers={verdict.markers}"
+            )
+        return
+
+    samples = read_dataset(args.dataset)
+    if not samples:
+        sys.exit(f"{args.dataset}: no labelled rows")
+    thresholds = {
+        "scam_threshold": args.scam_threshold,
+        "benign_threshold": args.benign_threshold,
+        "max_chars": args.max_chars,
+    }
+
+    if args.command == "train":
+        random.Random(42).shuffle(samples)
+        split = int(len(samples) * (1 - args.holdout))
+        prefilter = ScamPrefilter.train(samples[:split], **thresholds)
+        prefilter.save(args.out)
+        print(f"{args.out}: {len(prefilter.weights)} weights")
+        if split < len(samples):
+            evaluate(prefilter, samples[split:])
+    else:
+        evaluate(ScamPrefilter.load(args.model, **thresholds), samples)
+
+
+if __name__ == "__main__":
+    main()
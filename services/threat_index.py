@@ -0,0 +1,370 @@
+"""
+Локальный индекс доменов и ссылок из threat-фидов (URLhaus, OpenPhish,
+hosts-файлы, списки популярных сайтов).
+
+Формат файла индекса:
+    заголовок (MAGIC, число бит Bloom-фильтра, число хэш-функций, число ключей),
+    биты Bloom-фильтра, отсортированный массив 64-битных ключей.
+Файл открывается через mmap: Bloom-фильтр отсекает почти все промахи, точное
+совпадение проверяется бинарным поиском по отсортированному массиву.
+
+Сборка и бенчмарк:
+    python -m services.threat_index build --out data/threat_blocklist.idx urlhaus.txt openphish.txt
+    python -m services.threat_index build --out data/threat_allowlist.idx --hosts-only tranco.csv
+    python -m services.threat_index lookup data/threat_blocklist.idx http://evil.example/x
+    python -m services.threat_index bench --entries 2000000
+"""
+
+import argparse
+import bisect
+import hashlib
+import logging
+import mmap
+import os
+import random
+import re
+import struct
+import sys
+import tempfile
+import time
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"TIDX0001"
+HEADER = struct.Struct("<8sQIQ")
+BLOOM_BITS_PER_KEY = 10
+BLOOM_HASHES = 7
+RELOAD_CHECK_INTERVAL = 60.0
+
+_DOMAIN_RE = re.compile(r"^(?=.{1,253}$)([a-z0-9_-]{1,63}\.)+[a-z0-9-]{2,63}$")
+_HOSTS_PREFIXES = ("0.0.0.0", "127.0.0.1", "::", "::1")
+
+
+def normalize_host(host: str) -> Optional[str]:
+    host = host.strip().strip(".").lower()
+    if not host:
+        return None
+    if host.isascii():
+        return host
+    try:
+        return host.encode("idna").decode("ascii")
+    except UnicodeError:
+        return None
+
+
+def host_key(host: str) -> str:
+    return f"h:{host}"
+
+
+def url_key(host: str, path: str, query: str) -> str:
+    key = f"u:{host}{path or '/'}"
+    return f"{key}?{query}" if query else key
+
+
+def parent_hosts(host: str) -> Iterator[str]:
+    """Сам хост и его родительские домены вплоть до домена второго уровня."""
+    labels = host.split(".")
+    for i in range(max(len(labels) - 1, 1)):
+        yield ".".join(labels[i:])
+
+
+def key_hash(key: str) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(key.encode(), digest_size=8).digest(), "little"
+    )
+
+
+def _bloom_positions(key: int, bits: int, hashes: int) -> Iterator[int]:
+    h1 = key & 0xFFFFFFFF
+    h2 = (key >> 32) | 1
+    for i in range(hashes):
+        yield (h1 + i * h2) % bits
+
+
+def parse_feed_line(line: str, hosts_only: bool = False) -> Optional[str]:
+    """
+    Превращает строку фида в ключ индекса: полную ссылку (URLhaus, OpenPhish),
+    строку hosts-файла, CSV (Tranco, выгрузки URLhaus) или просто домен.
+    """
+    line = line.strip()
+    if not line or line[0] in "#!;":
+        return None
+
+    fields = [f.strip().strip('"') for f in re.split(r"[,\t ]+", line)]
+    if fields[0] in _HOSTS_PREFIXES and len(fields) > 1:
+        fields = fields[1:]
+
+    for field in fields:
+        if "://" in field:
+            parts = urlsplit(field)
+            host = normalize_host(parts.hostname or "")
+            if not host:
+                return None
+            if hosts_only or (parts.path in ("", "/") and not parts.query):
+                return host_key(host)
+            return url_key(host, parts.path, parts.query)
+
+        host = normalize_host(field)
+        if host and _DOMAIN_RE.match(host):
+            return host_key(host)
+
+    return None
+
+
+def build_index(keys: Iterable[str], out_path: str) -> int:
+    """Собирает файл индекса из ключей и атомарно заменяет out_path."""
+    hashes = array("Q", sorted({key_hash(key) for key in keys}))
+    bits = max(len(hashes) * BLOOM_BITS_PER_KEY, 64)
+    bits += -bits % 8
+    bloom = bytearray(bits // 8)
+
+    for value in hashes:
+        for pos in _bloom_positions(value, bits, BLOOM_HASHES):
+            bloom[pos >> 3] |= 1 << (pos & 7)
+
+    if sys.byteorder != "little":
+        hashes.byteswap()
+
+    out_dir = os.path.dirname(out_path) or "."
+    os.makedirs(out_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=out_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            out.write(HEADER.pack(MAGIC, bits, BLOOM_HASHES, len(hashes)))
+            out.write(bloom)
+            hashes.tofile(out)
+        os.replace(tmp_path, out_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+    return len(hashes)
+
+
+class DomainIndex:
+    """Открытый через mmap файл индекса (Bloom-фильтр + отсортированные ключи)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.mtime = os.stat(path).st_mtime
+
+        with open(path, "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.bits, self.hashes, self.size = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC:
+            self._mmap.close()
+            raise ValueError(f"{path}: not a threat index file")
+
+        bloom_start = HEADER.size
+        keys_start = bloom_start + self.bits // 8
+        view = memoryview(self._mmap)
+        self._bloom = view[bloom_start:keys_start]
+        self._keys = view[keys_start : keys_start + self.size * 8].cast("Q")
+
+    def might_contain(self, key: str) -> bool:
+        """Проверка только по Bloom-фильтру (возможны ложные срабатывания)."""
+        return self._bloom_check(key_hash(key))
+
+    def _bloom_check(self, value: int) -> bool:
+        bloom = self._bloom
+        for pos in _bloom_positions(value, self.bits, self.hashes):
+            if not bloom[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def __contains__(self, key: str) -> bool:
+        value = key_hash(key)
+        if not self._bloom_check(value):
+            return False
+
+        i = bisect.bisect_left(self._keys, value)
+        return i < self.size and self._keys[i] == value
+
+    def close(self) -> None:
+        self._keys.release()
+        self._bloom.release()
+        self._mmap.close()
+
+
+class _ReloadableIndex:
+    """DomainIndex, который переоткрывается, когда файл на диске обновился."""
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.index: Optional[DomainIndex] = None
+        self._checked_at = 0.0
+        self.reload()
+
+    def reload(self) -> None:
+        self._checked_at = time.monotonic()
+        if not self.path or not os.path.exists(self.path):
+            return
+
+        try:
+            mtime = os.stat(self.path).st_mtime
+            if self.index is not None and self.index.mtime == mtime:
+                return
+            new_index = DomainIndex(self.path)
+        except (OSError, ValueError) as e:
+            logger.error(f"Не удалось загрузить индекс {self.path}: {e}")
+            return
+
+        old_index, self.index = self.index, new_index
+        logger.info(f"Индекс {self.path} загружен: {new_index.size} записей")
+        if old_index is not None:
+            old_index.close()
+
+    def maybe_reload(self) -> None:
+        if time.monotonic() - self._checked_at >= RELOAD_CHECK_INTERVAL:
+            self.reload()
+
+    def __contains__(self, key: str) -> bool:
+        return self.index is not None and key in self.index
+
+    @property
+    def size(self) -> int:
+        return self.index.size if self.index is not None else 0
+
+    def close(self) -> None:
+        if self.index is not None:
+            self.index.close()
+            self.index = None
+
+
+class ThreatIndex:
+    """
+    Предварительный вердикт по ссылке без обращения к VirusTotal:
+    "malicious" для ссылок и доменов из блок-листа (с поддоменами), "clean"
+    для хостов из списка известных сайтов, None — если ссылка неизвестна.
+    Список известных сайтов сверяется только с самим хостом: поддомены на
+    общих хостингах (github.io, blogspot.com, workers.dev) принадлежат кому
+    угодно и чистыми не считаются.
+    """
+
+    def __init__(self, blocklist_path: Optional[str], allowlist_path: Optional[str]):
+        self.blocklist = _ReloadableIndex(blocklist_path)
+        self.allowlist = _ReloadableIndex(allowlist_path)
+
+        self.malicious = 0
+        self.clean = 0
+        self.unknown = 0
+
+    def verdict(self, link: str) -> Optional[str]:
+        self.blocklist.maybe_reload()
+        self.allowlist.maybe_reload()
+
+        parts = urlsplit(link if "://" in link else f"http://{link}")
+        host = normalize_host(parts.hostname or "")
+        if not host:
+            return None
+
+        if url_key(host, parts.path, parts.query) in self.blocklist or any(
+            host_key(h) in self.blocklist for h in parent_hosts(host)
+        ):
+            self.malicious += 1
+            return "malicious"
+
+        if host_key(host) in self.allowlist:
+            self.clean += 1
+            return "clean"
+
+        self.unknown += 1
+        return None
+
+    def close(self) -> None:
+        self.blocklist.close()
+        self.allowlist.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "blocklist_entries": self.blocklist.size,
+            "allowlist_entries": self.allowlist.size,
+            "malicious": self.malicious,
+            "clean": self.clean,
+            "unknown": self.unknown,
+        }
+
+
+def _read_feeds(paths: List[str], hosts_only: bool) -> Iterator[str]:
+    for path in paths:
+        with open(path, encoding="utf-8", errors="replace") as feed:
+            for line in feed:
+                key = parse_feed_line(line, hosts_only)
+                if key:
+                    yield key
+
+
+def _bench(entries: int, lookups: int) -> None:
+    rng = random.Random(42)
+    known = [f"site{i}-{rng.getrandbits(32):x}.example" for i in range(entries)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.idx")
+
+        started = time.perf_counter()
+        build_index((host_key(host) for host in known), path)
+        print(f"build: {entries} entries in {time.perf_counter() - started:.2f} s")
+        print(f"file size: {os.path.getsize(path) / 1024 / 1024:.1f} MiB")
+
+        index = ThreatIndex(path, None)
+        hits = [f"http://{rng.choice(known)}/" for _ in range(lookups)]
+        misses = [f"http://miss{i}.example/" for i in range(lookups)]
+
+        for name, links in (("hit", hits), ("miss", misses)):
+            started = time.perf_counter()
+            for link in links:
+                index.verdict(link)
+            per_lookup = (time.perf_counter() - started) / lookups * 1e6
+            print(f"verdict ({name}): {per_lookup:.2f} us/lookup")
+
+        blocklist = index.blocklist.index
+        assert blocklist is not None
+        bloom_passes = sum(
+            blocklist.might_contain(host_key(f"fp{i}.example")) for i in range(lookups)
+        )
+        print(f"bloom false positive rate: {bloom_passes / lookups:.3%}")
+        index.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m services.threat_index")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="собрать индекс из фидов")
+    build.add_argument("--out", required=True)
+    build.add_argument(
+        "--hosts-only",
+        action="store_true",
+        help="индексировать только домены (для списков популярных сайтов)",
+    )
+    build.add_argument("feeds", nargs="+")
+
+    lookup = commands.add_parser("lookup", help="проверить ссылки по индексу")
+    lookup.add_argument("index")
+    lookup.add_argument("links", nargs="+")
+
+    bench = commands.add_parser("bench", help="бенчмарк на синтетических данных")
+    bench.add_argument("--entries", type=int, default=1_000_000)
+    bench.add_argument("--lookups", type=int, default=100_000)
+
+    args = parser.parse_args()
+
+    if args.command == "build":
+        started = time.perf_counter()
+        count = build_index(_read_feeds(args.feeds, args.hosts_only), args.out)
+        print(f"{args.out}: {count} keys in {time.perf_counter() - started:.2f} s")
+    elif args.command == "lookup":
+        index = ThreatIndex(args.index, None)
+        for link in args.links:
+            print(f"{link}: {index.verdict(link) or 'unknown'}")
+        index.close()
+    else:
+        _bench(args.entries, args.lookups)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from services.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+Verdict = Tuple[str, Dict[str, Any]]
+
+
+class VerdictCache:
+    """
+    Двухуровневый кэш вердиктов VirusTotal: LRU в памяти и SQLite на диске.
+    Время жизни записи зависит от вердикта: чистые результаты живут меньше опасных.
+    """
+
+    def __init__(
+        self,
+        db_path: Optional[str],
+        memory_size: int,
+        clean_ttl: float,
+        malicious_ttl: float,
+    ):
+        self.db_path = db_path
+        self.clean_ttl = clean_ttl
+        self.malicious_ttl = malicious_ttl
+
+        self._memory: TTLCache[Verdict] = TTLCache(memory_size, clean_ttl)
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def open(self) -> None:
+        if not self.db_path or self._db is not None:
+            return
+
+        try:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            db = sqlite3.connect(self.db_path, check_same_thread=False)
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS verdicts ("
+                "key TEXT PRIMARY KEY, report_url TEXT NOT NULL, "
+                "stats TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            db.execute("DELETE FROM verdicts WHERE expires_at <= ?", (time.time(),))
+            db.commit()
+            self._db = db
+            logger.info(f"Кэш вердиктов открыт: {self.db_path}")
+        except sqlite3.Error as e:
+            logger.error(f"Не удалось открыть кэш вердиктов {self.db_path}: {e}")
+
+    def close(self) -> None:
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def ttl_for(self, stats: Dict[str, Any]) -> float:
+        if stats.get("malicious", 0) or stats.get("suspicious", 0):
+            return self.malicious_ttl
+        return self.clean_ttl
+
+    async def get(self, key: str) -> Optional[Verdict]:
+        verdict = self._memory.get(key)
+        if verdict is not None:
+            self.memory_hits += 1
+            return verdict
+
+        if self._db is not None:
+            row = await asyncio.to_thread(self._db_get, key)
+            if row is not None:
+                report_url, stats, expires_at = row
+                verdict = (report_url, stats)
+                self._memory.set(key, verdict, expires_at - time.time())
+                self.disk_hits += 1
+                return verdict
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, report_url: str, stats: Dict[str, Any]) -> None:
+        ttl = self.ttl_for(stats)
+        self._memory.set(key, (report_url, stats), ttl)
+
+        if self._db is not None:
+            await asyncio.to_thread(
+                self._db_set, key, report_url, stats, time.time() + ttl
+            )
+
+    def _db_get(self, key: str) -> Optional[Tuple[str, Dict[str, Any], float]]:
+        with self._db_lock:
+            if self._db is None:
+                return None
+            try:
+                row = self._db.execute(
+                    "SELECT report_url, stats, expires_at FROM verdicts WHERE key = ?",
+                    (key,),
+                ).fetchone()
+                if row is None:
+                    return None
+                if row[2] <= time.time():
+                    self._db.execute("DELETE FROM verdicts WHERE key = ?", (key,))
+                    self._db.commit()
+                    return None
+                return row[0], json.loads(row[1]), row[2]
+            except (sqlite3.Error, ValueError) as e:
+                logger.error(f"Ошибка чтения кэша вердиктов: {e}")
+                return None
+
+    def _db_set(
+        self, key: str, report_url: str, stats: Dict[str, Any], expires_at: float
+    ) -> None:
+        with self._db_lock:
+            if self._db is None:
+                return
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?, ?)",
+                    (key, report_url, json.dumps(stats), expires_at),
+                )
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.error(f"Ошибка записи кэша вердиктов: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        hits = self.memory_hits + self.disk_hits
+        return {
+            "memory_size": len(self._memory),
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": f"{hits / lookups:.1%}" if lookups else "n/a",
+            "disk_enabled": self._db is not None,
+        }
@@ -0,0 +1,170 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+import vt
+
+from services.rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+def _utc_day() -> str:
+    return datetime.now(timezone.utc).date().isoformat()
+
+
+def _seconds_until_utc_midnight() -> float:
+    now = datetime.now(timezone.utc)
+    midnight = (now + timedelta(days=1)).replace(
+        hour=0, minute=0, second=0, microsecond=0
+    )
+    return (midnight - now).total_seconds()
+
+
+class VTKey:
+    """Ключ VirusTotal: свой клиент, минутный token bucket и дневной счётчик."""
+
+    def __init__(
+        self,
+        token: str,
+        client_factory: Callable[[str], vt.Client],
+        requests_per_minute: float,
+        requests_per_day: int,
+    ):
+        self.name = f"…{token[-4:]}"
+        self.client = client_factory(token)
+        self.bucket = TokenBucket(
+            rate=requests_per_minute / 60, capacity=requests_per_minute
+        )
+        self.requests_per_day = requests_per_day
+
+        self.day = _utc_day()
+        self.used_today = 0
+        self.requests = 0
+        self.quota_errors = 0
+        self.cooldown_streak = 0
+
+    def remaining_today(self) -> float:
+        if self.day != _utc_day():
+            self.day = _utc_day()
+            self.used_today = 0
+        return self.requests_per_day - self.used_today
+
+    def can_serve(self, cost: float) -> bool:
+        return self.remaining_today() >= cost and self.bucket.tokens >= min(
+            cost, self.bucket.capacity
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "used_today": self.used_today,
+            "remaining_today": self.remaining_today(),
+            "tokens": round(self.bucket.tokens, 2),
+            "quota_errors": self.quota_errors,
+            "cooldown_seconds": round(self.bucket.paused_for),
+        }
+
+    def score(self) -> float:
+        """Доля оставшейся минутной и дневной квоты: чем больше, тем свободнее ключ."""
+        return (
+            self.bucket.tokens / self.bucket.capacity
+            + self.remaining_today() / self.requests_per_day
+        )
+
+
+class VTKeyPool:
+    """
+    Пул ключей VirusTotal. Каждый запрос уходит через ключ с наибольшим
+    запасом минутной и дневной квоты, ключи с ошибками квоты временно
+    выключаются. Пропускная способность растёт с числом ключей.
+    """
+
+    def __init__(
+        self,
+        tokens: List[str],
+        client_factory: Callable[[str], vt.Client],
+        requests_per_minute: float,
+        requests_per_day: int,
+    ):
+        if not tokens:
+            raise ValueError("VirusTotal key pool needs at least one API token")
+
+        self.keys = [
+            VTKey(token, client_factory, requests_per_minute, requests_per_day)
+            for token in dict.fromkeys(tokens)
+        ]
+
+    @property
+    def rate(self) -> float:
+        """Суммарная скорость пополнения квоты, запросов в секунду."""
+        return sum(
+            key.bucket.rate for key in self.keys if key.remaining_today() > 0
+        ) or min(key.bucket.rate for key in self.keys)
+
+    @property
+    def tokens(self) -> float:
+        return sum(key.bucket.tokens for key in self.keys if key.remaining_today() > 0)
+
+    def try_acquire(self, cost: float = 1.0) -> Optional[VTKey]:
+        candidates = [key for key in self.keys if key.can_serve(cost)]
+        if not candidates:
+            return None
+
+        key = max(candidates, key=VTKey.score)
+        key.bucket.try_acquire(cost)
+        key.used_today += int(cost)
+        key.requests += int(cost)
+        return key
+
+    def time_until_available(self, cost: float = 1.0) -> float:
+        waits = [
+            key.bucket.time_until_available(cost)
+            for key in self.keys
+            if key.remaining_today() >= cost
+        ]
+        return min(waits) if waits else _seconds_until_utc_midnight()
+
+    async def acquire(self, cost: float = 1.0) -> VTKey:
+        """Ждёт ключ, у которого хватает квоты на cost запросов, и списывает их."""
+        while True:
+            key = self.try_acquire(cost)
+            if key is not None:
+                return key
+            await asyncio.sleep(max(self.time_until_available(cost), 0.05))
+
+    async def wait_available(self) -> None:
+        while not any(key.can_serve(1) for key in self.keys):
+            await asyncio.sleep(max(self.time_until_available(), 0.05))
+
+    def report_success(self, key: VTKey) -> None:
+        key.cooldown_streak = 0
+
+    def report_quota_error(self, key: VTKey, cooldown: float) -> float:
+        """
+        Выключает ключ после ошибки квоты. Повторные ошибки подряд удваивают
+        паузу (вплоть до полуночи UTC, когда сбрасывается дневная квота).
+        Возвращает длительность паузы в секундах.
+        """
+        key.quota_errors += 1
+        key.cooldown_streak += 1
+        pause = min(
+            cooldown * 2 ** (key.cooldown_streak - 1), _seconds_until_utc_midnight()
+        )
+        key.bucket.pause(pause)
+        logger.warning(
+            f"Квота ключа VirusTotal {key.name} исчерпана, ключ на паузе {pause:.0f} с"
+        )
+        return pause
+
+    async def close(self) -> None:
+        for key in self.keys:
+            await key.client.close_async()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "keys": len(self.keys),
+            "available_keys": sum(key.can_serve(1) for key in self.keys),
+            "tokens": round(self.tokens, 2),
+        }
@@ -0,0 +1,151 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+FetchAnalysis = Callable[[str], Awaitable[Any]]
+
+
+class _PendingAnalysis:
+    def __init__(self, future: asyncio.Future, delay: float, deadline: float):
+        self.future = future
+        self.delay = delay
+        self.next_poll_at = time.monotonic() + delay
+        self.deadline = deadline
+
+
+class AnalysisPoller:
+    """
+    Единый планировщик опроса анализов VirusTotal.
+    Вызывающий код регистрирует id анализа и ждёт future, а одна фоновая задача
+    опрашивает все незавершённые анализы с нарастающей задержкой.
+    """
+
+    def __init__(
+        self,
+        fetch: FetchAnalysis,
+        initial_delay: float = 5.0,
+        max_delay: float = 60.0,
+        backoff: float = 1.5,
+        timeout: float = 600.0,
+        max_parallel_polls: int = 4,
+    ):
+        self.fetch = fetch
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.backoff = backoff
+        self.timeout = timeout
+        self.max_parallel_polls = max_parallel_polls
+
+        self._pending: Dict[str, _PendingAnalysis] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+        self.polls = 0
+        self.completed = 0
+        self.timed_out = 0
+
+    def submit(self, analysis_id: str) -> asyncio.Future:
+        """Ставит анализ в очередь опроса и возвращает future с его результатом."""
+        pending = self._pending.get(analysis_id)
+        if pending is not None:
+            return pending.future
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[analysis_id] = _PendingAnalysis(
+            future, self.initial_delay, time.monotonic() + self.timeout
+        )
+        self._ensure_running()
+        self._wakeup.set()
+        return future
+
+    async def wait(self, analysis_id: str) -> Dict[str, int]:
+        """Ждёт завершения анализа и возвращает его статистику."""
+        analysis = await asyncio.shield(self.submit(analysis_id))
+        return analysis.stats
+
+    def _ensure_running(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        for pending in self._pending.values():
+            if not pending.future.done():
+                pending.future.cancel()
+        self._pending.clear()
+
+    async def _run(self) -> None:
+        while True:
+            now = time.monotonic()
+            due = [
+                analysis_id
+                for analysis_id, pending in self._pending.items()
+                if pending.next_poll_at <= now
+            ][: self.max_parallel_polls]
+
+            if due:
+                await asyncio.gather(*(self._poll(analysis_id) for analysis_id in due))
+                continue
+
+            self._wakeup.clear()
+            if not self._pending:
+                await self._wakeup.wait()
+                continue
+
+            sleep_for = min(p.next_poll_at for p in self._pending.values()) - now
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(sleep_for, 0))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _poll(self, analysis_id: str) -> None:
+        pending = self._pending.get(analysis_id)
+        if pending is None:
+            return
+
+        self.polls += 1
+        try:
+            analysis = await self.fetch(analysis_id)
+        except Exception as e:
+            logger.warning(f"Ошибка опроса анализа {analysis_id}: {e}")
+            analysis = None
+
+        if pending.future.cancelled():
+            self._pending.pop(analysis_id, None)
+            return
+
+        if analysis is not None and analysis.status == "completed":
+            self._pending.pop(analysis_id, None)
+            pending.future.set_result(analysis)
+            self.completed += 1
+            return
+
+        now = time.monotonic()
+        if now >= pending.deadline:
+            self._pending.pop(analysis_id, None)
+            pending.future.set_exception(
+                TimeoutError(f"Analysis {analysis_id} did not complete in time")
+            )
+            self.timed_out += 1
+            return
+
+        pending.delay = min(pending.delay * self.backoff, self.max_delay)
+        pending.next_poll_at = min(now + pending.delay, pending.deadline)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": len(self._pending),
+            "polls": self.polls,
+            "completed": self.completed,
+            "timed_out": self.timed_out,
+        }
@@ -0,0 +1,211 @@
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, Optional, TypeVar
+
+import vt
+
+from services.resilience import ProviderGuard
+from services.vt_key_pool import VTKey, VTKeyPool
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+QUOTA_ERROR_CODES = ("QuotaExceededError", "TooManyRequestsError")
+
+VTCall = Callable[[vt.Client], Awaitable[Any]]
+
+
+class _Job:
+    def __init__(self, fn: VTCall, cost: float, timed: bool, future: asyncio.Future):
+        self.fn = fn
+        self.cost = cost
+        self.timed = timed
+        self.future = future
+        self.attempts = 0
+
+
+class VTScheduler:
+    """
+    Планировщик запросов к VirusTotal с учётом квоты.
+    Каждый запрос уходит через ключ из пула с наибольшим запасом квоты,
+    очереди пользователей обслуживаются по кругу, интерактивные запросы
+    идут раньше фоновых. Если задан guard, запросы идут через него:
+    при недоступности VirusTotal они сразу завершаются CircuitOpenError.
+    """
+
+    def __init__(
+        self,
+        keys: VTKeyPool,
+        quota_cooldown: float = 60.0,
+        max_quota_retries: int = 3,
+        guard: Optional[ProviderGuard] = None,
+    ):
+        self.keys = keys
+        self.guard = guard
+        self.quota_cooldown = quota_cooldown
+        self.max_quota_retries = max_quota_retries
+
+        self._queues: Dict[int, "OrderedDict[Hashable, Deque[_Job]]"] = {
+            PRIORITY_INTERACTIVE: OrderedDict(),
+            PRIORITY_BACKGROUND: OrderedDict(),
+        }
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._running: set[asyncio.Task] = set()
+
+        self.dispatched = 0
+        self.quota_errors = 0
+
+    async def run(
+        self,
+        fn: Callable[[vt.Client], Awaitable[T]],
+        user_id: Hashable = None,
+        priority: int = PRIORITY_INTERACTIVE,
+        cost: float = 1.0,
+        timed: bool = True,
+    ) -> T:
+        """
+        Ставит вызов в очередь пользователя и ждёт его результат.
+        timed=False — вызов без адаптивного таймаута (загрузка файла).
+        """
+        if self.guard is not None:
+            self.guard.check()
+        future = asyncio.get_running_loop().create_future()
+        self._enqueue(_Job(fn, cost, timed, future), user_id, priority)
+        return await future
+
+    def position(self, user_id: Hashable) -> Optional[int]:
+        """
+        Позиция ближайшего запроса пользователя в общей очереди (начиная с 1).
+        None, если у пользователя нет ожидающих запросов.
+        """
+        ahead = 0
+        for priority in sorted(self._queues):
+            queue = self._queues[priority]
+            if user_id in queue:
+                return ahead + list(queue).index(user_id) + 1
+            ahead += sum(len(jobs) for jobs in queue.values())
+        return None
+
+    def estimated_wait(self, position: int) -> float:
+        """Примерное время ожидания в секундах для заданной позиции в очереди."""
+        return max(position - self.keys.tokens, 0.0) / self.keys.rate
+
+    def queue_size(self) -> int:
+        return sum(
+            len(jobs) for queue in self._queues.values() for jobs in queue.values()
+        )
+
+    def _enqueue(
+        self, job: _Job, user_id: Hashable, priority: int, front: bool = False
+    ) -> None:
+        queue = self._queues[priority]
+        jobs = queue.setdefault(user_id, deque())
+        if front:
+            jobs.appendleft(job)
+        else:
+            jobs.append(job)
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._dispatch())
+        self._wakeup.set()
+
+    def _next_job(self) -> Optional[tuple[_Job, Hashable, int]]:
+        for priority in sorted(self._queues):
+            queue = self._queues[priority]
+            while queue:
+                user_id, jobs = queue.popitem(last=False)
+                job = jobs.popleft()
+                if jobs:
+                    queue[user_id] = jobs
+                if job.future.cancelled():
+                    continue
+                return job, user_id, priority
+        return None
+
+    async def _dispatch(self) -> None:
+        while True:
+            if not self.queue_size():
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            await self.keys.wait_available()
+
+            picked = self._next_job()
+            if picked is None:
+                continue
+
+            job, user_id, priority = picked
+            # Все запросы одного вызова (например, загрузка файла) идут через один ключ.
+            key = await self.keys.acquire(job.cost)
+
+            task = asyncio.create_task(self._execute(job, key, user_id, priority))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+            self.dispatched += 1
+
+    async def _execute(
+        self, job: _Job, key: VTKey, user_id: Hashable, priority: int
+    ) -> None:
+        job.attempts += 1
+        try:
+            if self.guard is not None:
+                result = await self.guard.call(
+                    lambda: job.fn(key.client), timed=job.timed
+                )
+            else:
+                result = await job.fn(key.client)
+        except vt.APIError as e:
+            if (
+                e.code in QUOTA_ERROR_CODES
+                and job.attempts <= self.max_quota_retries
+                and not job.future.cancelled()
+            ):
+                self.quota_errors += 1
+                self.keys.report_quota_error(key, self.quota_cooldown)
+                self._enqueue(job, user_id, priority, front=True)
+                return
+            if not job.future.done():
+                job.future.set_exception(e)
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            self.keys.report_success(key)
+            if not job.future.done():
+                job.future.set_result(result)
+
+    async def stop(self) -> None:
+        tasks = [t for t in (self._task, *self._running) if t is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+
+        for queue in self._queues.values():
+            for jobs in queue.values():
+                for job in jobs:
+                    job.future.cancel()
+            queue.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued_interactive": sum(
+                len(jobs) for jobs in self._queues[PRIORITY_INTERACTIVE].values()
+            ),
+            "queued_background": sum(
+                len(jobs) for jobs in self._queues[PRIORITY_BACKGROUND].values()
+            ),
+            "users_waiting": len(
+                set().union(*(queue.keys() for queue in self._queues.values()))
+            ),
+            "dispatched": self.dispatched,
+            "quota_errors": self.quota_errors,
+            "tokens": round(self.keys.tokens, 2),
+        }
@@ -0,0 +1,112 @@
+import asyncio
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import time
+import unittest
+import zipfile
+from unittest import mock
+
+for name in (
+    "MAX_BOT_TOKEN",
+    "VIRUSTOTAL_API_TOKEN",
+    "LEAKLOOKUP_PUBLIC_KEY",
+    "AI_TUNNEL_TOKEN",
+):
+    os.environ.setdefault(name, "test")
+
+import virus_checker
+from services.archive_scanner import SPOOL_MEMORY, extract_member
+
+
+class CheckArchiveTest(unittest.IsolatedAsyncioTestCase):
+    async def test_unknown_members_of_large_archive_are_uploaded_intact(self):
+        contents = {f"file{i}.bin": os.urandom(1024 * 1024) for i in range(8)}
+        archive = tempfile.TemporaryFile()
+        self.addCleanup(archive.close)
+        with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zf:
+            for name, data in contents.items():
+                zf.writestr(name, data)
+        size = archive.tell()
+        self.assertGreater(size, SPOOL_MEMORY)
+
+        # Извлечения двигают позицию общего файла архива и не должны пересекаться.
+        lock = threading.Lock()
+        running = 0
+        overlaps = 0
+
+        def extract(file, path, limits):
+            nonlocal running, overlaps
+            with lock:
+                running += 1
+                overlaps += running > 1
+            try:
+                time.sleep(0.01)
+                return extract_member(file, path, limits)
+            finally:
+                with lock:
+                    running -= 1
+
+        async def get_file_report(sha256, user_id=None, priority=0):
+            return None
+
+        uploaded = []
+
+        async def upload_file(file, user_id=None, priority=0):
+            file.seek(0)
+            data = await asyncio.to_thread(file.read)
+            sha256 = hashlib.sha256(data).hexdigest()
+            uploaded.append(sha256)
+            return virus_checker.file_report_url(sha256), {"malicious": 0}
+
+        with (
+            mock.patch.object(virus_checker, "extract_member", extract),
+            mock.patch.object(virus_checker, "get_file_report", get_file_report),
+            mock.patch.object(virus_checker, "upload_file", upload_file),
+            mock.patch.object(
+                virus_checker.settings, "ARCHIVE_MAX_UPLOADS", len(contents)
+            ),
+        ):
+            verdicts = await virus_checker.check_archive(
+                archive, "archive-sha256", "archive.zip", size
+            )
+
+        expected = {hashlib.sha256(data).hexdigest() for data in contents.values()}
+        self.assertEqual(overlaps, 0)
+        self.assertEqual(sorted(uploaded), sorted(expected))
+        self.assertEqual({v.sha256 for v in verdicts}, expected)
+        self.assertEqual({v.name for v in verdicts}, set(contents))
+
+    async def test_same_unsupported_archive_is_uploaded_once(self):
+        uploads = 0
+
+        async def get_file_report(sha256, user_id=None, priority=0):
+            return None
+
+        async def upload_file(file, user_id=None, priority=0):
+            nonlocal uploads
+            uploads += 1
+            await asyncio.sleep(0.01)
+            return "report", {"malicious": 0}
+
+        with (
+            mock.patch.object(virus_checker, "get_file_report", get_file_report),
+            mock.patch.object(virus_checker, "upload_file", upload_file),
+        ):
+            verdicts = await asyncio.gather(
+                *(
+                    virus_checker.check_archive(
+                        io.BytesIO(b"not an archive"), "same-sha256", "a.zip", 14
+                    )
+                    for _ in range(2)
+                )
+            )
+
+        self.assertEqual(uploads, 1)
+        self.assertEqual([v[0].report_url for v in verdicts], ["report", "report"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+
+from services.group_scanner import GroupScanner
+
+
+def make_scanner(burst: float = 3) -> GroupScanner:
+    return GroupScanner(
+        db_path=None,
+        dedupe_window=3600,
+        chat_requests_per_hour=1,
+        chat_burst=burst,
+        queue_soft_limit=100,
+        queue_hard_limit=200,
+        queue_size=lambda: 0,
+    )
+
+
+class GroupScannerTest(unittest.TestCase):
+    def test_duplicates_do_not_spend_budget(self):
+        scanner = make_scanner(burst=2)
+        self.assertTrue(scanner.admit(1, "sha"))
+        for _ in range(5):
+            self.assertFalse(scanner.admit(1, "sha"))
+        self.assertTrue(scanner.has_budget(1))
+        self.assertTrue(scanner.admit(1, "other"))
+        self.assertFalse(scanner.has_budget(1))
+
+    def test_has_budget_does_not_spend_it(self):
+        scanner = make_scanner(burst=1)
+        for _ in range(3):
+            self.assertTrue(scanner.has_budget(1))
+        self.assertTrue(scanner.admit(1, "sha"))
+
+    def test_forget_allows_retry(self):
+        scanner = make_scanner()
+        self.assertTrue(scanner.admit(1, "sha"))
+        scanner.forget(1, "sha")
+        self.assertFalse(scanner.seen(1, "sha"))
+        self.assertTrue(scanner.admit(1, "sha"))
+
+
+if __name__ == "__main__":
+    unittest.main()
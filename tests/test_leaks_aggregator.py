@@ -0,0 +1,122 @@
+import os
+import unittest
+from unittest import mock
+
+for name in (
+    "MAX_BOT_TOKEN",
+    "VIRUSTOTAL_API_TOKEN",
+    "LEAKLOOKUP_PUBLIC_KEY",
+    "AI_TUNNEL_TOKEN",
+):
+    os.environ.setdefault(name, "test")
+
+import leaks_aggregator
+from leaks_aggregator import (
+    LeakInfo,
+    LeakSearchResult,
+    build_check_item,
+    leak_query_key,
+    merge_leaks,
+    normalize_check_value,
+    normalize_phone,
+    search_leaks,
+)
+from services.breach_catalog import canonical_breach_name
+
+
+class MergeLeaksTest(unittest.TestCase):
+    def test_canonical_name_keeps_unicode_letters(self):
+        self.assertEqual(canonical_breach_name("Vk.Com"), "vk")
+        self.assertEqual(canonical_breach_name("Гемотест"), "гемотест")
+        self.assertEqual(canonical_breach_name(None), "")
+
+    def test_same_breach_from_different_providers_is_merged(self):
+        leaks = [
+            LeakInfo(site="VK", sources=["XposedOrNot"]),
+            LeakInfo(site="vk.com", records=100, sources=["Leak-Lookup"]),
+        ]
+        merged = merge_leaks(leaks)
+        self.assertEqual(len(merged), 1)
+        self.assertEqual(merged[0].records, 100)
+        self.assertEqual(merged[0].sources, ["XposedOrNot", "Leak-Lookup"])
+
+    def test_unrelated_cyrillic_breaches_are_not_merged(self):
+        leaks = [LeakInfo(site="Гемотест"), LeakInfo(site="СДЭК")]
+        self.assertEqual(len(merge_leaks(leaks)), 2)
+
+    def test_unnamed_leaks_are_not_merged(self):
+        leaks = [
+            LeakInfo(site=None, sources=["Pwned Passwords"]),
+            LeakInfo(site=None, sources=["Leak-Lookup"]),
+            LeakInfo(site="", sources=["XposedOrNot"]),
+        ]
+        self.assertEqual(len(merge_leaks(leaks)), 3)
+
+
+class NormalizationTest(unittest.TestCase):
+    def test_russian_phones_are_normalized_to_plus_seven(self):
+        for value in ("89161234567", "+79161234567", "79161234567", "9161234567"):
+            self.assertEqual(normalize_phone(value), "+79161234567", value)
+
+    def test_foreign_phones_keep_their_digits(self):
+        self.assertEqual(normalize_phone("+9161234567"), "+9161234567")
+        self.assertEqual(normalize_phone("+44 20 7946 0958"), "+442079460958")
+
+    def test_check_items_are_classified_and_normalized(self):
+        email = build_check_item("  User@Mail.RU ")
+        self.assertEqual(email.type, "Email")
+        self.assertEqual(normalize_check_value(email), "user@mail.ru")
+
+        phone = build_check_item("89161234567")
+        self.assertEqual(phone.type, "Number")
+
+        password = build_check_item("Secret 123")
+        self.assertEqual(password.type, "Password_or_login")
+        self.assertEqual(normalize_check_value(password), "Secret 123")
+
+    def test_same_value_in_any_format_has_one_key(self):
+        self.assertEqual(
+            leak_query_key(build_check_item("89161234567")),
+            leak_query_key(build_check_item("+79161234567")),
+        )
+        self.assertNotEqual(
+            leak_query_key(build_check_item("Secret")),
+            leak_query_key(build_check_item("secret")),
+        )
+
+
+class LeakCacheTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        leaks_aggregator._LEAK_CACHE.clear()
+        self.addCleanup(leaks_aggregator._LEAK_CACHE.clear)
+
+    async def search(self, result, *values):
+        backend = mock.AsyncMock(return_value=result)
+        with mock.patch.object(leaks_aggregator, "_search_leaks", backend):
+            for value in values:
+                self.assertEqual(await search_leaks(value), result)
+        return backend
+
+    async def test_repeated_query_is_served_from_cache(self):
+        result = LeakSearchResult(leaks=[LeakInfo(site="VK")], checked=["Leak-Lookup"])
+        backend = await self.search(result, "89161234567", "+79161234567")
+        backend.assert_awaited_once()
+
+    async def test_result_without_answers_is_not_cached(self):
+        result = LeakSearchResult(failed=["Leak-Lookup"])
+        backend = await self.search(result, "user@mail.ru", "user@mail.ru")
+        self.assertEqual(backend.await_count, 2)
+
+    async def test_partial_result_is_cached_briefly(self):
+        result = LeakSearchResult(checked=["XposedOrNot"], timed_out=["Leak-Lookup"])
+        with mock.patch.object(leaks_aggregator._LEAK_CACHE, "set") as cache_set:
+            await self.search(result, "user@mail.ru")
+        cache_set.assert_called_once()
+        self.assertEqual(
+            cache_set.call_args.args[2],
+            leaks_aggregator.settings.LEAK_CACHE_PARTIAL_TTL,
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
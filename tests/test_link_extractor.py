@@ -0,0 +1,53 @@
+import unittest
+
+from services.link_extractor import canonicalize_link, extract_links
+
+
+class ExtractLinksTest(unittest.TestCase):
+    def test_links_with_and_without_scheme(self):
+        links = extract_links(
+            [
+                "Зайди на example.com, и https://Пример.рф/путь?q=1#x ещё hxxp://evil.test/a)."
+            ]
+        )
+        self.assertCountEqual(
+            links,
+            [
+                "https://example.com/",
+                "https://xn--e1afmkfd.xn--p1ai/путь?q=1",
+                "http://evil.test/a",
+            ],
+        )
+
+    def test_markdown_and_html_links(self):
+        links = extract_links(
+            ['[тут](https://a.example/x) и <a href="http://b.example/">b</a>']
+        )
+        self.assertEqual(links, ["https://a.example/x", "http://b.example/"])
+
+    def test_file_names_and_emails_are_not_links(self):
+        self.assertEqual(extract_links(["report.pdf, отчёт.docx, user@mail.ru"]), [])
+
+    def test_duplicates_and_limit(self):
+        self.assertEqual(
+            extract_links(["https://x.example/"], markup_urls=["https://x.example/"]),
+            ["https://x.example/"],
+        )
+        text = " ".join(f"site{i}.com" for i in range(20))
+        self.assertEqual(len(extract_links([text], limit=3)), 3)
+
+    def test_canonicalize_link(self):
+        self.assertEqual(
+            canonicalize_link("HTTPS://Example.COM:8443/a?b=1#frag"),
+            "https://example.com:8443/a?b=1",
+        )
+        self.assertEqual(
+            canonicalize_link("https://example.com/wiki/A_(b))."),
+            "https://example.com/wiki/A_(b)",
+        )
+        self.assertIsNone(canonicalize_link("ftp://example.com/"))
+        self.assertIsNone(canonicalize_link("https://localhost/"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+
+from services.prompt_builder import (
+    PROMPT_AUTO,
+    PROMPT_COMPACT,
+    build_prompt,
+    count_tokens,
+    split_conversation,
+    trim_conversation,
+)
+
+FILLER = "обычное сообщение про погоду выходные и планы на вечер " * 4
+
+
+def conversation(count: int, marked: int = -1) -> str:
+    lines = []
+    for i in range(count):
+        text = f"{i}: {FILLER}"
+        if i == marked:
+            text = f"{i}: продиктуйте код из смс, пожалуйста"
+        lines.append(f"Собеседник {i % 2 + 1}: {text}")
+    return "\n".join(lines) + "\n[Контекст: личный чат]"
+
+
+class TrimConversationTest(unittest.TestCase):
+    def test_short_conversation_is_unchanged(self):
+        text = conversation(3)
+        self.assertEqual(trim_conversation(text, 10_000), (text, 0))
+
+    def test_split_conversation_keeps_context_footer(self):
+        messages, footer = split_conversation(conversation(4))
+        self.assertEqual(len(messages), 4)
+        self.assertEqual(footer, "[Контекст: личный чат]")
+
+    def test_trimmed_conversation_fits_budget_and_keeps_key_messages(self):
+        text = conversation(60, marked=20)
+        budget = 600
+        trimmed, dropped = trim_conversation(text, budget)
+
+        self.assertLessEqual(count_tokens(trimmed), budget)
+        self.assertGreater(dropped, 0)
+        self.assertIn("продиктуйте код из смс", trimmed)
+        self.assertIn("Собеседник 2: 59:", trimmed)
+        self.assertIn("Собеседник 1: 0:", trimmed)
+        self.assertIn("пропущено сообщений", trimmed)
+        self.assertTrue(trimmed.endswith("[Контекст: личный чат]"))
+
+    def test_kept_messages_stay_in_order(self):
+        trimmed, _ = trim_conversation(conversation(60, marked=20), 600)
+        positions = [
+            int(line.split(": ")[1])
+            for line in trimmed.splitlines()
+            if line.startswith("Собеседник")
+        ]
+        self.assertEqual(positions, sorted(positions))
+
+
+class BuildPromptTest(unittest.TestCase):
+    FULL = "полный системный промпт " * 200
+    COMPACT = "краткий промпт"
+
+    def test_full_prompt_when_it_fits(self):
+        prompt = build_prompt(
+            conversation(3), self.FULL, self.COMPACT, 10_000, PROMPT_AUTO
+        )
+        self.assertFalse(prompt.compact)
+        self.assertEqual(prompt.dropped, 0)
+
+    def test_compact_prompt_and_trimming_when_over_budget(self):
+        budget = 1500
+        prompt = build_prompt(
+            conversation(60), self.FULL, self.COMPACT, budget, PROMPT_AUTO
+        )
+        self.assertTrue(prompt.compact)
+        self.assertEqual(prompt.system, self.COMPACT)
+        self.assertGreater(prompt.dropped, 0)
+        self.assertLessEqual(prompt.tokens, budget)
+
+    def test_compact_mode_is_forced(self):
+        prompt = build_prompt(
+            conversation(3), self.FULL, self.COMPACT, 10_000, PROMPT_COMPACT
+        )
+        self.assertTrue(prompt.compact)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+import hashlib
+import os
+import tempfile
+import unittest
+
+from services.pwned_offline import OfflinePwnedIndex, convert
+
+
+def sha1(password: str) -> str:
+    return hashlib.sha1(password.encode()).hexdigest().upper()
+
+
+class OfflinePwnedIndexTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        self.path = os.path.join(tmp.name, "pwned.bin")
+
+    def open(self) -> OfflinePwnedIndex:
+        index = OfflinePwnedIndex(self.path)
+        self.addCleanup(index.close)
+        return index
+
+    def test_convert_and_lookup(self):
+        counts = {"password": 10, "123456": 25, "qwerty": 7}
+        lines = sorted(f"{sha1(p)}:{n}\n" for p, n in counts.items())
+        self.assertEqual(convert(lines, self.path), 3)
+
+        index = self.open()
+        self.assertEqual(index.size, 3)
+        for password, count in counts.items():
+            self.assertEqual(index.count_password(password), count)
+            self.assertEqual(index.count(sha1(password).lower()), count)
+        self.assertEqual(index.count_password("not in the list"), 0)
+
+    def test_unsorted_input_is_rejected_and_old_file_kept(self):
+        convert([f"{sha1('password')}:1"], self.path)
+        lines = sorted(f"{sha1(p)}:1" for p in ("a", "b"))[::-1]
+        with self.assertRaises(ValueError):
+            convert(lines, self.path)
+
+        self.assertEqual(self.open().count_password("password"), 1)
+        self.assertEqual(
+            [name for name in os.listdir(self.dir) if name.endswith(".tmp")], []
+        )
+
+    def test_other_files_are_rejected(self):
+        with open(self.path, "wb") as f:
+            f.write(b"not an index" * 10)
+        with self.assertRaises(ValueError):
+            OfflinePwnedIndex(self.path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+from unittest import mock
+
+from services import pwned_passwords
+from services.pwned_passwords import (
+    is_password_pwned,
+    parse_range,
+    range_contains,
+    split_sha1,
+)
+
+
+class ParseRangeTest(unittest.TestCase):
+    def test_range_is_parsed_into_sorted_keys(self):
+        suffixes = ["F" * 35, "0" * 35, "1E4C9B93F3F0682250B6CF8331B7EE68FD8"]
+        text = "\r\n".join(f"{suffix}:{i + 1}" for i, suffix in enumerate(suffixes))
+        keys = parse_range(text)
+
+        self.assertEqual(keys.typecode, "Q")
+        self.assertEqual(list(keys), sorted(keys))
+        self.assertEqual(len(keys), 3)
+        for suffix in suffixes:
+            self.assertTrue(range_contains(keys, suffix))
+        self.assertFalse(range_contains(keys, "A" * 35))
+
+    def test_padding_and_malformed_lines_are_skipped(self):
+        keys = parse_range(f"{'A' * 35}:0\n{'B' * 35}:\nshort:5\n\n{'C' * 35}:2")
+        self.assertEqual(len(keys), 1)
+        self.assertFalse(range_contains(keys, "A" * 35))
+        self.assertTrue(range_contains(keys, "C" * 35))
+
+
+class PwnedPasswordsGuardTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.addCleanup(pwned_passwords._RANGES.clear)
+        self.addCleanup(pwned_passwords._GUARD._latencies.clear)
+        pwned_passwords._RANGES.clear()
+        pwned_passwords._GUARD._latencies.clear()
+
+    async def test_only_network_fetches_are_timed(self):
+        prefix, suffix = split_sha1("password")
+        download = mock.AsyncMock(return_value=f"{suffix}:3\r\n")
+
+        with mock.patch.object(pwned_passwords, "_download_range", download):
+            for _ in range(3):
+                self.assertTrue(await is_password_pwned("password"))
+
+        download.assert_awaited_once_with(prefix)
+        self.assertEqual(len(pwned_passwords._GUARD._latencies), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+import os
+import tempfile
+import unittest
+
+from services.threat_index import ThreatIndex, build_index, host_key
+
+
+class ThreatIndexTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        blocklist = os.path.join(tmp.name, "blocklist.idx")
+        allowlist = os.path.join(tmp.name, "allowlist.idx")
+        build_index([host_key("evil.example")], blocklist)
+        build_index([host_key("github.io"), host_key("example.com")], allowlist)
+
+        self.index = ThreatIndex(blocklist, allowlist)
+        self.addCleanup(self.index.close)
+
+    def test_allowlist_matches_exact_host(self):
+        self.assertEqual(self.index.verdict("https://github.io/"), "clean")
+        self.assertEqual(self.index.verdict("https://example.com/login"), "clean")
+
+    def test_allowlist_does_not_clear_subdomains(self):
+        self.assertIsNone(self.index.verdict("https://x.github.io/"))
+        self.assertIsNone(self.index.verdict("https://phish-bank.github.io/login"))
+
+    def test_blocklist_matches_subdomains(self):
+        self.assertEqual(self.index.verdict("http://evil.example/x"), "malicious")
+        self.assertEqual(self.index.verdict("http://cdn.evil.example/x"), "malicious")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import asyncio
+import os
+import unittest
+from unittest import mock
+
+for name in (
+    "MAX_BOT_TOKEN",
+    "VIRUSTOTAL_API_TOKEN",
+    "LEAKLOOKUP_PUBLIC_KEY",
+    "AI_TUNNEL_TOKEN",
+):
+    os.environ.setdefault(name, "test")
+
+import virus_checker
+from services.attachments import spooled_file
+
+
+class CheckFileTest(unittest.IsolatedAsyncioTestCase):
+    async def test_shared_scan_outlives_cancelled_caller(self):
+        first = spooled_file("a.bin", max_size=16)
+        first.write(b"x" * 64)
+        second = spooled_file("b.bin", max_size=16)
+        second.write(b"x" * 64)
+        self.addCleanup(second.close)
+
+        uploading = asyncio.Event()
+        release = asyncio.Event()
+
+        async def get_file_report(sha256, user_id=None, priority=0):
+            return None
+
+        async def upload_file(file, user_id=None, priority=0):
+            uploading.set()
+            await release.wait()
+            file.seek(0)
+            return "report", {"size": len(file.read())}
+
+        async def scan(file):
+            try:
+                return await virus_checker.check_file(file, "same-sha256")
+            finally:
+                file.close()
+
+        with (
+            mock.patch.object(virus_checker, "get_file_report", get_file_report),
+            mock.patch.object(virus_checker, "upload_file", upload_file),
+        ):
+            originator = asyncio.create_task(scan(first))
+            await uploading.wait()
+            waiter = asyncio.create_task(scan(second))
+            await asyncio.sleep(0)
+
+            originator.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await originator
+            self.assertFalse(first.closed)
+
+            release.set()
+            self.assertEqual(await waiter, ("report", {"size": 64}))
+
+        await asyncio.sleep(0)
+        self.assertTrue(first.closed)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+from unittest import mock
+
+from services import vt_key_pool
+from services.vt_key_pool import VTKeyPool
+
+
+def make_pool(tokens, per_minute: float = 2, per_day: int = 100) -> VTKeyPool:
+    return VTKeyPool(list(tokens), lambda token: token, per_minute, per_day)
+
+
+class VTKeyPoolTest(unittest.TestCase):
+    def test_each_key_has_its_own_bucket(self):
+        pool = make_pool(["key-one", "key-two"], per_minute=2)
+        acquired = [pool.try_acquire() for _ in range(4)]
+        self.assertNotIn(None, acquired)
+        self.assertIsNone(pool.try_acquire())
+        for key in pool.keys:
+            self.assertEqual(key.requests, 2)
+
+    def test_requests_rotate_to_the_least_used_key(self):
+        pool = make_pool(["key-one", "key-two"], per_minute=10)
+        clients = [pool.try_acquire().client for _ in range(4)]
+        self.assertEqual(clients[0::2], [clients[0]] * 2)
+        self.assertEqual(clients[1::2], [clients[1]] * 2)
+        self.assertNotEqual(clients[0], clients[1])
+
+    def test_duplicate_tokens_make_one_key(self):
+        self.assertEqual(len(make_pool(["key-one", "key-one"]).keys), 1)
+
+    def test_daily_quota_resets_on_new_utc_day(self):
+        pool = make_pool(["key-one"], per_minute=10, per_day=1)
+        with mock.patch.object(vt_key_pool, "_utc_day", return_value="2026-01-01"):
+            pool.keys[0].day = "2026-01-01"
+            self.assertIsNotNone(pool.try_acquire())
+            self.assertIsNone(pool.try_acquire())
+
+        with mock.patch.object(vt_key_pool, "_utc_day", return_value="2026-01-02"):
+            self.assertEqual(pool.keys[0].remaining_today(), 1)
+            self.assertIsNotNone(pool.try_acquire())
+
+    def test_quota_error_pauses_key_with_growing_cooldown(self):
+        pool = make_pool(["key-one", "key-two"], per_minute=10)
+        key = pool.try_acquire()
+
+        first = pool.report_quota_error(key, cooldown=10)
+        second = pool.report_quota_error(key, cooldown=10)
+        self.assertEqual(
+            second, min(first * 2, vt_key_pool._seconds_until_utc_midnight())
+        )
+        self.assertFalse(key.can_serve(1))
+        self.assertIsNot(pool.try_acquire(), key)
+
+        pool.report_success(key)
+        self.assertEqual(key.cooldown_streak, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
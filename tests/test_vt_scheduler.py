@@ -0,0 +1,91 @@
+import asyncio
+import unittest
+
+import vt
+
+from services.vt_key_pool import VTKeyPool
+from services.vt_scheduler import PRIORITY_BACKGROUND, VTScheduler
+
+
+def make_pool(tokens=("key-one",), per_minute: float = 60) -> VTKeyPool:
+    return VTKeyPool(list(tokens), lambda token: token, per_minute, 1000)
+
+
+class VTSchedulerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.scheduler = VTScheduler(make_pool(), quota_cooldown=60)
+        self.calls = []
+
+    async def asyncTearDown(self):
+        await self.scheduler.stop()
+
+    def job(self, label):
+        async def fn(client):
+            self.calls.append(label)
+            return label
+
+        return fn
+
+    async def test_users_are_served_round_robin(self):
+        tasks = [
+            asyncio.create_task(self.scheduler.run(self.job(label), user_id=user))
+            for user, label in [("a", "a1"), ("a", "a2"), ("a", "a3"), ("b", "b1")]
+        ]
+        await asyncio.gather(*tasks)
+        self.assertEqual(self.calls, ["a1", "b1", "a2", "a3"])
+
+    async def test_interactive_jobs_go_before_background(self):
+        tasks = [
+            asyncio.create_task(
+                self.scheduler.run(
+                    self.job("background"), user_id="a", priority=PRIORITY_BACKGROUND
+                )
+            ),
+            asyncio.create_task(self.scheduler.run(self.job("interactive"), "b")),
+        ]
+        await asyncio.gather(*tasks)
+        self.assertEqual(self.calls, ["interactive", "background"])
+
+    async def test_position_counts_jobs_ahead(self):
+        release = asyncio.Event()
+
+        async def blocked(client):
+            await release.wait()
+
+        # Ключ без свободной квоты: все запросы остаются в очереди.
+        self.scheduler.keys.keys[0].bucket.pause(60)
+        tasks = [
+            asyncio.create_task(self.scheduler.run(blocked, user_id="bg", priority=1)),
+            asyncio.create_task(self.scheduler.run(blocked, user_id="a")),
+            asyncio.create_task(self.scheduler.run(blocked, user_id="a")),
+            asyncio.create_task(self.scheduler.run(blocked, user_id="b")),
+        ]
+        await asyncio.sleep(0)
+
+        self.assertEqual(self.scheduler.position("a"), 1)
+        self.assertEqual(self.scheduler.position("b"), 2)
+        self.assertEqual(self.scheduler.position("bg"), 4)
+        self.assertIsNone(self.scheduler.position("nobody"))
+        self.assertEqual(self.scheduler.queue_size(), 4)
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def test_quota_error_retries_through_another_key(self):
+        self.scheduler = VTScheduler(make_pool(("key-one", "key-two")))
+        clients = []
+
+        async def fn(client):
+            clients.append(client)
+            if len(clients) == 1:
+                raise vt.APIError("QuotaExceededError", "quota exceeded")
+            return "ok"
+
+        self.assertEqual(await self.scheduler.run(fn), "ok")
+        self.assertEqual(len(set(clients)), 2)
+        self.assertEqual(self.scheduler.quota_errors, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
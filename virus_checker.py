@@ -1,75 +1,427 @@
-from typing import Dict, Any, Tuple
+from typing import (
+    Any,
+    Awaitable,
+    BinaryIO,
+    Callable,
+    Dict,
+    Hashable,
+    List,
+    Literal,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+from pydantic import BaseModel
+import asyncio
 import logging
 import os
 from config import settings
+from services.archive_scanner import (
+    ArchiveBombError,
+    ArchiveLimits,
+    ArchiveMember,
+    UnsupportedArchiveError,
+    extract_member,
+    hash_archive_members,
+)
+from services.attachments import keep_open
+from services.group_scanner import GroupScanner
+from services.http import create_connector
+from services.link_extractor import canonicalize_link
+from services.metrics import register_metrics
+from services.resilience import provider_guard
+from services.singleflight import SingleFlight
+from services.threat_index import ThreatIndex
+from services.verdict_cache import VerdictCache
+from services.vt_key_pool import VTKeyPool
+from services.vt_poller import AnalysisPoller
+from services.vt_scheduler import PRIORITY_INTERACTIVE, VTScheduler
 import vt
 
-
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
-_VIRUSTOTAL_CLIENT: vt.Client | None = None
+_VT_KEY_POOL: VTKeyPool | None = None
+_URL_VERDICT_CACHE: VerdictCache | None = None
+_ANALYSIS_POLLER: AnalysisPoller | None = None
+_VT_SCHEDULER: VTScheduler | None = None
+_THREAT_INDEX: ThreatIndex | None = None
+_GROUP_SCANNER: GroupScanner | None = None
+
+_LINK_FLIGHTS = SingleFlight()
+_FILE_FLIGHTS = SingleFlight()
+register_metrics("vt_link_singleflight", _LINK_FLIGHTS.stats)
+register_metrics("vt_file_singleflight", _FILE_FLIGHTS.stats)
+
+T = TypeVar("T")
+
+VT_GUI_URL = "https://www.virustotal.com/gui"
+VT_SERVER_ERROR_CODES = ("TransientError", "DeadlineExceededError", "ServerError")
 
 
 async def setup_vt_client():
-    """Инициализирует асинхронный клиент VirusTotal."""
-    global _VIRUSTOTAL_CLIENT
-    if not _VIRUSTOTAL_CLIENT:
-        _VIRUSTOTAL_CLIENT = vt.Client(settings.VIRUSTOTAL_API_TOKEN, timeout=15)
-        logging.info("VirusTotal API client initialized.")
+    """Инициализирует пул ключей VirusTotal, планировщик запросов и опроса анализов."""
+    global _VT_KEY_POOL, _ANALYSIS_POLLER, _VT_SCHEDULER
+    if not _VT_KEY_POOL:
+        # vt-py закрывает коннектор вместе со своей сессией, поэтому у клиентов
+        # VirusTotal отдельный общий пул соединений с кэшем DNS.
+        connector = create_connector()
+        _VT_KEY_POOL = VTKeyPool(
+            [settings.VIRUSTOTAL_API_TOKEN, *settings.VIRUSTOTAL_API_TOKENS],
+            client_factory=lambda token: vt.Client(
+                token, timeout=settings.VT_REQUEST_TIMEOUT, connector=connector
+            ),
+            requests_per_minute=settings.VT_REQUESTS_PER_MINUTE,
+            requests_per_day=settings.VT_REQUESTS_PER_DAY,
+        )
+        register_metrics("vt_keys", _VT_KEY_POOL.stats)
+        for key in _VT_KEY_POOL.keys:
+            register_metrics(f"vt_key {key.name}", key.stats)
+        logging.info(
+            f"VirusTotal API clients initialized: {len(_VT_KEY_POOL.keys)} keys."
+        )
+    if not _VT_SCHEDULER:
+        guard = provider_guard(
+            "VirusTotal",
+            settings.VT_REQUEST_TIMEOUT,
+            min_timeout=3.0,
+            is_failure=_is_vt_failure,
+        )
+        _VT_SCHEDULER = VTScheduler(_VT_KEY_POOL, guard=guard)
+        register_metrics("vt_scheduler", _VT_SCHEDULER.stats)
+    if not _ANALYSIS_POLLER:
+        _ANALYSIS_POLLER = AnalysisPoller(
+            _fetch_analysis,
+            initial_delay=settings.VT_POLL_INITIAL_DELAY,
+            max_delay=settings.VT_POLL_MAX_DELAY,
+            timeout=settings.VT_ANALYSIS_TIMEOUT,
+        )
+        register_metrics("vt_analysis_poller", _ANALYSIS_POLLER.stats)
+
+
+def _is_vt_failure(error: Exception) -> bool:
+    # Ответы API вроде "файл не найден" или "квота исчерпана" означают, что
+    # VirusTotal работает; сбоем считаются сетевые ошибки и ошибки сервера.
+    if isinstance(error, vt.APIError):
+        return error.code in VT_SERVER_ERROR_CODES
+    return True
+
+
+async def _vt_call(
+    fn: Callable[[vt.Client], Awaitable[T]],
+    user_id: Hashable = None,
+    priority: int = PRIORITY_INTERACTIVE,
+    cost: float = 1.0,
+    timed: bool = True,
+) -> T:
+    """Выполняет запрос к VirusTotal через планировщик с учётом квоты."""
+    await setup_vt_client()
+    if _VT_SCHEDULER is None:
+        raise RuntimeError("VirusTotal scheduler not initialized.")
+    return await _VT_SCHEDULER.run(
+        fn, user_id=user_id, priority=priority, cost=cost, timed=timed
+    )
+
+
+async def _fetch_analysis(analysis_id: str) -> vt.Object:
+    return await _vt_call(
+        lambda client: client.get_object_async("/analyses/{}", analysis_id)
+    )
+
+
+def vt_queue_position(user_id: Hashable) -> Optional[int]:
+    """Позиция ближайшего запроса пользователя в очереди к VirusTotal."""
+    if _VT_SCHEDULER is None:
+        return None
+    return _VT_SCHEDULER.position(user_id)
+
+
+def vt_queue_wait(position: int) -> float:
+    """Примерное ожидание в секундах для позиции в очереди к VirusTotal."""
+    if _VT_SCHEDULER is None:
+        return 0.0
+    return _VT_SCHEDULER.estimated_wait(position)
+
+
+def vt_queue_size() -> int:
+    """Число запросов, ожидающих отправки в VirusTotal."""
+    if _VT_SCHEDULER is None:
+        return 0
+    return _VT_SCHEDULER.queue_size()
+
+
+def setup_group_scanner() -> GroupScanner:
+    """Открывает настройки пассивной проверки групп и их бюджеты запросов."""
+    global _GROUP_SCANNER
+    if not _GROUP_SCANNER:
+        _GROUP_SCANNER = GroupScanner(
+            os.path.join(settings.DATA_DIR, "group_scan.sqlite3"),
+            dedupe_window=settings.GROUP_SCAN_DEDUPE_WINDOW,
+            chat_requests_per_hour=settings.GROUP_SCAN_CHAT_REQUESTS_PER_HOUR,
+            chat_burst=settings.GROUP_SCAN_CHAT_BURST,
+            queue_soft_limit=settings.GROUP_SCAN_QUEUE_SOFT_LIMIT,
+            queue_hard_limit=settings.GROUP_SCAN_QUEUE_HARD_LIMIT,
+            queue_size=vt_queue_size,
+        )
+        _GROUP_SCANNER.open()
+        register_metrics("group_scanner", _GROUP_SCANNER.stats)
+    return _GROUP_SCANNER
+
+
+async def setup_url_verdict_cache():
+    """Открывает кэш вердиктов по ссылкам (память + SQLite)."""
+    global _URL_VERDICT_CACHE
+    if not _URL_VERDICT_CACHE:
+        _URL_VERDICT_CACHE = VerdictCache(
+            os.path.join(settings.DATA_DIR, "vt_verdicts.sqlite3"),
+            memory_size=settings.VT_CACHE_MEMORY_SIZE,
+            clean_ttl=settings.VT_CACHE_CLEAN_TTL,
+            malicious_ttl=settings.VT_CACHE_MALICIOUS_TTL,
+        )
+        await asyncio.to_thread(_URL_VERDICT_CACHE.open)
+        register_metrics("vt_url_cache", _URL_VERDICT_CACHE.stats)
 
 
 async def exit_vt_client():
-    """Закрывает асинхронный клиент VirusTotal."""
-    global _VIRUSTOTAL_CLIENT
-    if _VIRUSTOTAL_CLIENT:
-        await _VIRUSTOTAL_CLIENT.close_async()
-        _VIRUSTOTAL_CLIENT = None
-        logging.info("VirusTotal API client closed.")
+    """Закрывает клиенты VirusTotal, планировщики запросов и кэш вердиктов."""
+    global _VT_KEY_POOL, _URL_VERDICT_CACHE, _ANALYSIS_POLLER, _VT_SCHEDULER
+    global _GROUP_SCANNER
+    if _ANALYSIS_POLLER:
+        await _ANALYSIS_POLLER.stop()
+        _ANALYSIS_POLLER = None
+    if _VT_SCHEDULER:
+        await _VT_SCHEDULER.stop()
+        _VT_SCHEDULER = None
+    if _VT_KEY_POOL:
+        await _VT_KEY_POOL.close()
+        _VT_KEY_POOL = None
+        logging.info("VirusTotal API clients closed.")
+    if _URL_VERDICT_CACHE:
+        await asyncio.to_thread(_URL_VERDICT_CACHE.close)
+        _URL_VERDICT_CACHE = None
+    close_threat_index()
+    if _GROUP_SCANNER:
+        _GROUP_SCANNER.close()
+        _GROUP_SCANNER = None
 
 
-async def check_link(link: str) -> Tuple[str, Dict[str, int]]:
+def setup_threat_index():
+    """Открывает локальные индексы опасных и известных доменов."""
+    global _THREAT_INDEX
+    if not _THREAT_INDEX:
+        _THREAT_INDEX = ThreatIndex(
+            settings.THREAT_BLOCKLIST_PATH
+            or os.path.join(settings.DATA_DIR, "threat_blocklist.idx"),
+            settings.THREAT_ALLOWLIST_PATH
+            or os.path.join(settings.DATA_DIR, "threat_allowlist.idx"),
+        )
+        register_metrics("threat_index", _THREAT_INDEX.stats)
+
+
+def close_threat_index():
+    global _THREAT_INDEX
+    if _THREAT_INDEX:
+        _THREAT_INDEX.close()
+        _THREAT_INDEX = None
+
+
+def analysis_report_url(analysis_id: str) -> str:
+    return f"{VT_GUI_URL}/file-analysis/{analysis_id}"
+
+
+def file_report_url(sha256: str) -> str:
+    return f"{VT_GUI_URL}/file/{sha256}"
+
+
+class LinkVerdict(BaseModel):
+    link: str
+    source: Literal["local", "cache", "virustotal", "error"]
+    local_verdict: Optional[str] = None
+    report_url: Optional[str] = None
+    stats: Optional[Dict[str, int]] = None
+
+    @property
+    def is_dangerous(self) -> bool:
+        if self.local_verdict == "malicious":
+            return True
+        stats = self.stats or {}
+        return bool(stats.get("malicious", 0) or stats.get("suspicious", 0))
+
+
+def canonical_url(link: str) -> str:
+    """Приводит ссылку к единому виду: схема, регистр хоста, punycode, без якоря."""
+    return canonicalize_link(link) or link.strip()
+
+
+def get_local_link_verdict(link: str) -> Optional[str]:
     """
-    Сканирует ссылку на вредоносы в VirusTotal.
+    Мгновенный вердикт по локальным threat-фидам без обращения к VirusTotal:
+    "malicious", "clean" или None, если ссылка неизвестна.
     """
-    await setup_vt_client()
-    if _VIRUSTOTAL_CLIENT is None:
-        raise RuntimeError("VirusTotal client not initialized.")
+    setup_threat_index()
+    if _THREAT_INDEX is None:
+        return None
+    return _THREAT_INDEX.verdict(canonical_url(link))
 
+
+async def get_cached_link_verdict(link: str) -> Optional[Tuple[str, Dict[str, int]]]:
+    """Возвращает вердикт по ссылке из кэша, не обращаясь к VirusTotal."""
+    await setup_url_verdict_cache()
+    if _URL_VERDICT_CACHE is None:
+        return None
+    return await _URL_VERDICT_CACHE.get(vt.url_id(canonical_url(link)))
+
+
+async def submit_link(
+    link: str, user_id: Hashable = None, priority: int = PRIORITY_INTERACTIVE
+) -> str:
+    """Отправляет ссылку на анализ в VirusTotal и возвращает id анализа."""
     logging.info(f"Submitting link for analysis: {link}")
+    analysis = await _vt_call(
+        lambda client: client.scan_url_async(link), user_id, priority
+    )
+    return analysis.id
+
+
+async def wait_for_analysis(analysis_id: str) -> Dict[str, int]:
+    """Ждёт результат анализа через общий планировщик опроса."""
+    await setup_vt_client()
+    if _ANALYSIS_POLLER is None:
+        raise RuntimeError("VirusTotal analysis poller not initialized.")
+    return await _ANALYSIS_POLLER.wait(analysis_id)
+
 
+async def check_link(
+    link: str, user_id: Hashable = None, priority: int = PRIORITY_INTERACTIVE
+) -> Tuple[str, Dict[str, int]]:
+    """
+    Сканирует ссылку на вредоносы в VirusTotal.
+    Свежие вердикты берутся из кэша по идентификатору ссылки VirusTotal,
+    одновременные проверки одной ссылки объединяются в один запрос.
+    Возвращает ссылку на отчёт VirusTotal и статистику анализа.
+    """
+    link = canonical_url(link)
+    cached = await get_cached_link_verdict(link)
+    if cached is not None:
+        logging.info(f"URL verdict served from cache: {link}")
+        return cached
+
+    return await _LINK_FLIGHTS.do(
+        vt.url_id(link), lambda: _scan_link(link, user_id, priority)
+    )
+
+
+async def _scan_link(
+    link: str, user_id: Hashable, priority: int
+) -> Tuple[str, Dict[str, int]]:
     try:
-        analysis = await _VIRUSTOTAL_CLIENT.scan_url_async(
-            link, wait_for_completion=True
-        )
-        return analysis.id, analysis.stats  # type: ignore
+        analysis_id = await submit_link(link, user_id, priority)
+        stats = await wait_for_analysis(analysis_id)
+        report_url = analysis_report_url(analysis_id)
+        if _URL_VERDICT_CACHE is not None:
+            await _URL_VERDICT_CACHE.set(vt.url_id(link), report_url, stats)
+        return report_url, stats
 
     except vt.APIError as e:
         logging.error(f"VT URL submission failed: {e}")
         raise
 
 
-async def check_file(file_path: str) -> Tuple[str, Dict[str, Any]]:
+async def quick_link_verdict(link: str) -> Optional[LinkVerdict]:
+    """Вердикт по ссылке из локальных фидов или кэша, без запросов к VirusTotal."""
+    local_verdict = get_local_link_verdict(link)
+    if local_verdict:
+        return LinkVerdict(link=link, source="local", local_verdict=local_verdict)
+
+    cached = await get_cached_link_verdict(link)
+    if cached:
+        report_url, stats = cached
+        return LinkVerdict(
+            link=link, source="cache", report_url=report_url, stats=stats
+        )
+    return None
+
+
+async def check_links(
+    links: List[str],
+    user_id: Hashable = None,
+    priority: int = PRIORITY_INTERACTIVE,
+) -> List[LinkVerdict]:
     """
-    Сканирует файл на вредоносы в VirusTotal.
+    Проверяет несколько ссылок параллельно (не больше LINK_SCAN_CONCURRENCY
+    одновременно). Ошибка одной ссылки не прерывает проверку остальных.
     """
-    await setup_vt_client()
-    if _VIRUSTOTAL_CLIENT is None:
-        raise RuntimeError("VirusTotal client not initialized.")
+    semaphore = asyncio.Semaphore(settings.LINK_SCAN_CONCURRENCY)
 
-    if not os.path.exists(file_path):
-        raise FileNotFoundError(f"File not found: {file_path}")
+    async def check_one(link: str) -> LinkVerdict:
+        verdict = await quick_link_verdict(link)
+        if verdict:
+            return verdict
+
+        async with semaphore:
+            try:
+                report_url, stats = await check_link(link, user_id, priority)
+            except Exception as e:
+                logging.error(f"Link check failed for {link}: {e}")
+                return LinkVerdict(link=link, source="error")
+        return LinkVerdict(
+            link=link, source="virustotal", report_url=report_url, stats=stats
+        )
 
-    logging.info(f"Submitting file for analysis: {file_path}")
+    return list(await asyncio.gather(*(check_one(link) for link in links)))
 
+
+async def get_file_report(
+    sha256: str, user_id: Hashable = None, priority: int = PRIORITY_INTERACTIVE
+) -> Optional[Dict[str, int]]:
+    """
+    Ищет готовый отчёт VirusTotal по SHA-256 файла.
+    Возвращает статистику последнего анализа или None, если файл неизвестен.
+    """
     try:
-        with open(file_path, "rb") as file:
-            analysis = await _VIRUSTOTAL_CLIENT.scan_file_async(
-                file, wait_for_completion=True
-            )
-            print(analysis)
-            return analysis.id, analysis.stats  # type: ignore
+        file_object = await _vt_call(
+            lambda client: client.get_object_async("/files/{}", sha256),
+            user_id,
+            priority,
+        )
+    except vt.APIError as e:
+        if e.code == "NotFoundError":
+            return None
+        logging.error(f"VT file report lookup failed: {e}")
+        raise
+
+    return file_object.get("last_analysis_stats") or None
+
+
+async def check_file(
+    file: BinaryIO,
+    sha256: str,
+    user_id: Hashable = None,
+    priority: int = PRIORITY_INTERACTIVE,
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    Сканирует файл на вредоносы в VirusTotal.
+    Сначала ищет готовый отчёт по SHA-256 и загружает файл только при промахе,
+    одновременные проверки одного файла объединяются в один запрос.
+    Возвращает ссылку на отчёт VirusTotal и статистику анализа.
+    """
+    return await _FILE_FLIGHTS.do(
+        sha256, keep_open(file, lambda: _scan_file(file, sha256, user_id, priority))
+    )
+
+
+async def _scan_file(
+    file: BinaryIO, sha256: str, user_id: Hashable, priority: int
+) -> Tuple[str, Dict[str, Any]]:
+    try:
+        stats = await get_file_report(sha256, user_id, priority)
+        if stats is not None:
+            logging.info(f"VT file report found by hash: {sha256}")
+            return file_report_url(sha256), stats
+
+        logging.info(f"Submitting file for analysis: {sha256}")
+        return await upload_file(file, user_id, priority)
 
     except vt.APIError as e:
         logging.error(f"VT File upload failed: {e}")
@@ -77,3 +429,159 @@ async def check_file(file_path: str) -> Tuple[str, Dict[str, Any]]:
     except Exception as e:
         logging.error(f"An error occurred during file check: {e}")
         raise
+
+
+async def upload_file(
+    file: BinaryIO, user_id: Hashable = None, priority: int = PRIORITY_INTERACTIVE
+) -> Tuple[str, Dict[str, Any]]:
+    """Загружает файл в VirusTotal без поиска по хэшу и ждёт результат анализа."""
+
+    async def upload(client: vt.Client) -> vt.Object:
+        file.seek(0)
+        return await client.scan_file_async(file)
+
+    # Загрузка файла — это два запроса: получение upload_url и сам POST.
+    analysis = await _vt_call(upload, user_id, priority, cost=2, timed=False)
+
+    stats = await wait_for_analysis(analysis.id)
+    return analysis_report_url(analysis.id), stats
+
+
+class FileVerdict(BaseModel):
+    name: str
+    sha256: str
+    report_url: Optional[str] = None
+    stats: Optional[Dict[str, int]] = None
+
+    @property
+    def is_dangerous(self) -> bool:
+        stats = self.stats or {}
+        return bool(stats.get("malicious", 0) or stats.get("suspicious", 0))
+
+
+def _archive_limits() -> ArchiveLimits:
+    return ArchiveLimits(
+        max_members=settings.ARCHIVE_MAX_MEMBERS,
+        max_total_size=settings.ARCHIVE_MAX_TOTAL_SIZE,
+        max_ratio=settings.ARCHIVE_MAX_RATIO,
+        max_depth=settings.ARCHIVE_MAX_DEPTH,
+        tmp_dir=settings.TMP_DIR,
+    )
+
+
+async def check_archive(
+    file: BinaryIO,
+    sha256: str,
+    filename: str,
+    size: int,
+    user_id: Hashable = None,
+    priority: int = PRIORITY_INTERACTIVE,
+) -> List[FileVerdict]:
+    """
+    Проверяет архив (zip, tar.*) по содержимому.
+    Если VirusTotal уже знает сам архив — возвращает его отчёт. Иначе архив
+    распаковывается локально, хэши файлов ищутся в VirusTotal параллельно,
+    а загружаются только неизвестные файлы. Если неизвестных слишком много,
+    архив не разбирается или превышает лимиты распаковки, загружается архив
+    целиком. Возвращает вердикты по файлам архива (и по самому архиву,
+    если он загружался).
+    """
+    archive_stats = await get_file_report(sha256, user_id, priority)
+    if archive_stats is not None:
+        logging.info(f"VT file report found by hash: {sha256}")
+        return [
+            FileVerdict(
+                name=filename,
+                sha256=sha256,
+                report_url=file_report_url(sha256),
+                stats=archive_stats,
+            )
+        ]
+
+    limits = _archive_limits()
+    try:
+        members = await asyncio.to_thread(hash_archive_members, file, size, limits)
+    except (ArchiveBombError, UnsupportedArchiveError) as e:
+        logging.warning(f"Archive {sha256} is not unpacked: {e}")
+        members = []
+
+    # Одинаковые файлы внутри архива проверяем один раз.
+    by_hash: Dict[str, List[ArchiveMember]] = {}
+    for member in members:
+        by_hash.setdefault(member.sha256, []).append(member)
+
+    async def lookup(member_sha256: str) -> Optional[Dict[str, int]]:
+        try:
+            return await get_file_report(member_sha256, user_id, priority)
+        except Exception as e:
+            logging.error(f"VT report lookup failed for {member_sha256}: {e}")
+            return None
+
+    reports = dict(
+        zip(by_hash, await asyncio.gather(*(lookup(sha) for sha in by_hash)))
+    )
+
+    verdicts: List[FileVerdict] = []
+    unknown: List[ArchiveMember] = []
+    for member_sha256, same_members in by_hash.items():
+        stats = reports[member_sha256]
+        if stats is None:
+            # Содержимое разобранных вложенных архивов проверяется по файлам.
+            if not same_members[0].expanded:
+                unknown.append(same_members[0])
+            continue
+        verdicts.extend(
+            FileVerdict(
+                name=member.name,
+                sha256=member_sha256,
+                report_url=file_report_url(member_sha256),
+                stats=stats,
+            )
+            for member in same_members
+        )
+
+    if (
+        not members
+        or len(unknown) > settings.ARCHIVE_MAX_UPLOADS
+        or any(member.size > settings.VT_MAX_FILE_SIZE for member in unknown)
+    ):
+        logging.info(f"Submitting whole archive for analysis: {sha256}")
+        report_url, stats = await _FILE_FLIGHTS.do(
+            sha256, keep_open(file, lambda: upload_file(file, user_id, priority))
+        )
+        verdicts.append(
+            FileVerdict(
+                name=filename, sha256=sha256, report_url=report_url, stats=stats
+            )
+        )
+        return verdicts
+
+    # Все извлечения читают один файл архива и двигают его позицию,
+    # поэтому идут по очереди; загрузки в VirusTotal — параллельно.
+    extract_lock = asyncio.Lock()
+
+    async def upload_member(member: ArchiveMember) -> List[FileVerdict]:
+        logging.info(f"Submitting archive member for analysis: {member.sha256}")
+        async with extract_lock:
+            member_file = await asyncio.to_thread(
+                extract_member, file, member.path, limits
+            )
+        try:
+            report_url, stats = await _FILE_FLIGHTS.do(
+                member.sha256,
+                keep_open(
+                    member_file, lambda: upload_file(member_file, user_id, priority)
+                ),
+            )
+        finally:
+            member_file.close()
+        return [
+            FileVerdict(
+                name=same.name, sha256=member.sha256, report_url=report_url, stats=stats
+            )
+            for same in by_hash[member.sha256]
+        ]
+
+    for uploaded in await asyncio.gather(*(upload_member(m) for m in unknown)):
+        verdicts.extend(uploaded)
+    return verdicts